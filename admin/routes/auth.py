@@ -1,7 +1,7 @@
 # auth/routes.py
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 
-from auth.utils import generate_otp, send_sms_otp
+from auth.utils import generate_otp, queue_sms_otp
 from models.models import db, User, OTP
 from datetime import datetime
 
@@ -69,10 +69,10 @@ def send_otp():
     )
 
     db.session.add(new_otp)
-    db.session.commit()
 
-    # Send OTP (implement your SMS sending logic)
-    send_sms_otp(mobile, otp)  # Your SMS sending function
+    # Send OTP from a job worker, queued with the OTP itself
+    queue_sms_otp(mobile, otp)
+    db.session.commit()
 
     return jsonify({'message': 'OTP sent successfully'})
 
@@ -1,11 +1,14 @@
 # admin/routes/claims.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app
 
 from auth.utils import admin_required
 from models.models import db, Claim, Transaction
 from sqlalchemy import desc
 from datetime import datetime, timedelta
 
+from services import bulk_import, claim_matcher, claims_book, state_machine
+from services.search import search_claims
+
 admin_claims_bp = Blueprint('admin_claims', __name__)
 
 
@@ -22,11 +25,7 @@ def claims_list(current_user):
     if status:
         query = query.filter(Claim.status == status)
     if search:
-        query = query.filter(
-            (Claim.bank_name.ilike(f'%{search}%')) |
-            (Claim.account_number.ilike(f'%{search}%')) |
-            (Claim.account_holder.ilike(f'%{search}%'))
-        )
+        query = search_claims(query, search)
 
     claims = query.order_by(desc(Claim.created_at)).paginate(
         page=page, per_page=per_page
@@ -66,6 +65,34 @@ def add_claim(current_user):
     return render_template('admin/claims/add.html')
 
 
+@admin_claims_bp.route('/claims/import', methods=['GET', 'POST'])
+@admin_required
+def import_claims(current_user):
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to import', 'error')
+        else:
+            try:
+                result = bulk_import.import_claims(upload.stream, dry_run=request.form.get('dry_run') == 'on')
+                flash(f"{result['imported']} of {result['total']} rows imported",
+                      'warning' if result['errors'] else 'success')
+            except bulk_import.InvalidUpload as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Claims import error: {str(e)}")
+                flash(f'Failed to import claims: {str(e)}', 'error')
+
+    return render_template('admin/import.html',
+                           title='Import Claims',
+                           columns=bulk_import.CLAIM_COLUMNS,
+                           result=result,
+                           back_url=url_for('admin_claims.claims_list')
+                           )
+
+
 @admin_claims_bp.route('/claims/<int:claim_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def edit_claim(current_user, claim_id):
@@ -74,7 +101,7 @@ def edit_claim(current_user, claim_id):
     if request.method == 'POST':
         try:
             # Only allow editing if claim is not in use
-            if claim.status not in ['CLAIMED', 'COMPLETED']:
+            if claim.status not in ['CLAIMED', 'COMPLETED', 'SPLIT']:
                 claim.bank_name = request.form['bank_name']
                 claim.account_number = request.form['account_number']
                 claim.ifsc_code = request.form['ifsc_code']
@@ -101,10 +128,13 @@ def update_claim_status(current_user, claim_id):
 
     try:
         # Only allow status update if claim is not in use
-        if claim.status not in ['CLAIMED', 'COMPLETED']:
-            claim.is_active = new_status
-            if not new_status:
-                claim.status = 'DISABLED'
+        if claim.status not in ['CLAIMED', 'COMPLETED', 'SPLIT']:
+            if not new_status and claim.status != 'DISABLED':
+                state_machine.transition(claim, 'DISABLED', is_active=False)
+            elif new_status and claim.status == 'DISABLED':
+                state_machine.transition(claim, 'AVAILABLE', is_active=True)
+            else:
+                claim.is_active = new_status
             db.session.commit()
             return jsonify({'success': True})
         return jsonify({'success': False, 'message': 'Cannot update status of claim in current state'})
@@ -114,6 +144,33 @@ def update_claim_status(current_user, claim_id):
         return jsonify({'success': False, 'message': str(e)})
 
 
+@admin_claims_bp.route('/claims/<int:claim_id>/split', methods=['POST'])
+@admin_required
+def split_claim(current_user, claim_id):
+    claim = Claim.query.get_or_404(claim_id)
+
+    try:
+        pieces = claim_matcher.split_claim(
+            claim, float(request.form['piece_amount']),
+            current_app.config['MIN_BUY_INR'], current_app.config['MAX_BUY_INR'])
+        db.session.commit()
+        claims_book.invalidate()
+        flash(f'Claim split into {len(pieces)} claims', 'success')
+
+    except (state_machine.IllegalTransition, ValueError) as e:
+        db.session.rollback()
+        flash(f'Cannot split claim: {str(e)}', 'error')
+    except state_machine.ConcurrentUpdate:
+        db.session.rollback()
+        flash('Claim was changed by another request, try again', 'error')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Claim split error: {str(e)}")
+        flash(f'Failed to split claim: {str(e)}', 'error')
+
+    return redirect(url_for('admin_claims.claim_details', claim_id=claim_id))
+
+
 @admin_claims_bp.route('/claims/<int:claim_id>/details')
 @admin_required
 def claim_details(current_user, claim_id):
@@ -123,8 +180,10 @@ def claim_details(current_user, claim_id):
     transactions = Transaction.query.filter_by(
         claim_id=claim_id
     ).order_by(Transaction.created_at.desc()).all()
+    pieces = Claim.query.filter_by(parent_id=claim_id).order_by(Claim.id).all()
 
     return render_template('admin/claims/details.html',
                            claim=claim,
-                           transactions=transactions
+                           transactions=transactions,
+                           pieces=pieces
                            )
\ No newline at end of file
@@ -0,0 +1,17 @@
+# admin/routes/jobs.py
+from flask import Blueprint, jsonify
+
+from auth.utils import admin_required
+from models.models import db, Job
+from services import jobs
+
+admin_jobs_bp = Blueprint('admin_jobs', __name__)
+
+
+@admin_jobs_bp.route('/<int:job_id>')
+@admin_required
+def job_status(current_user, job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.to_dict(job))
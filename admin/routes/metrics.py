@@ -0,0 +1,51 @@
+# admin/routes/metrics.py
+from datetime import datetime
+
+from flask import Blueprint, render_template, jsonify, request, current_app
+
+from auth.utils import admin_required
+from services import platform_metrics, scheduler_stats, sql_profiler
+
+admin_metrics_bp = Blueprint('admin_metrics', __name__)
+
+
+@admin_metrics_bp.route('/')
+@admin_required
+def overview(current_user):
+    metrics = platform_metrics.get_metrics()
+
+    refreshed_at = metrics.get('metrics.refreshed_at')
+
+    return render_template('admin/metrics/overview.html',
+                           metrics=metrics,
+                           volumes=platform_metrics.volume_breakdown(metrics),
+                           top_referrers=platform_metrics.get_payload(platform_metrics.REFERRAL_TOP_REFERRERS, []),
+                           scheduled_jobs=scheduler_stats.summary(metrics),
+                           refreshed_at=datetime.utcfromtimestamp(refreshed_at) if refreshed_at else None)
+
+
+@admin_metrics_bp.route('/scheduler')
+@admin_required
+def scheduler(current_user):
+    """Per job run statistics of the scheduled jobs, for polling and alerting"""
+    rows = scheduler_stats.summary()
+    for row in rows:
+        row['last_run_at'] = row['last_run_at'].isoformat() if row['last_run_at'] else None
+        row['buckets'] = dict(row['buckets'])
+    return jsonify({'jobs': rows})
+
+
+@admin_metrics_bp.route('/sql')
+@admin_required
+def sql_profiles(current_user):
+    """Requests recorded by the SQL profiler in this process, newest first; ?flagged=1 for N+1 and slow ones"""
+    profiles = sql_profiler.recent()
+    flagged = request.args.get('flagged') == '1'
+    if flagged:
+        profiles = [profile for profile in profiles if profile['repeated'] or profile['slow']]
+    return render_template('admin/metrics/sql_profiles.html',
+                           profiles=profiles,
+                           flagged=flagged,
+                           enabled=current_app.config['SQL_PROFILER'],
+                           repeat_threshold=current_app.config['SQL_PROFILER_REPEAT_THRESHOLD'],
+                           slow_ms=current_app.config['SQL_PROFILER_SLOW_MS'])
@@ -1,10 +1,12 @@
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app
 
 from auth.utils import admin_required
 from models.models import db, ExchangeRate, PaymentMode
 from sqlalchemy import desc
 from datetime import datetime
 
+from services import bulk_import
+
 admin_rates_bp = Blueprint('admin_rates', __name__)
 
 
@@ -76,6 +78,34 @@ def add_rate(current_user,):
                            )
 
 
+@admin_rates_bp.route('/rates/import', methods=['GET', 'POST'])
+@admin_required
+def import_rates(current_user):
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to import', 'error')
+        else:
+            try:
+                result = bulk_import.import_rates(upload.stream, dry_run=request.form.get('dry_run') == 'on')
+                flash(f"{result['imported']} of {result['total']} rows imported",
+                      'warning' if result['errors'] else 'success')
+            except bulk_import.InvalidUpload as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Rates import error: {str(e)}")
+                flash(f'Failed to import rates: {str(e)}', 'error')
+
+    return render_template('admin/import.html',
+                           title='Import Rate Slabs',
+                           columns=bulk_import.RATE_COLUMNS,
+                           result=result,
+                           back_url=url_for('admin_rates.rates_list')
+                           )
+
+
 @admin_rates_bp.route('/rates/<int:rate_id>/edit', methods=['GET', 'POST'])
 @admin_required
 def edit_rate(current_user, rate_id):
@@ -6,6 +6,9 @@ from models.models import db, User, ReferralCommission, ReferralEarning, Transac
 from sqlalchemy import func
 from datetime import datetime, timedelta
 
+from referral.utils import get_referral_tree
+from services import platform_metrics, referrals
+
 referral_admin_bp = Blueprint('admin_referral', __name__)
 
 
@@ -13,9 +16,7 @@ referral_admin_bp = Blueprint('admin_referral', __name__)
 @admin_required
 def dashboard(current_user):
     # Get overall statistics
-    total_earnings = db.session.query(
-        func.sum(ReferralEarning.amount_usdt)
-    ).scalar() or 0
+    total_earnings = platform_metrics.get_metric(platform_metrics.REFERRAL_PAYOUT_USDT)
 
     # Get commission rates
     commission_rates = ReferralCommission.query.order_by(ReferralCommission.level).all()
@@ -25,17 +26,8 @@ def dashboard(current_user):
         ReferralEarning.created_at.desc()
     ).limit(10).all()
 
-    # Get top referrers
-    top_referrers = db.session.query(
-        User,
-        func.count(User.id).label('referral_count'),
-        func.sum(ReferralEarning.amount_usdt).label('total_earnings')
-    ).join(
-        ReferralEarning,
-        User.id == ReferralEarning.user_id
-    ).group_by(User.id).order_by(
-        func.sum(ReferralEarning.amount_usdt).desc()
-    ).limit(5).all()
+    # Get top referrers, refreshed by the metrics job
+    top_referrers = platform_metrics.get_payload(platform_metrics.REFERRAL_TOP_REFERRERS, [])
 
     return render_template('admin/referrals/dashboard.html',
                            total_earnings=total_earnings,
@@ -76,6 +68,7 @@ def add_commission(current_user):
 
         db.session.add(commission)
         db.session.commit()
+        referrals.invalidate_commission_levels()
 
         flash('Commission rate added successfully', 'success')
         return redirect(url_for('admin_referral.commission_rates'))
@@ -97,6 +90,7 @@ def edit_commission(current_user, commission_id):
         commission.is_active = bool(request.form.get('is_active'))
 
         db.session.commit()
+        referrals.invalidate_commission_levels()
         return jsonify({'success': True})
 
     except ValueError:
@@ -150,24 +144,17 @@ def earnings(current_user):
 @admin_required
 def referral_tree(current_user, user_id):
     user = User.query.get_or_404(user_id)
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 50, type=int), 100))
+    max_levels = request.args.get('max_levels', type=int)
 
-    # Get direct referrals
-    direct_referrals = User.query.filter_by(referred_by=user_id).all()
-
-    # Get earnings data
-    earnings_data = db.session.query(
-        User.id,
-        func.sum(ReferralEarning.amount_usdt).label('total_earnings')
-    ).join(
-        ReferralEarning,
-        User.id == ReferralEarning.user_id
-    ).filter(
-        User.id.in_([r.id for r in direct_referrals])
-    ).group_by(User.id).all()
-
-    earnings_map = {user_id: total for user_id, total in earnings_data}
+    # Whole downline under one page of direct referrals
+    tree = get_referral_tree(user_id, max_levels=max_levels, page=page, per_page=per_page)
+    pages = max(1, -(-tree['total_direct'] // per_page))
 
     return render_template('admin/referrals/tree.html',
                            user=user,
-                           referrals=direct_referrals,
-                           earnings_map=earnings_map)
\ No newline at end of file
+                           tree=tree,
+                           page=page,
+                           per_page=per_page,
+                           pages=pages)
\ No newline at end of file
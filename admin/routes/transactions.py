@@ -1,11 +1,14 @@
 # admin/routes/transactions.py
-from flask import Blueprint, render_template, request, jsonify, flash
+from flask import Blueprint, render_template, request, jsonify, flash, current_app
 
 from auth.utils import admin_required
-from models.models import db, Transaction, TransactionType, TransactionStatus, Claim, PaymentMode, ReferralCommission, \
-    ReferralEarning, User
+from models.models import db, Transaction, TransactionType, TransactionStatus, PaymentMode
 from sqlalchemy import desc
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from services import approvals, state_machine
+from services.export import build_export_query, export_response
+from transaction.utils import TransactionUtil
 
 admin_transactions_bp = Blueprint('admin_transactions', __name__)
 
@@ -23,21 +26,7 @@ def transactions_list(current_user):
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
 
-    query = Transaction.query.join(Transaction.user)
-
-    if tx_type:
-        query = query.filter(Transaction.transaction_type == TransactionType(tx_type))
-    if status:
-        query = query.filter(Transaction.status == TransactionStatus(status))
-    if search:
-        query = query.filter(
-            (Transaction.rupal_id.like(f'%{search}%')) |
-            (Transaction.user.has(mobile=search))
-        )
-    if date_from:
-        query = query.filter(Transaction.created_at >= datetime.strptime(date_from, '%Y-%m-%d'))
-    if date_to:
-        query = query.filter(Transaction.created_at < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+    query = TransactionUtil.apply_filters(Transaction.query.join(Transaction.user), request.args)
 
     transactions = query.order_by(desc(Transaction.created_at)).paginate(
         page=page, per_page=per_page
@@ -55,6 +44,19 @@ def transactions_list(current_user):
                            )
 
 
+@admin_transactions_bp.route('/transactions/export')
+@admin_required
+def transactions_export(current_user):
+    export_format = request.args.get('format', 'csv')
+
+    try:
+        query = TransactionUtil.apply_filters(build_export_query(), request.args)
+        filename = f"transactions_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+        return export_response(query, export_format, filename)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+
 @admin_transactions_bp.route('/transactions/<int:transaction_id>')
 @admin_required
 def transaction_detail(current_user, transaction_id):
@@ -124,86 +126,65 @@ def update_transaction_status(transaction_id):
         return jsonify({'success': False, 'message': 'Invalid status'}), 400
 
     try:
-        with db.session.begin_nested():  # Use nested transaction for atomicity
-            old_status = transaction.status
-            transaction.status = TransactionStatus(new_status)
+        if transaction.status == TransactionStatus(new_status):
             transaction.admin_notes = admin_notes
-
+        else:
+            values = {'admin_notes': admin_notes}
             if new_status == 'COMPLETED':
-                transaction.completed_at = datetime.utcnow()
-
-                # Handle claim if exists
-                if transaction.claim_id:
-                    claim = Claim.query.get(transaction.claim_id)
-                    claim.status = 'COMPLETED'
-
-                # Update user balance and process referral earnings for buy transactions
-                if transaction.transaction_type == TransactionType.BUY:
-                    transaction.user.wallet_balance += transaction.amount_usdt
-                    process_referral_earnings(transaction, "buy")
-                elif transaction.transaction_type == TransactionType.SELL:
-                    process_referral_earnings(transaction, "sell")
-
-            elif new_status == 'CANCELLED':
-                # Refund for sell transactions
-                if transaction.transaction_type == TransactionType.SELL:
-                    transaction.user.wallet_balance += transaction.amount_usdt
-
-                # Release claim if exists
-                if transaction.claim_id:
-                    claim = Claim.query.get(transaction.claim_id)
-                    claim.status = 'AVAILABLE'
-                    claim.claimed_by = None
-                    claim.claimed_at = None
-                    claim.expires_at = None
+                values['completed_at'] = datetime.utcnow()
+            state_machine.transition(transaction, new_status, **values)
 
         db.session.commit()
         flash(f'Transaction status updated to {new_status}', 'success')
         return jsonify({'success': True})
 
+    except state_machine.IllegalTransition as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except state_machine.ConcurrentUpdate:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Transaction was updated by someone else, reload and retry'}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
-def process_referral_earnings(transaction, transaction_type):
-    """Processes referral earnings for a given transaction."""
-    user = transaction.user
-    referral_levels = ReferralCommission.query.filter_by(is_active=True).order_by(ReferralCommission.level.asc()).all()
-
-    if not user or not referral_levels:
-        return
-
-    current_referee = None
-    if user.referred_by:
-        current_referee = User.query.get(user.referred_by)  # Assuming `referrer` is a relationship or FK to the referring user
-
-    level = 1
-
-    while current_referee and level <= len(referral_levels):
-        referral_commission = referral_levels[level - 1]
-
-        if transaction.amount_usdt >= referral_commission.min_amount_usdt:
-            commission_percent = (
-                referral_commission.buy_commission_percent if transaction_type == "buy" else referral_commission.sell_commission_percent
-            )
-            commission_amount = (transaction.amount_usdt * commission_percent) / 100
-
-            if commission_amount > 0:
-                # Create ReferralEarning record
-                referral_earning = ReferralEarning(
-                    user_id=current_referee.id,
-                    transaction_id=transaction.id,
-                    referral_level=level,
-                    amount_usdt=commission_amount,
-                    commission_percent=commission_percent
-                )
-                db.session.add(referral_earning)
+@admin_transactions_bp.route('/transactions/bulk-update-status', methods=['POST'])
+@admin_required
+def bulk_update_transaction_status(current_user):
+    """
+    Complete or cancel many transactions at once
+    Request: {
+        "ids": [101, 102, 103],
+        "status": "COMPLETED" or "CANCELLED",
+        "admin_notes": "" (optional)
+    }
+    """
+    data = request.get_json(silent=True) or {}
+    transaction_ids = data.get('ids')
+    new_status = data.get('status')
+
+    if not isinstance(transaction_ids, list) or not transaction_ids:
+        return jsonify({'success': False, 'message': 'ids must be a non-empty list'}), 400
+    try:
+        transaction_ids = [int(transaction_id) for transaction_id in transaction_ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'ids must be transaction ids'}), 400
+    max_ids = current_app.config['BULK_STATUS_MAX_IDS']
+    if len(transaction_ids) > max_ids:
+        return jsonify({'success': False, 'message': f'At most {max_ids} transactions at once'}), 400
+    if new_status not in [status.value for status in approvals.BULK_STATUSES]:
+        return jsonify({'success': False, 'message': 'Invalid status'}), 400
 
-                # Update referrer's wallet balance
-                current_referee.wallet_balance += commission_amount
+    try:
+        results = approvals.bulk_update_status(transaction_ids, new_status, data.get('admin_notes'))
+        updated = sum(1 for result in results if result['success'])
+        return jsonify({'success': True, 'updated': updated, 'results': results})
 
-        # Move up to the next referral level
-        if current_referee.referred_by:
-            current_referee = User.query.get(current_referee.referred_by)
-        level += 1
+    except state_machine.ConcurrentUpdate as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Bulk status update error: {str(e)}")
+        return jsonify({'success': False, 'message': str(e)}), 500
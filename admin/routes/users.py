@@ -1,11 +1,13 @@
 # admin/routes/users.py
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, current_app
 
 from auth.utils import admin_required
-from models.models import db, User, UserStatus, Transaction, TransactionType, TransactionStatus
+from models.models import db, User, UserStatus, Transaction, TransactionType, TransactionStatus, UserVolumeRollup, Job
 from sqlalchemy import desc
 from datetime import datetime
 
+from services import ledger, balance_adjustments, bulk_import, jobs, state_machine
+from services.search import search_users
 from transaction.utils import TransactionUtil
 
 admin_users_bp = Blueprint('admin_users', __name__)
@@ -22,10 +24,7 @@ def users_list(current_user):
     query = User.query
 
     if search:
-        query = query.filter(
-            (User.mobile.like(f'%{search}%')) |
-            (User.name.like(f'%{search}%'))
-        )
+        query = search_users(query, search)
 
     if status:
         query = query.filter(User.status == UserStatus(status))
@@ -42,6 +41,45 @@ def users_list(current_user):
                            )
 
 
+@admin_users_bp.route('/users/balance-adjustments', methods=['GET', 'POST'])
+@admin_required
+def balance_adjustments_upload(current_user):
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to upload', 'error')
+            return redirect(url_for('admin_users.balance_adjustments_upload'))
+        try:
+            rows, errors = balance_adjustments.parse(upload.stream)
+            if not rows:
+                flash(f'No adjustments to apply, {len(errors)} rows with errors', 'error')
+                return render_template('admin/users/balance_adjustments.html',
+                                       columns=balance_adjustments.COLUMNS,
+                                       job=None,
+                                       errors=errors,
+                                       recent=[])
+            job = balance_adjustments.start(rows, errors, created_by=current_user.id)
+            flash(f'Applying {len(rows)} adjustments in the background', 'success')
+            return redirect(url_for('admin_users.balance_adjustments_upload', job_id=job.id))
+        except bulk_import.InvalidUpload as e:
+            flash(str(e), 'error')
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Balance adjustments error: {str(e)}")
+            flash(f'Failed to start balance adjustments: {str(e)}', 'error')
+        return redirect(url_for('admin_users.balance_adjustments_upload'))
+
+    job_id = request.args.get('job_id', type=int)
+    job = db.session.get(Job, job_id) if job_id else None
+    recent = Job.query.filter_by(kind=balance_adjustments.KIND).order_by(desc(Job.id)).limit(10).all()
+
+    return render_template('admin/users/balance_adjustments.html',
+                           columns=balance_adjustments.COLUMNS,
+                           job=jobs.to_dict(job) if job else None,
+                           errors=None,
+                           recent=recent)
+
+
 @admin_users_bp.route('/users/<int:user_id>')
 @admin_required
 def user_detail(current_user, user_id):
@@ -49,12 +87,19 @@ def user_detail(current_user, user_id):
     transactions = Transaction.query.filter_by(user_id=user_id) \
         .order_by(desc(Transaction.created_at)).limit(10).all()
 
+    # Completed volumes come from the user's daily rollups rather than their transaction history
+    volumes = dict(db.session.query(
+        UserVolumeRollup.transaction_type,
+        db.func.sum(UserVolumeRollup.volume_usdt)
+    ).filter(
+        UserVolumeRollup.user_id == user_id,
+        UserVolumeRollup.transaction_type.in_([TransactionType.BUY, TransactionType.SELL])
+    ).group_by(UserVolumeRollup.transaction_type).all())
+
     stats = {
         'total_transactions': Transaction.query.filter_by(user_id=user_id).count(),
-        'total_buy_amount': db.session.query(db.func.sum(Transaction.amount_usdt)) \
-                                .filter_by(user_id=user_id, transaction_type='BUY', status='COMPLETED').scalar() or 0,
-        'total_sell_amount': db.session.query(db.func.sum(Transaction.amount_usdt)) \
-                                 .filter_by(user_id=user_id, transaction_type='SELL', status='COMPLETED').scalar() or 0
+        'total_buy_amount': volumes.get(TransactionType.BUY) or 0,
+        'total_sell_amount': volumes.get(TransactionType.SELL) or 0
     }
 
     return render_template('admin/users/details.html',
@@ -100,14 +145,12 @@ def update_balance(current_user, user_id):
             return redirect(url_for('admin_users.user_detail', user_id=user_id))
 
         if operation == 'add':
-            user.wallet_balance += amount
             action = 'added to'
             transaction_type = TransactionType.ADMIN_ADD
         elif operation == 'subtract':
             if user.wallet_balance < amount:
                 flash('Insufficient balance', 'error')
                 return redirect(url_for('admin_users.user_detail', user_id=user_id))
-            user.wallet_balance -= amount
             action = 'subtracted from'
             transaction_type = TransactionType.ADMIN_SUB
         else:
@@ -127,16 +170,27 @@ def update_balance(current_user, user_id):
         )
 
         db.session.add(transaction)
+
+        if transaction_type == TransactionType.ADMIN_ADD:
+            ledger.credit(user.id, amount, transaction_type.value, transaction=transaction, note=reason)
+        else:
+            ledger.debit(user.id, amount, transaction_type.value, transaction=transaction, note=reason)
+
+        state_machine.publish_completed([transaction])
         db.session.commit()
 
         flash(f'{amount} USDT {action} wallet balance successfully', 'success')
         return redirect(url_for('admin_users.user_detail', user_id=user_id))
 
+    except ledger.InsufficientBalance:
+        db.session.rollback()
+        flash('Insufficient balance', 'error')
+        return redirect(url_for('admin_users.user_detail', user_id=user_id))
     except ValueError:
         flash('Invalid amount format', 'error')
         return redirect(url_for('admin_users.user_detail', user_id=user_id))
     except Exception as e:
         db.session.rollback()
-        print(e)
+        current_app.logger.error(f"Update balance error: {str(e)}", exc_info=True)
         flash('Failed to update balance', 'error')
         return redirect(url_for('admin_users.user_detail', user_id=user_id))
\ No newline at end of file
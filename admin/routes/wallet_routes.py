@@ -1,10 +1,12 @@
 # admin/wallet_routes.py
-from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
+from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify, current_app
 
 from auth.utils import admin_required
 from models.models import db, PooledWallet, WalletAssignment, WalletStatus, User
 from datetime import datetime
 
+from services import bulk_import
+
 wallet_bp = Blueprint('wallet', __name__, url_prefix='/admin/wallets')
 
 
@@ -63,6 +65,35 @@ def add_wallet(current_user):
     return render_template('admin/wallets/add.html')
 
 
+@wallet_bp.route('/import', methods=['GET', 'POST'])
+@admin_required
+def import_wallets(current_user):
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV file to import', 'error')
+        else:
+            try:
+                result = bulk_import.import_wallets(upload.stream, current_user.id,
+                                                  dry_run=request.form.get('dry_run') == 'on')
+                flash(f"{result['imported']} of {result['total']} rows imported",
+                      'warning' if result['errors'] else 'success')
+            except bulk_import.InvalidUpload as e:
+                flash(str(e), 'error')
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Wallets import error: {str(e)}")
+                flash(f'Failed to import wallets: {str(e)}', 'error')
+
+    return render_template('admin/import.html',
+                           title='Import Wallets',
+                           columns=bulk_import.WALLET_COLUMNS,
+                           result=result,
+                           back_url=url_for('wallet.list_wallets')
+                           )
+
+
 @wallet_bp.route('/<int:wallet_id>/status', methods=['POST'])
 @admin_required
 def update_status(current_user, wallet_id):
@@ -1,9 +1,12 @@
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 
 from admin.routes.auth import admin_auth_bp
 from admin.routes.claims import admin_claims_bp
+from admin.routes.jobs import admin_jobs_bp
+from admin.routes.metrics import admin_metrics_bp
 from admin.routes.rates import admin_rates_bp
 from admin.routes.referrals import referral_admin_bp
 from admin.routes.settings import settings_bp
@@ -12,82 +15,197 @@ from admin.routes.users import admin_users_bp
 from admin.routes.wallet_routes import wallet_bp
 from config import Config
 from models import db
-import logging
-from logging.handlers import RotatingFileHandler
+from models.schema import ensure_columns, ensure_indexes
 import os
 import atexit
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from services.wallet_pool import cleanup_expired_claims, DepositMonitor
+from services.ledger import take_snapshots
+from services.platform_metrics import refresh_gauges
+from services.referrals import reconcile_stats
+from services.claim_expiry import release_expired_claims
+from services.jobs import start_workers
+from services import leases, log_pipeline, scheduler_stats, sql_profiler, telemetry
+from services.wallet_pool import DepositMonitor
 from web.routes import web_bp
 
 
 def setup_logging(app):
-    """Configure application logging"""
+    """Configure application logging: JSON lines written off the calling thread, see services/log_pipeline.py"""
+    log_pipeline.init_app(app)
     if not app.debug and not app.testing:
-        if not os.path.exists('logs'):
-            os.mkdir('logs')
-
-        file_handler = RotatingFileHandler(
-            'logs/crypto_platform.log',
-            maxBytes=10240,
-            backupCount=10
-        )
-        file_handler.setFormatter(logging.Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-        ))
-        file_handler.setLevel(logging.INFO)
-        app.logger.addHandler(file_handler)
-        app.logger.setLevel(logging.INFO)
+        log_pipeline.setup(app)
         app.logger.info('Crypto Platform startup')
 
 
 def setup_schedulers(app):
-    """Initialize and configure all schedulers"""
+    """
+    Initialize and configure all schedulers. Every job is a singleton: it only
+    does its work in the process holding its lease, see services/leases.py.
+    Its runs are recorded by services/scheduler_stats.py
+    """
     schedulers = []
 
+    def singleton(name, fn, lease_seconds):
+        return leases.singleton(app, name, scheduler_stats.instrument(name, fn), lease_seconds)
+
     # Wallet monitoring scheduler
     wallet_scheduler = BackgroundScheduler(timezone='UTC')
-    monitor = DepositMonitor()
-
-    def monitor_with_context():
-        with app.app_context():
-            monitor.monitor_active_assignments()
+    with app.app_context():
+        monitor = DepositMonitor()
 
     wallet_scheduler.add_job(
-        monitor_with_context,
+        singleton('deposit_monitor', monitor.monitor_active_assignments, lease_seconds=30),
         'interval',
         seconds=5,
+        id='deposit_monitor',
         max_instances=1
     )
 
-    # Claims monitoring scheduler
-    def cleanup_with_context():
-        with app.app_context():
-            cleanup_expired_claims()
-
+    # Claims expiry scheduler; ticks are free unless a claim is due
     claims_scheduler = BackgroundScheduler(timezone='UTC')
     claims_scheduler.add_job(
-        cleanup_with_context,
+        singleton('claim_expiry', release_expired_claims,
+                  lease_seconds=max(30, 2 * app.config['CLAIM_EXPIRY_TICK_SECONDS'])),
         'interval',
-        seconds=5,
+        seconds=app.config['CLAIM_EXPIRY_TICK_SECONDS'],
+        id='claim_expiry',
+        max_instances=1
+    )
+
+    # Platform metrics scheduler
+    metrics_scheduler = BackgroundScheduler(timezone='UTC')
+    metrics_scheduler.add_job(
+        singleton('metrics_refresh', refresh_gauges,
+                  lease_seconds=2 * app.config['METRICS_REFRESH_SECONDS']),
+        'interval',
+        seconds=app.config['METRICS_REFRESH_SECONDS'],
+        id='metrics_refresh',
+        max_instances=1
+    )
+
+    # Referral counters reconciliation scheduler
+    def reconcile_referrals():
+        try:
+            corrected = reconcile_stats()
+            app.logger.info(f"Referral stats reconciled, {corrected} rows corrected")
+        except Exception as e:
+            db.session.rollback()
+            scheduler_stats.count('failures')
+            app.logger.error(f"Referral stats reconciliation error: {str(e)}")
+
+    referral_scheduler = BackgroundScheduler(timezone='UTC')
+    referral_scheduler.add_job(
+        singleton('referral_reconcile', reconcile_referrals, lease_seconds=3600),
+        'cron',
+        hour=app.config['REFERRAL_STATS_RECONCILE_HOUR'],
+        id='referral_reconcile',
+        max_instances=1
+    )
+
+    # Balance snapshot scheduler
+    def snapshot_balances():
+        try:
+            written, drifted = take_snapshots()
+            if drifted:
+                app.logger.warning(f"Balance snapshots: {written} written, {drifted} with drift")
+        except Exception as e:
+            db.session.rollback()
+            scheduler_stats.count('failures')
+            app.logger.error(f"Balance snapshot error: {str(e)}")
+
+    ledger_scheduler = BackgroundScheduler(timezone='UTC')
+    ledger_scheduler.add_job(
+        singleton('balance_snapshot', snapshot_balances,
+                  lease_seconds=2 * 60 * app.config['BALANCE_SNAPSHOT_MINUTES']),
+        'interval',
+        minutes=app.config['BALANCE_SNAPSHOT_MINUTES'],
+        id='balance_snapshot',
         max_instances=1
     )
 
     # Start schedulers
-    for scheduler in [wallet_scheduler, claims_scheduler]:
+    for scheduler in [wallet_scheduler, claims_scheduler, metrics_scheduler, referral_scheduler,
+                      ledger_scheduler]:
+        scheduler_stats.listen(scheduler)
         scheduler.start()
         schedulers.append(scheduler)
 
-    # Register shutdown handlers
+    # Register shutdown handlers; giving up the leases lets another process take over at once
     def cleanup_schedulers():
         for scheduler in schedulers:
-            scheduler.shutdown()
+            if scheduler.running:
+                scheduler.shutdown()
+        with app.app_context():
+            try:
+                leases.release_all()
+            except Exception as e:
+                app.logger.error(f"Lease release error: {str(e)}")
 
     atexit.register(cleanup_schedulers)
     return schedulers
 
 
+def setup_commands(app):
+    """Register maintenance commands with the flask CLI"""
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index():
+        """Rebuild the admin search trigram index"""
+        from services.search import rebuild_index
+        rebuild_index()
+        print('Search index rebuilt')
+
+    @app.cli.command('backfill-rollups')
+    @click.option('--user-id', type=int, default=None, help='Only rebuild rollups for this user')
+    def backfill_rollups(user_id):
+        """Rebuild per-user daily volume rollups from completed transactions"""
+        from services.rollups import backfill
+        rows = backfill(user_id=user_id)
+        print(f'Rollups rebuilt: {rows} rows')
+
+    @app.cli.command('rebuild-metrics')
+    def rebuild_metrics():
+        """Recompute platform metrics from the source tables"""
+        from services.platform_metrics import rebuild
+        rebuild()
+        print('Platform metrics rebuilt')
+
+    @app.cli.command('rebuild-referral-ancestry')
+    def rebuild_referral_ancestry():
+        """Rebuild the referral closure table from User.referred_by"""
+        from services.referrals import rebuild_ancestry
+        rows = rebuild_ancestry()
+        print(f'Referral ancestry rebuilt: {rows} rows')
+
+    @app.cli.command('reconcile-referral-stats')
+    def reconcile_referral_stats():
+        """Recompute per-user referral counters and fix any that drifted"""
+        corrected = reconcile_stats()
+        print(f'Referral stats reconciled: {corrected} rows corrected')
+
+    @app.cli.command('migrate-money')
+    def migrate_money():
+        """Convert FLOAT money columns to BIGINT micro-units; run with the app stopped"""
+        from models.schema import migrate_money_columns
+        converted = migrate_money_columns()
+        print(f'Money columns converted: {", ".join(converted) or "none"}')
+
+    @app.cli.command('retry-outbox')
+    @click.option('--event-id', type=int, multiple=True, help='Only retry these events')
+    def retry_outbox(event_id):
+        """Queue FAILED outbox events for delivery again"""
+        from services.outbox import retry_failed
+        count = retry_failed(list(event_id) or None)
+        print(f'Outbox events queued again: {count}')
+
+    @app.cli.command('snapshot-balances')
+    def snapshot_balances():
+        """Snapshot balances with new ledger activity and report drift"""
+        written, drifted = take_snapshots()
+        print(f'Balance snapshots: {written} written, {drifted} with drift')
+
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
@@ -126,7 +244,9 @@ def create_app(config_class=Config):
         (admin_rates_bp, '/admin_rates'),
         (referral_admin_bp, '/admin/referrals'),
         (wallet_bp, '/admin/wallets'),
-        (settings_bp, '/admin/settings')
+        (settings_bp, '/admin/settings'),
+        (admin_metrics_bp, '/admin/metrics'),
+        (admin_jobs_bp, '/admin/jobs')
     ]
 
     # Register all blueprints
@@ -140,10 +260,21 @@ def create_app(config_class=Config):
     # Setup logging
     setup_logging(app)
 
-    # Initialize schedulers
+    # Register CLI commands
+    setup_commands(app)
+
     with app.app_context():
-        app.schedulers = setup_schedulers(app)
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+
+    # Schedulers and job workers run in worker.py; RUN_SCHEDULERS and WEB_JOB_WORKERS run them here too
+    app.schedulers = setup_schedulers(app) if app.config['RUN_SCHEDULERS'] else []
+    app.job_workers = start_workers(app, app.config['WEB_JOB_WORKERS'])
+    sql_profiler.init_app(app)
+    if app.config['TELEMETRY_FLUSH_SECONDS']:
+        telemetry.init_app(app)
+        telemetry.start(app)
 
     @app.after_request
     def after_request(response):
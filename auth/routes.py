@@ -2,7 +2,8 @@ import re
 from flask import Blueprint, request, jsonify, current_app
 from models import db
 from models.models import User, OTP, UserStatus
-from .utils import generate_otp, generate_referral_code, send_sms_otp, create_access_token, token_required
+from services import referrals
+from .utils import generate_otp, generate_referral_code, queue_sms_otp, create_access_token, token_required
 from datetime import datetime, timedelta
 
 auth_bp = Blueprint('auth', __name__)
@@ -67,11 +68,10 @@ def send_otp():
         })
 
         db.session.add(new_otp)
-        db.session.commit()
 
-        # Send OTP
-        if not send_sms_otp(mobile, otp):
-            return jsonify({'error': 'Failed to send OTP'}), 500
+        # Send OTP from a job worker, queued with the OTP itself
+        queue_sms_otp(mobile, otp)
+        db.session.commit()
 
         return jsonify({
             'message': 'OTP sent successfully',
@@ -164,6 +164,8 @@ def authenticate():
                     user.referred_by = referrer.id
 
             db.session.add(user)
+            db.session.flush()
+            referrals.record_signup(user)
 
         # Mark OTP as verified and commit changes
         otp_record.is_verified = True
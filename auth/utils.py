@@ -8,6 +8,9 @@ import requests
 
 from models import db
 from models.models import UserStatus, User, OTP
+from services import jobs, telemetry
+
+SMS_OTP_JOB = 'sms_otp'
 
 
 def generate_otp():
@@ -40,13 +43,28 @@ def send_sms_otp(mobile, otp):
             "DLT_TE_ID": "1307167958154244221"
         }
 
-        response = requests.get(url, params=params)
+        with telemetry.external_call('sms_gateway') as call:
+            response = requests.get(url, params=params)
+            call.status = response.status_code
+        telemetry.count('otp.sms.sent' if response.ok else 'otp.sms.failed')
         return response.ok
     except Exception as e:
+        telemetry.count('otp.sms.failed')
         current_app.logger.error(f"SMS send error: {str(e)}")
         return False
 
 
+def queue_sms_otp(mobile, otp):
+    """Queue the OTP SMS for a job worker; it is sent once the caller commits"""
+    jobs.enqueue(SMS_OTP_JOB, {'mobile': mobile, 'otp': otp}, priority=jobs.PRIORITY_HIGH)
+
+
+@jobs.handler(SMS_OTP_JOB, max_attempts=3)
+def _send_sms_otp_job(job, payload):
+    if not send_sms_otp(payload['mobile'], payload['otp']):
+        raise RuntimeError('SMS gateway did not accept the message')
+
+
 def create_access_token(user_id):
     """Create JWT token"""
     expiry = datetime.utcnow() + timedelta(days=1)
@@ -0,0 +1,139 @@
+"""
+Filling large buy orders from several claims.
+
+Planning: fills per second over in-memory claims books of 10k claims and up,
+with the bisect planner behind /buy/fill against a greedy scan of the whole
+sorted book, and how often each finds a fill and how close it lands.
+
+Orders: concurrent buyers filling large amounts end to end through
+claim_matcher.fill_claims on a book of --claims claims in the database.
+
+    python benchmarks/claim_fill_benchmark.py --books 10000 100000 --claims 10000 --buyers 16
+
+Point BENCH_DATABASE_URL at MySQL for realistic row locking; SQLite serializes writers.
+"""
+import argparse
+import random
+import threading
+import time
+
+from claim_match_benchmark import AMOUNTS, populate, reset_claims
+from common import create_bench_app, summarize
+from models.models import db
+from services import claims_book, claim_matcher
+
+FILL_AMOUNTS = [30000, 45000, 60000, 75000, 120000, 150000, 200000]
+MAX_PIECES = 4
+TOLERANCE_PERCENT = 10
+
+
+def scan_fill(entries, amount, max_pieces, tolerance, used):
+    """Baseline: walk the whole book largest first, taking every claim that still fits"""
+    picked = []
+    remaining = amount
+    for claim_amount, claim_id in reversed(entries):
+        if len(picked) == max_pieces or remaining <= tolerance:
+            break
+        if claim_id not in used and claim_amount <= remaining + tolerance:
+            picked.append(claim_id)
+            remaining -= claim_amount
+    return picked if abs(remaining) <= tolerance else []
+
+
+def build_book(size, seed=7):
+    rng = random.Random(seed)
+    book = claims_book.ClaimsBook()
+    book.load({
+        'id': i, 'bank_name': rng.choice(['HDFC', 'SBI', 'ICICI', 'AXIS']), 'account_number': f'{i:012d}',
+        'ifsc_code': 'BENCH0000001', 'account_holder': f'Holder {i}', 'amount_inr': rng.choice(AMOUNTS),
+        'status': 'AVAILABLE', 'version': 1, 'created_at': ''
+    } for i in range(size))
+    return book
+
+
+def bench_planning(sizes, fills):
+    for size in sizes:
+        book = build_book(size)
+        entries = book._sorted[None]
+        amounts = [random.Random(i).choice(FILL_AMOUNTS) for i in range(fills)]
+
+        for name, planner in (('bisect', claims_book._fill), ('scan', scan_fill)):
+            filled = pieces = 0
+            error = 0.0
+            start = time.perf_counter()
+            for amount in amounts:
+                ids = planner(entries, amount, MAX_PIECES, amount * TOLERANCE_PERCENT / 100, set())
+                if ids:
+                    filled += 1
+                    pieces += len(ids)
+                    error += abs(sum(book._claims[claim_id]['amount_inr'] for claim_id in ids) - amount) / amount
+            elapsed = time.perf_counter() - start
+            print(f"{size:>7} claims, {name:<6}: {fills / elapsed:10.0f} fills/s, "
+                  f"{filled / fills:.0%} filled, {pieces / max(filled, 1):.2f} pieces, "
+                  f"{error / max(filled, 1):.2%} mean error")
+
+
+def bench_orders(app, buyers, orders):
+    results = {}
+    counts = {'orders': 0, 'no_match': 0, 'errors': 0, 'pieces': 0}
+    lock = threading.Lock()
+
+    def buyer(user_id):
+        rng = random.Random(user_id)
+        with app.app_context():
+            for _ in range(orders):
+                amount = rng.choice(FILL_AMOUNTS)
+                start = time.perf_counter()
+                try:
+                    claims = claim_matcher.fill_claims(user_id, amount)
+                    db.session.commit()
+                    outcome = 'orders'
+                except claim_matcher.NoMatch:
+                    db.session.rollback()
+                    claims, outcome = [], 'no_match'
+                except Exception:
+                    db.session.rollback()
+                    claims, outcome = [], 'errors'
+                with lock:
+                    counts[outcome] += 1
+                    counts['pieces'] += len(claims)
+                    results.setdefault('fill_claims: order', []).append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in range(1, buyers + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"fill_claims: {counts['orders']} orders in {elapsed:.2f} s ({counts['orders'] / elapsed:.1f} orders/s), "
+          f"{counts['pieces'] / max(counts['orders'], 1):.2f} claims per order, "
+          f"{counts['no_match']} unmatched, {counts['errors']} errors")
+    summarize(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--books', type=int, nargs='+', default=[10000, 100000], help='In-memory book sizes to plan over')
+    parser.add_argument('--fills', type=int, default=20000, help='Fills planned per book')
+    parser.add_argument('--claims', type=int, default=10000, help='Claims in the database for the order run')
+    parser.add_argument('--buyers', type=int, default=16, help='Concurrent buyer threads')
+    parser.add_argument('--orders', type=int, default=20, help='Orders per buyer')
+    args = parser.parse_args()
+
+    bench_planning(args.books, args.fills)
+
+    app = create_bench_app()
+    app.config['CLAIM_FILL_MAX_PIECES'] = MAX_PIECES
+    app.config['CLAIM_MATCH_TOLERANCE_PERCENT'] = TOLERANCE_PERCENT
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        populate(args.claims, args.buyers)
+        reset_claims()
+    bench_orders(app, args.buyers, args.orders)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Buyers competing for claims: picking the top recommended claim from the list
+and retrying on conflict, as /buy/initiate clients do, against the matcher
+behind /buy/match, which moves on to the next candidate by itself.
+
+    python benchmarks/claim_match_benchmark.py --claims 2000 --buyers 32 --orders 20
+
+Point BENCH_DATABASE_URL at MySQL for realistic row locking; SQLite serializes writers.
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+
+from common import create_bench_app, summarize
+from models.models import db, User, Claim
+from services import claims_book, claim_matcher, state_machine
+
+AMOUNTS = [1000, 2000, 2500, 5000, 10000, 20000, 25000, 50000]
+
+
+def populate(claims, buyers):
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [{
+        'id': i, 'mobile': f'9{i:09d}', 'name': f'Buyer {i}', 'referral_code': f'B{i:08d}', 'created_at': now
+    } for i in range(1, buyers + 1)])
+
+    rng = random.Random(7)
+    db.session.execute(insert(Claim), [{
+        'bank_name': rng.choice(['HDFC', 'SBI', 'ICICI', 'AXIS']),
+        'account_number': f'{i:012d}',
+        'ifsc_code': 'BENCH0000001',
+        'account_holder': f'Holder {i}',
+        'amount_inr': rng.choice(AMOUNTS),
+        'status': 'AVAILABLE',
+        'is_active': True,
+        'created_at': now,
+        'updated_at': now
+    } for i in range(claims)])
+    db.session.commit()
+
+
+def reset_claims():
+    db.session.execute(update(Claim).values(
+        status='AVAILABLE', claimed_by=None, claimed_at=None, expires_at=None, updated_at=datetime.utcnow()))
+    db.session.commit()
+    claims_book.invalidate()
+
+
+def pick_from_list(user_id, amount):
+    """The list flow: take the top recommended claim, fail if someone got there first"""
+    candidates, _ = claims_book.get_book().query(near=amount, limit=1)
+    if not candidates:
+        return None
+    claim = db.session.get(Claim, candidates[0]['id'], populate_existing=True)
+    if claim.status != 'AVAILABLE':
+        raise state_machine.IllegalTransition('Invalid claim status')
+    state_machine.transition(claim, 'CLAIMED', claimed_by=user_id, claimed_at=datetime.utcnow(),
+                             expires_at=datetime.utcnow() + timedelta(minutes=30))
+    return claim
+
+
+def match(user_id, amount):
+    try:
+        return claim_matcher.match_claim(user_id, amount)
+    except claim_matcher.NoMatch:
+        return None
+
+
+def run(app, strategy, buyers, orders, max_retries):
+    results = {}
+    counts = {'orders': 0, 'failed_attempts': 0, 'gave_up': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def buyer(user_id):
+        rng = random.Random(user_id)
+        with app.app_context():
+            for _ in range(orders):
+                amount = rng.choice(AMOUNTS)
+                start = time.perf_counter()
+                for attempt in range(max_retries + 1):
+                    try:
+                        claim = strategy(user_id, amount)
+                        db.session.commit()
+                        outcome = 'orders' if claim else 'gave_up'
+                        break
+                    except (state_machine.IllegalTransition, state_machine.ConcurrentUpdate):
+                        db.session.rollback()
+                        with lock:
+                            counts['failed_attempts'] += 1
+                    except Exception:
+                        db.session.rollback()
+                        with lock:
+                            counts['errors'] += 1
+                else:
+                    outcome = 'gave_up'
+                with lock:
+                    counts[outcome] += 1
+                    results.setdefault(f'{strategy.__name__}: order', []).append(
+                        (time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=buyer, args=(user_id,)) for user_id in range(1, buyers + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{strategy.__name__}: {counts['orders']} orders in {elapsed:.2f} s, "
+          f"{counts['failed_attempts']} failed attempts "
+          f"({counts['failed_attempts'] / max(counts['orders'], 1):.2f} per order), "
+          f"{counts['gave_up']} gave up, {counts['errors']} errors")
+    summarize(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--claims', type=int, default=2000)
+    parser.add_argument('--buyers', type=int, default=32, help='Concurrent buyer threads')
+    parser.add_argument('--orders', type=int, default=20, help='Orders per buyer')
+    parser.add_argument('--max-retries', type=int, default=10, help='List-flow retries before a buyer gives up')
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        populate(args.claims, args.buyers)
+
+    for strategy in (pick_from_list, match):
+        with app.app_context():
+            reset_claims()
+        run(app, strategy, args.buyers, args.orders, args.max_retries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Shared setup for the standalone benchmark scripts in this directory"""
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from config import Config
+from models import db
+from models.schema import ensure_columns, ensure_indexes
+
+
+def create_bench_app(database_uri=None):
+    """Minimal app bound to a scratch database; schedulers and blueprints are not started"""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri or os.getenv(
+        'BENCH_DATABASE_URL', 'sqlite:////tmp/rupal_bench.db'
+    )
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        ensure_columns()
+        ensure_indexes()
+
+    return app
+
+
+@contextmanager
+def timed(label, results=None):
+    start = time.perf_counter()
+    yield
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if results is not None:
+        results.setdefault(label, []).append(elapsed_ms)
+    else:
+        print(f"{label}: {elapsed_ms:.2f} ms")
+
+
+def summarize(results):
+    for label, samples in results.items():
+        samples = sorted(samples)
+        p50 = samples[len(samples) // 2]
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{label:<40} n={len(samples):<5} p50={p50:8.2f} ms  p95={p95:8.2f} ms")
@@ -0,0 +1,99 @@
+"""
+Query budgets of the user API: each endpoint must answer within a fixed number
+of SQL statements, however many rows the user has, and without running one
+statement shape per row (N+1). Exits 1 if any endpoint is over its budget.
+
+    python benchmarks/query_budgets.py --transactions 200 --referrals 50
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert
+
+from app import create_app
+from auth.utils import create_access_token
+from config import Config
+from models.models import db, User, Transaction
+from models.schema import ensure_columns, ensure_indexes
+from services import sql_profiler
+
+# (path, most statements, most runs of one statement shape)
+BUDGETS = [
+    ('/api/v1/dashboard/summary', 2, 1),
+    ('/api/v1/dashboard/analytics', 3, 1),
+    ('/api/v1/dashboard/referrals', 5, 1),
+    ('/api/v1/dashboard/pending-actions', 4, 1),
+    ('/api/v1/referral/info', 8, 1),
+    ('/api/v1/referral/earnings', 4, 1),
+    ('/api/v1/referral/tree', 6, 1),
+    ('/api/v1/transaction/rates/all', 3, 1),
+    ('/api/v1/transaction/transactions?page=0&per_page=50', 4, 1),
+    ('/api/v1/transaction/transaction/1', 3, 1),
+    ('/api/v1/transaction/claims', 4, 1),
+    ('/api/v1/transaction/v2/claims', 4, 1),
+    ('/api/v1/user/profile', 4, 2),
+    ('/api/v1/bank/accounts', 3, 1),
+]
+
+
+def populate(transactions, referrals):
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [{
+        'mobile': f'9{i:09d}',
+        'name': f'User {i}',
+        'referral_code': f'R{i:08d}',
+        'referred_by': 1 if i > 1 else None,
+        'created_at': now
+    } for i in range(1, referrals + 2)])
+    db.session.execute(insert(Transaction), [{
+        'rupal_id': f'QB{i:08d}',
+        'user_id': 1,
+        'transaction_type': ('BUY', 'SELL', 'DEPOSIT')[i % 3],
+        'status': ('PENDING', 'COMPLETED')[i % 2],
+        'amount_usdt': 10.0,
+        'amount_inr': 900.0,
+        'created_at': now
+    } for i in range(transactions)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--transactions', type=int, default=200)
+    parser.add_argument('--referrals', type=int, default=50)
+    args = parser.parse_args()
+
+    class BudgetConfig(Config):
+        SQLALCHEMY_DATABASE_URI = os.getenv('BENCH_DATABASE_URL', 'sqlite:////tmp/rupal_query_budgets.db')
+        TESTING = True
+        TELEMETRY_FLUSH_SECONDS = 0
+
+    app = create_app(BudgetConfig)
+    client = app.test_client()
+    failed = 0
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        populate(args.transactions, args.referrals)
+        headers = {'Authorization': f'Bearer {create_access_token(1)}'}
+
+        for path, max_queries, max_repeats in BUDGETS:
+            try:
+                with sql_profiler.query_budget(max_queries, max_repeats) as recording:
+                    response = client.get(path, headers=headers)
+                print(f"ok    {path:<55} {recording.count:>3} queries  HTTP {response.status_code}")
+            except sql_profiler.QueryBudgetExceeded as e:
+                failed += 1
+                print(f"OVER  {path:<55} {e}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Referral tree loading on synthetic downlines: the old per-node recursive
+query walk against the single-query loader in referral/utils.py.
+
+    python benchmarks/referral_tree_benchmark.py --nodes 100000 --fanout 1000
+"""
+import argparse
+import random
+from datetime import datetime
+
+from sqlalchemy import insert, Index
+
+from common import create_bench_app, timed, summarize
+from models.models import db, User
+from referral.utils import get_referral_tree
+from services.referrals import rebuild_ancestry
+
+
+def populate(nodes, fanout, batch_size=20000):
+    """
+    A promoter at the root and a random tree below: each new user is referred by a
+    random earlier user, biased towards the top so the first levels are very wide.
+    """
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    rows = [{'id': 1, 'mobile': '9000000000', 'name': 'Root', 'referral_code': 'R00000000', 'created_at': now}]
+
+    for i in range(2, nodes + 2):
+        parent = 1 if i <= fanout + 1 else rng.randint(1, int((i - 1) ** rng.uniform(0.5, 1)))
+        rows.append({
+            'id': i,
+            'mobile': f'9{i:09d}',
+            'name': f'User {i}',
+            'referral_code': f'R{i:08d}',
+            'referred_by': parent,
+            'created_at': now
+        })
+
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(User), rows[start:start + batch_size])
+    db.session.commit()
+
+    # MySQL indexes the referred_by foreign key implicitly; match that so the legacy walk is not a scan per node
+    Index('idx_bench_user_referred_by', User.referred_by).create(db.engine, checkfirst=True)
+
+    rebuild_ancestry()
+
+
+def legacy_tree(user_id, level=1, max_levels=5):
+    """The previous loader: one query per node"""
+    if level > max_levels:
+        return []
+    return [{
+        'user': referral,
+        'level': level,
+        'children': legacy_tree(referral.id, level + 1, max_levels)
+    } for referral in User.query.filter_by(referred_by=user_id).all()]
+
+
+def count_nodes(tree):
+    return sum(1 + count_nodes(node['children']) for node in tree)
+
+
+def run(samples, max_nodes, legacy_levels):
+    results = {}
+
+    if legacy_levels:
+        with timed(f'legacy walk: {legacy_levels} levels', results):
+            tree = legacy_tree(1, max_levels=legacy_levels)
+        db.session.expunge_all()
+        print(f'legacy nodes: {count_nodes(tree)}')
+
+        for _ in range(samples):
+            with timed(f'ancestry loader: {legacy_levels} levels', results):
+                tree = get_referral_tree(1, max_levels=legacy_levels, max_nodes=max_nodes)
+        print(f"ancestry nodes at {legacy_levels} levels: {tree['node_count']}")
+
+    for _ in range(samples):
+        with timed('ancestry loader: whole tree', results):
+            tree = get_referral_tree(1, max_nodes=max_nodes)
+    print(f"whole tree nodes: {tree['node_count']} truncated={tree['truncated']}")
+
+    for page in range(1, samples + 1):
+        with timed('ancestry loader: page of 50', results):
+            tree = get_referral_tree(1, max_nodes=max_nodes, page=page, per_page=50)
+    print(f"last page nodes: {tree['node_count']}")
+
+    summarize(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--fanout', type=int, default=1000, help='Direct referrals of the root')
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--legacy-levels', type=int, default=5, help='Depth for the single legacy run, 0 to skip')
+    parser.add_argument('--max-nodes', type=int, default=200000)
+    parser.add_argument('--skip-populate', action='store_true')
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    with app.app_context():
+        if not args.skip_populate:
+            db.drop_all()
+            db.create_all()
+            with timed('populate'):
+                populate(args.nodes, args.fanout)
+        run(args.samples, args.max_nodes, args.legacy_levels)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Admin search latency on a synthetic dataset: leading-wildcard LIKE scans
+against the indexed lookups in services/search.py.
+
+    python benchmarks/search_benchmark.py --users 500000 --transactions 3000000 --claims 200000
+"""
+import argparse
+import random
+import string
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from common import create_bench_app, timed, summarize
+from models.models import db, User, Transaction, Claim
+from services import search
+
+SYLLABLES = [c + v for c in 'bcdfghjklmnprstvwyz' for v in 'aeiou'] + ['sh', 'pr', 'an', 'ar', 'ee']
+BANKS = ['State Bank of India', 'HDFC Bank', 'ICICI Bank', 'Axis Bank', 'Punjab National Bank', 'Kotak Bank']
+
+
+def _name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+
+
+def populate(users, transactions, claims, batch_size=20000):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    for start in range(0, users, batch_size):
+        db.session.execute(insert(User), [{
+            'mobile': f'9{i:09d}',
+            'name': f'{_name(rng)} {i}',
+            'referral_code': f'R{i:08d}',
+            'created_at': now
+        } for i in range(start, min(users, start + batch_size))])
+
+    for start in range(0, transactions, batch_size):
+        db.session.execute(insert(Transaction), [{
+            'rupal_id': f'PO{i:08d}',
+            'user_id': rng.randint(1, users),
+            'transaction_type': 'BUY',
+            'status': 'COMPLETED',
+            'amount_usdt': 10.0,
+            'created_at': now
+        } for i in range(start, min(transactions, start + batch_size))])
+
+    for start in range(0, claims, batch_size):
+        db.session.execute(insert(Claim), [{
+            'bank_name': rng.choice(BANKS),
+            'account_number': ''.join(rng.choices(string.digits, k=12)),
+            'ifsc_code': 'SBIN0000001',
+            'account_holder': f'{_name(rng)} {_name(rng)}',
+            'amount_inr': 5000,
+            'status': 'AVAILABLE',
+            'created_at': now
+        } for _ in range(start, min(claims, start + batch_size))])
+
+    db.session.commit()
+    search.rebuild_index()
+
+
+def run(users, transactions, claims, samples):
+    rng = random.Random(7)
+    results = {}
+
+    for _ in range(samples):
+        reference = f'PO{rng.randint(0, transactions - 1):08d}'
+        mobile = f'9{rng.randint(0, users - 1):09d}'
+        name = _name(rng)[:5]
+
+        with timed('transactions: LIKE %ref%', results):
+            Transaction.query.filter(Transaction.rupal_id.like(f'%{reference}%')).limit(50).all()
+        with timed('transactions: indexed ref', results):
+            search.search_transactions(Transaction.query, reference).limit(50).all()
+
+        with timed('users: LIKE %mobile% OR %name%', results):
+            User.query.filter(User.mobile.like(f'%{mobile[:6]}%') | User.name.like(f'%{mobile[:6]}%')) \
+                .limit(50).all()
+        with timed('users: mobile prefix', results):
+            search.search_users(User.query, mobile[:6]).limit(50).all()
+
+        with timed('users: LIKE %name%', results):
+            User.query.filter(User.name.like(f'%{name}%')).limit(50).all()
+        with timed('users: trigram name', results):
+            search.search_users(User.query, name).limit(50).all()
+
+        with timed('claims: ILIKE %holder%', results):
+            Claim.query.filter(Claim.account_holder.ilike(f'%{name}%') |
+                               Claim.bank_name.ilike(f'%{name}%') |
+                               Claim.account_number.ilike(f'%{name}%')).limit(50).all()
+        with timed('claims: trigram holder', results):
+            search.search_claims(Claim.query, name).limit(50).all()
+
+    summarize(results)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--transactions', type=int, default=2000000)
+    parser.add_argument('--claims', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=20)
+    parser.add_argument('--skip-populate', action='store_true')
+    args = parser.parse_args()
+
+    app = create_bench_app()
+    with app.app_context():
+        if not args.skip_populate:
+            with timed('populate'):
+                populate(args.users, args.transactions, args.claims)
+        run(args.users, args.transactions, args.claims, args.samples)
+
+
+if __name__ == '__main__':
+    main()
@@ -41,9 +41,85 @@ class Config:
     # Wallet Pool Config
     WALLET_ASSIGNMENT_DURATION = 30  # minutes
     CLEANUP_INTERVAL = 5  # minutes
+    WALLET_ASSIGNMENT_GRACE_MINUTES = 5  # deposit checks continue this long past expiry
+
+    # Claim expiry: how often due claims are released, and how often the expiry heap is rebuilt
+    CLAIM_EXPIRY_TICK_SECONDS = 5
+    CLAIM_EXPIRY_RESEED_SECONDS = 60
+
+    # How often each process checks for claim changes made elsewhere before serving the claims book
+    CLAIMS_BOOK_CHECK_SECONDS = 2
+
+    # Buy order matching: candidates tried per request, and how far a claim may be from the requested amount
+    CLAIM_MATCH_CANDIDATES = 10
+    CLAIM_MATCH_TOLERANCE_PERCENT = 10
+    # Most claims a single buy order may be filled from
+    CLAIM_FILL_MAX_PIECES = 4
+
+    # Most transactions a single bulk approve or cancel may touch
+    BULK_STATUS_MAX_IDS = 1000
+
+    # Most data rows a single bulk CSV import may hold
+    CSV_IMPORT_MAX_ROWS = 20000
+
+    # Background work runs in worker.py. Web processes start no schedulers and no job workers unless
+    # RUN_SCHEDULERS / WEB_JOB_WORKERS say so; scheduled jobs stay singletons either way, through leases.
+    # Job queue: how often an idle worker polls, default attempts and the first retry delay (doubled per
+    # attempt), how long a running job may go without committing progress before it is taken as
+    # abandoned, and how long finished jobs are kept
+    RUN_SCHEDULERS = os.getenv('RUN_SCHEDULERS', 'False').lower() == 'true'
+    WEB_JOB_WORKERS = int(os.getenv('WEB_JOB_WORKERS', 0))
+    JOB_POLL_SECONDS = 1
+    JOB_MAX_ATTEMPTS = 5
+    JOB_RETRY_SECONDS = 10
+    JOB_LEASE_SECONDS = 600
+    JOB_RETENTION_DAYS = 7
+
+    # Outbox: events delivered per batch, delivery attempts before an event is set aside as FAILED,
+    # the first retry delay (doubled per attempt), and how long delivered events are kept
+    OUTBOX_BATCH_SIZE = 200
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_RETRY_SECONDS = 10
+    OUTBOX_RETENTION_DAYS = 3
+
+    # /metrics: how often each process writes its request, external call and pool telemetry to the
+    # database (0 to not collect it), and the bearer token scrapes must send; without one
+    # /metrics is only served in debug or testing
+    TELEMETRY_FLUSH_SECONDS = 10
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # SQL profiler (services/sql_profiler.py), for staging or a single production process while
+    # investigating: records every request's statements and logs those repeating a statement shape
+    # this often (N+1) or running one this slow, and keeps the last few for /admin/metrics/sql
+    SQL_PROFILER = os.getenv('SQL_PROFILER', 'False').lower() == 'true'
+    SQL_PROFILER_REPEAT_THRESHOLD = 5
+    SQL_PROFILER_SLOW_MS = 100
+    SQL_PROFILER_KEEP = 200
+
+    # Logging (services/log_pipeline.py): JSON lines written by a listener thread, rotated at 10 MB.
+    # LOG_LEVELS sets the level of individual loggers; LOG_SAMPLING keeps only a fraction of the
+    # records below WARNING of a logger or module, e.g. {'wallet_pool': 0.1}; with LOG_CAPTURE_STDOUT
+    # print() output becomes DEBUG records of the stdout logger
+    LOG_DIR = 'logs'
+    LOG_FILE = 'crypto_platform.log'
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = {'werkzeug': 'WARNING', 'apscheduler': 'WARNING', 'urllib3': 'WARNING'}
+    LOG_SAMPLING = {}
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 10
+    LOG_QUEUE_SIZE = 10000
+    LOG_CAPTURE_STDOUT = os.getenv('LOG_CAPTURE_STDOUT', 'False').lower() == 'true'
+
+    # Ledger balance snapshots
+    BALANCE_SNAPSHOT_MINUTES = 60
+
+    # Platform metrics refresh (queue sizes, wallet utilization, top referrers)
+    METRICS_REFRESH_SECONDS = 60
 
     # Referral Config
     MAX_REFERRAL_LEVELS = 5
+    REFERRAL_TREE_MAX_NODES = 5000
+    REFERRAL_STATS_RECONCILE_HOUR = 3  # UTC, daily
     DEFAULT_BUY_COMMISSION = 1.0  # percentage
     DEFAULT_SELL_COMMISSION = 0.5  # percentage
 
@@ -1,10 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app
-from models.models import db, Transaction, User, BankAccount, TransactionType, TransactionStatus
+from models.models import Transaction, User, BankAccount, TransactionStatus
 from auth.utils import token_required
-from sqlalchemy import func
-from datetime import datetime, timedelta
 
 from models.models import ReferralEarning
+from services import rollups, referrals
 from transaction.utils import TransactionUtil
 
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -19,7 +18,7 @@ def get_dashboard_summary(current_user):
     """
     try:
         version = int(request.form.get("version", 0))
-        print(version)
+        current_app.logger.debug(f"Dashboard app version {version}")
 
         return jsonify({
             'wallet_balance': current_user.wallet_balance,
@@ -50,40 +49,16 @@ def get_analytics(current_user):
     """
     try:
         period = request.args.get('period', 'month')
+        start_day, interval = rollups.analytics_window(period)
 
-        # Calculate date range
-        now = datetime.utcnow()
-        if period == 'day':
-            start_date = now - timedelta(days=1)
-            interval = 'hour'
-        elif period == 'week':
-            start_date = now - timedelta(days=7)
-            interval = 'day'
-        elif period == 'year':
-            start_date = now - timedelta(days=365)
-            interval = 'month'
-        else:  # month
-            start_date = now - timedelta(days=30)
-            interval = 'day'
-
-        # Get volume analytics
-        volume_data = db.session.query(
-            func.date_trunc(interval, Transaction.created_at).label('date'),
-            TransactionType,
-            func.sum(Transaction.amount_usdt).label('volume')
-        ).filter(
-            Transaction.user_id == current_user.id,
-            Transaction.status == TransactionStatus.COMPLETED,
-            Transaction.created_at >= start_date
-        ).group_by(
-            'date',
-            TransactionType
-        ).all()
+        # Read precomputed daily volumes instead of aggregating the transaction history
+        volume_data = rollups.get_user_rollups(current_user.id, start_day)
 
         # Format analytics data
         analytics = {}
-        for date, tx_type, volume in volume_data:
-            date_str = date.strftime('%Y-%m-%d %H:00' if interval == 'hour' else '%Y-%m-%d')
+        for rollup in volume_data:
+            bucket = rollup.day.replace(day=1) if interval == 'month' else rollup.day
+            date_str = bucket.strftime('%Y-%m-%d')
             if date_str not in analytics:
                 analytics[date_str] = {
                     'buy': 0,
@@ -91,7 +66,8 @@ def get_analytics(current_user):
                     'deposit': 0,
                     'withdraw': 0
                 }
-            analytics[date_str][tx_type.value.lower()] = float(volume or 0)
+            tx_type = rollup.transaction_type.value.lower()
+            analytics[date_str][tx_type] = analytics[date_str].get(tx_type, 0) + float(rollup.volume_usdt or 0)
 
         return jsonify({
             'period': period,
@@ -112,18 +88,16 @@ def get_analytics(current_user):
 def get_referral_summary(current_user):
     """Get referral summary and earnings"""
     try:
-        # Get referred users
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+
+        # Get one page of referred users
         referred_users = User.query.filter_by(
             referred_by=current_user.id
-        ).all()
+        ).order_by(User.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
 
-        # Get referral earnings
-        earnings = db.session.query(
-            func.sum(ReferralEarning.amount_usdt),
-            func.count(ReferralEarning.id)
-        ).filter_by(
-            user_id=current_user.id
-        ).first()
+        # Get referral counters
+        stats = referrals.get_stats(current_user.id)
 
         # Get recent earnings
         recent_earnings = ReferralEarning.query.filter_by(
@@ -134,14 +108,20 @@ def get_referral_summary(current_user):
 
         return jsonify({
             'referral_code': current_user.referral_code,
-            'total_referrals': len(referred_users),
-            'total_earnings': float(earnings[0] or 0),
-            'total_transactions': earnings[1],
+            'total_referrals': stats.direct_count,
+            'total_downline': stats.downline_count,
+            'total_earnings': float(stats.total_earnings_usdt),
+            'total_transactions': stats.earning_count,
             'referred_users': [{
                 'mobile': user.mobile,
                 'joined_at': user.created_at.isoformat(),
                 'status': user.status.value
             } for user in referred_users],
+            'pagination': {
+                'total_pages': max(1, -(-stats.direct_count // per_page)),
+                'current_page': page,
+                'total_items': stats.direct_count
+            },
             'recent_earnings': [{
                 'amount_usdt': earning.amount_usdt,
                 'level': earning.referral_level,
@@ -4,6 +4,7 @@ from enum import Enum
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from models import db
+from models.types import Money
 
 
 class UserStatus(Enum):
@@ -16,7 +17,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     mobile = db.Column(db.String(15), unique=True, nullable=False)
     name = db.Column(db.String(20), unique=True, nullable=False)
-    wallet_balance = db.Column(db.Float, default=0.0)
+    wallet_balance = db.Column(Money(), default=0)
     wallet_pin_hash = db.Column(db.String(256))
     referral_code = db.Column(db.String(10), unique=True)
     referred_by = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -50,7 +51,7 @@ class PooledWallet(db.Model):
     total_assignments = db.Column(db.Integer, default=0)
     last_checked_at = db.Column(db.DateTime)
     total_deposits = db.Column(db.Integer, default=0)
-    total_deposit_amount = db.Column(db.Float, default=0.0)
+    total_deposit_amount = db.Column(Money(), default=0)
 
 
 class WalletAssignment(db.Model):
@@ -64,6 +65,11 @@ class WalletAssignment(db.Model):
     wallet = db.relationship('PooledWallet', backref='assignments')
     user = db.relationship('User', backref='wallet_assignments')
 
+    __table_args__ = (
+        db.Index('idx_assignment_expiry', 'is_active', 'expires_at'),
+        db.Index('idx_assignment_user_active', 'user_id', 'is_active', 'expires_at'),
+    )
+
 
 # models/transaction.py
 class TransactionType(Enum):
@@ -85,13 +91,13 @@ class TransactionStatus(Enum):
 
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    rupal_id = db.Column(db.String(10), nullable=False)
+    rupal_id = db.Column(db.String(10), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     transaction_type = db.Column(db.Enum(TransactionType), nullable=False)
-    amount_usdt = db.Column(db.Float, nullable=False)
-    amount_inr = db.Column(db.Float)
+    amount_usdt = db.Column(Money(), nullable=False)
+    amount_inr = db.Column(Money())
     exchange_rate = db.Column(db.Float)
-    fee_usdt = db.Column(db.Float, default=0)
+    fee_usdt = db.Column(Money(), default=0)
     status = db.Column(db.Enum(TransactionStatus), default=TransactionStatus.PENDING)
 
     # Blockchain details
@@ -115,12 +121,37 @@ class Transaction(db.Model):
     error_message = db.Column(db.String(500))
     admin_notes = db.Column(db.String(500))
 
+    # Bumped by every status change; see services/state_machine.py
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     # Relationships
     user = db.relationship('User', backref='transactions')
     bank_account = db.relationship('BankAccount', backref='transactions')
     wallet_assignment = db.relationship('WalletAssignment', backref='transactions')
     claim = db.relationship('Claim', backref='transactions')
 
+    __table_args__ = (
+        db.Index('idx_transaction_user_created', 'user_id', 'created_at'),
+        db.Index('idx_transaction_status_type', 'status', 'transaction_type'),
+    )
+    __mapper_args__ = {'version_id_col': version}
+
+
+class UserVolumeRollup(db.Model):
+    """Completed transaction volume per user, day and type, kept current as transactions complete"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    transaction_type = db.Column(db.Enum(TransactionType), nullable=False)
+    volume_usdt = db.Column(Money(), nullable=False, default=0)
+    volume_inr = db.Column(Money(), nullable=False, default=0)
+    txn_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'transaction_type', name='unique_user_day_type'),
+    )
+
 
 # models/bank.py
 class BankAccount(db.Model):
@@ -147,7 +178,7 @@ class ReferralCommission(db.Model):
     level = db.Column(db.Integer, nullable=False)
     buy_commission_percent = db.Column(db.Float, nullable=False)
     sell_commission_percent = db.Column(db.Float, nullable=False)
-    min_amount_usdt = db.Column(db.Float, default=0)
+    min_amount_usdt = db.Column(Money(), default=0)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -158,7 +189,7 @@ class ReferralEarning(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=False)
     referral_level = db.Column(db.Integer, nullable=False)
-    amount_usdt = db.Column(db.Float, nullable=False)
+    amount_usdt = db.Column(Money(), nullable=False)
     commission_percent = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -166,6 +197,48 @@ class ReferralEarning(db.Model):
     transaction = db.relationship('Transaction', backref='referral_earnings')
 
 
+class ReferralAncestor(db.Model):
+    """Closure table of the referral tree: one row per (user, upline member) pair"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    depth = db.Column(db.Integer, nullable=False)  # 1 = direct referrer
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'depth', name='uq_referral_ancestor_depth'),
+        db.Index('idx_referral_ancestor_descendants', 'ancestor_id', 'depth'),
+    )
+
+
+class ReferralStats(db.Model):
+    """Per-user referral counters, maintained at signup and when commissions are paid"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), unique=True, nullable=False)
+    direct_count = db.Column(db.Integer, nullable=False, default=0)
+    downline_count = db.Column(db.Integer, nullable=False, default=0)
+    total_earnings_usdt = db.Column(Money(), nullable=False, default=0)
+    earning_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_referral_stats_earnings', 'total_earnings_usdt'),
+    )
+
+
+class ReferralLevelStats(db.Model):
+    """A user's lifetime referral earnings from one level of their downline"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    level = db.Column(db.Integer, nullable=False)
+    earnings_usdt = db.Column(Money(), nullable=False, default=0)
+    earning_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'level', name='uq_referral_level_stats'),
+    )
+
+
 class OTP(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     mobile = db.Column(db.String(15), nullable=False)
@@ -182,7 +255,6 @@ class PaymentMode(Enum):
 
     @classmethod
     def from_value(cls, payment_mode_val):
-        print(payment_mode_val)
         if "Online Bank Transfer" == payment_mode_val:
             return PaymentMode.ONLINE_TRANSFER
         elif "Cash Deposit via CDM" == payment_mode_val:
@@ -197,8 +269,8 @@ class ExchangeRate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     transaction_type = db.Column(db.String(10), nullable=False)  # BUY/SELL
     payment_mode = db.Column(db.Enum(PaymentMode), nullable=False)
-    min_amount_inr = db.Column(db.Float, nullable=False)  # INR amount
-    max_amount_inr = db.Column(db.Float, nullable=False)  # INR amount
+    min_amount_inr = db.Column(Money(), nullable=False)  # INR amount
+    max_amount_inr = db.Column(Money(), nullable=False)  # INR amount
     rate = db.Column(db.Float, nullable=False)  # Rate for this slab
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -222,25 +294,32 @@ class ExchangeRate(db.Model):
 class Claim(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bank_name = db.Column(db.String(100), nullable=False)
-    account_number = db.Column(db.String(50), nullable=False)
+    account_number = db.Column(db.String(50), nullable=False, index=True)
     ifsc_code = db.Column(db.String(20), nullable=False)
     account_holder = db.Column(db.String(100), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
-    amount_inr = db.Column(db.Float, nullable=False)
+    amount_inr = db.Column(Money(), nullable=False)
 
     # Claim tracking
     claimed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     claimed_at = db.Column(db.DateTime)
     expires_at = db.Column(db.DateTime)
-    status = db.Column(db.String(20), default='AVAILABLE')  # AVAILABLE, CLAIMED, EXPIRED
+    status = db.Column(db.String(20), default='AVAILABLE')  # AVAILABLE, CLAIMED, COMPLETED, DISABLED, SPLIT
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Set on the pieces a large claim was split into; the parent is left SPLIT
+    parent_id = db.Column(db.Integer, db.ForeignKey('claim.id'))
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     __table_args__ = (
         db.Index('idx_claim_status', 'status', 'claimed_by'),
-        db.Index('idx_active_claims', 'claimed_by', 'status', 'expires_at')
+        db.Index('idx_active_claims', 'claimed_by', 'status', 'expires_at'),
+        db.Index('idx_claim_expiry', 'status', 'expires_at'),
+        db.Index('idx_claim_updated', 'updated_at')
     )
+    __mapper_args__ = {'version_id_col': version}
 
 
 # models/settings.py
@@ -284,3 +363,144 @@ class Setting(db.Model):
             except:
                 return default
         return setting.value
+
+
+# models/search.py
+class SearchToken(db.Model):
+    """Trigram of a searchable text field, used for admin name/holder search"""
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # USER, CLAIM
+    entity_id = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(30), nullable=False)
+    token = db.Column(db.String(3), nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_search_token_lookup', 'token', 'entity_type', 'entity_id'),
+        db.Index('idx_search_token_entity', 'entity_id', 'entity_type', 'field'),
+    )
+
+
+# models/metrics.py
+class PlatformMetric(db.Model):
+    """Platform-wide KPI, maintained incrementally or by the metrics refresh job"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(100), unique=True, nullable=False)
+    # Double precision: MySQL's single precision FLOAT stops counting at 2^24 and rounds epoch timestamps
+    value = db.Column(db.Float(precision=53), nullable=False, default=0)
+    payload = db.Column(db.Text)  # JSON, for list-valued metrics
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PlatformMetric {self.key}={self.value}>'
+
+
+# models/ledger.py
+class LedgerEntry(db.Model):
+    """Append-only record of every change to a user's wallet balance"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(Money(), nullable=False)  # signed: credits positive, debits negative
+    balance_after = db.Column(Money(), nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)  # DEPOSIT, BUY, SELL, WITHDRAW, REFUND, REFERRAL, ADMIN_ADD, ADMIN_SUB
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'))
+    note = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_ledger_user', 'user_id', 'id'),
+        db.Index('idx_ledger_transaction', 'transaction_id'),
+    )
+
+
+class BalanceSnapshot(db.Model):
+    """A user's balance as of a ledger entry, checked against the entries since the previous snapshot"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    ledger_entry_id = db.Column(db.Integer, nullable=False)  # last entry included
+    balance = db.Column(Money(), nullable=False)
+    drift = db.Column(Money())  # balance minus (previous snapshot + entries since), None for a first snapshot
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_balance_snapshot_user', 'user_id', 'ledger_entry_id'),
+    )
+
+
+# models/jobs.py
+class JobStatus(Enum):
+    QUEUED = 'QUEUED'
+    RUNNING = 'RUNNING'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+
+
+class Job(db.Model):
+    """
+    A unit of background work in the database job queue. Workers take the
+    QUEUED job with the highest priority whose run_at has passed; a failed
+    job is queued again with backoff until it has used max_attempts.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # higher runs first
+    run_at = db.Column(db.DateTime, default=datetime.utcnow)  # not taken before this time
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    locked_by = db.Column(db.String(100))  # worker running it
+    locked_at = db.Column(db.DateTime)  # renewed as the job commits progress; stale means the worker died
+    payload = db.Column(db.Text(length=2 ** 24))  # JSON input; MEDIUMTEXT on MySQL
+    result = db.Column(db.Text(length=2 ** 24))  # JSON output
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)  # committed with the work it counts
+    error = db.Column(db.String(500))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_job_kind', 'kind', 'created_at'),
+        db.Index('idx_job_dequeue', 'status', 'priority', 'run_at'),
+    )
+
+
+# models/outbox.py
+class OutboxStatus(Enum):
+    PENDING = 'PENDING'
+    DELIVERED = 'DELIVERED'
+    FAILED = 'FAILED'
+
+
+class OutboxEvent(db.Model):
+    """An event written in the same commit as the change it describes, delivered to its subscribers later"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text)  # JSON
+    status = db.Column(db.Enum(OutboxStatus), nullable=False, default=OutboxStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # not delivered before this time
+    error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_outbox_pending', 'status', 'available_at'),
+    )
+
+
+# models/leases.py
+class SchedulerLease(db.Model):
+    """Which process runs a singleton scheduled job, until expires_at unless it renews"""
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(100), nullable=False)
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+# models/schema.py
+class SchemaMigration(db.Model):
+    """Data migrations already applied, for steps that cannot be detected from the schema alone"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), unique=True, nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,113 @@
+from sqlalchemy import inspect, text, Float, Integer
+from sqlalchemy.dialects import mysql
+from sqlalchemy.schema import CreateColumn
+
+from models import db
+from models.types import Money, MICRO
+
+
+def ensure_indexes():
+    """
+    Create indexes declared on the models that are missing from existing tables.
+    db.create_all() only creates missing tables, so indexes added to a model
+    after its table was created are applied here.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def _single_precision(column, existing_type):
+    """A column declared double precision that MySQL created as a single precision FLOAT"""
+    return (db.engine.dialect.name == 'mysql'
+            and isinstance(column.type, Float) and (column.type.precision or 0) > 24
+            and isinstance(existing_type, mysql.FLOAT))
+
+
+def ensure_columns():
+    """
+    Add columns declared on the models that are missing from existing tables.
+    Like indexes, columns added to a model after its table was created are not
+    applied by db.create_all(); a new column must be nullable or have a
+    server_default so existing rows can take it. Columns declared double
+    precision that exist as MySQL FLOAT are widened to DOUBLE.
+    """
+    preparer = db.engine.dialect.identifier_preparer
+    added = []
+
+    for table in db.metadata.sorted_tables:
+        if not inspect(db.engine).has_table(table.name):
+            continue
+
+        existing = {info['name']: info for info in inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                if _single_precision(column, existing[column.name]['type']):
+                    null = 'NULL' if column.nullable else 'NOT NULL'
+                    with db.engine.begin() as connection:
+                        connection.execute(text(f'ALTER TABLE {preparer.quote(table.name)} '
+                                                f'MODIFY {preparer.quote(column.name)} DOUBLE {null}'))
+                    added.append(f'{table.name}.{column.name}')
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} without a server_default')
+
+            definition = CreateColumn(column).compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {definition}'))
+            added.append(f'{table.name}.{column.name}')
+
+    return added
+
+
+def migrate_money_columns():
+    """
+    Convert money columns created as FLOAT to BIGINT micro-units, in place so
+    constraints and indexes over them are kept.
+
+    Values are scaled by 10^6 in one UPDATE committed together with a
+    SchemaMigration marker, so an interrupted run can be repeated without scaling
+    twice. On MySQL the column is widened to DOUBLE before scaling and changed to
+    BIGINT after; SQLite keeps its declared type, which only sets the affinity.
+    Run with the application stopped. Returns the converted column names.
+    """
+    from models.models import SchemaMigration
+
+    preparer = db.engine.dialect.identifier_preparer
+    is_mysql = db.engine.dialect.name == 'mysql'
+    converted = []
+
+    for table in db.metadata.sorted_tables:
+        money_columns = [column for column in table.columns if isinstance(column.type, Money)]
+        if not money_columns or not inspect(db.engine).has_table(table.name):
+            continue
+
+        existing = {info['name']: info for info in inspect(db.engine).get_columns(table.name)}
+        quoted_table = preparer.quote(table.name)
+
+        for column in money_columns:
+            # Integer already: created as BIGINT, or converted by an earlier run
+            if isinstance(existing[column.name]['type'], Integer):
+                continue
+
+            quoted_column = preparer.quote(column.name)
+            null = 'NULL' if column.nullable else 'NOT NULL'
+            marker = f'money_units:{table.name}.{column.name}'
+
+            if not SchemaMigration.query.filter_by(name=marker).first():
+                if is_mysql:
+                    with db.engine.begin() as connection:
+                        connection.execute(text(f'ALTER TABLE {quoted_table} MODIFY {quoted_column} DOUBLE {null}'))
+
+                db.session.execute(text(
+                    f'UPDATE {quoted_table} SET {quoted_column} = ROUND({quoted_column} * {MICRO})'
+                ))
+                db.session.add(SchemaMigration(name=marker))
+                db.session.commit()
+                converted.append(f'{table.name}.{column.name}')
+
+            if is_mysql:
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {quoted_table} MODIFY {quoted_column} BIGINT {null}'))
+
+    return converted
@@ -0,0 +1,47 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import BigInteger, literal
+from sqlalchemy.types import TypeDecorator
+
+# Money is stored in micro-units: USDT has 6 decimals on chain, and INR uses the same scale
+MONEY_SCALE = 6
+MICRO = 10 ** MONEY_SCALE
+
+
+def to_units(value):
+    """Amount to integer micro-units, rounding half up at the sixth decimal"""
+    return int((Decimal(str(value)) * MICRO).to_integral_value(ROUND_HALF_UP))
+
+
+def from_units(units):
+    return float(Decimal(units).scaleb(-MONEY_SCALE))
+
+
+class Money(TypeDecorator):
+    """
+    An amount stored as a BIGINT count of micro-units.
+
+    Values bind from float, int or Decimal and load as float, so application
+    arithmetic is unchanged, while storage and SQL aggregation (SUM, +/- in
+    UPDATEs) work on exact integers.
+    """
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_units(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return from_units(value)
+
+    def coerce_compared_value(self, op, value):
+        return self
+
+
+def money(value):
+    """A bound amount for SQL expressions the column type does not reach, such as CASE branches"""
+    return literal(value, Money())
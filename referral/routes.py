@@ -1,12 +1,13 @@
 from flask import Blueprint, request, jsonify, current_app
 from models.models import (
-    db, User, ReferralCommission, ReferralEarning,
+    User, ReferralCommission, ReferralEarning,
     Transaction, TransactionStatus, Setting
 )
 from auth.utils import token_required
 from datetime import datetime
-from sqlalchemy import func
 
+from referral.utils import get_referral_tree
+from services import referrals
 from transaction.utils import TransactionUtil
 
 referral_bp = Blueprint('referral', __name__)
@@ -16,15 +17,16 @@ referral_bp = Blueprint('referral', __name__)
 def get_referral_info(current_user):
     """Get user's referral information and earnings"""
     try:
-        # Get direct referrals
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+
+        # Get one page of direct referrals
         direct_referrals = User.query.filter_by(
             referred_by=current_user.id
-        ).order_by(User.created_at.desc()).all()
+        ).order_by(User.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
 
-        # Get total earnings
-        total_earnings = db.session.query(
-            func.sum(ReferralEarning.amount_usdt)
-        ).filter_by(user_id=current_user.id).scalar() or 0
+        # Get counters
+        stats = referrals.get_stats(current_user.id)
 
         # Get recent earnings
         recent_earnings = ReferralEarning.query.filter_by(
@@ -45,8 +47,14 @@ def get_referral_info(current_user):
         return jsonify({
             'referral_code': current_user.referral_code,
             'referral_link': f"{domain}?referralCode={current_user.referral_code}",
-            'total_referrals': len(direct_referrals),
-            'total_earnings': round(float(total_earnings), 2),
+            'total_referrals': stats.direct_count,
+            'total_downline': stats.downline_count,
+            'total_earnings': round(float(stats.total_earnings_usdt), 2),
+            'earnings_by_level': [{
+                'level': level.level,
+                'amount_usdt': round(level.earnings_usdt, 2),
+                'count': level.earning_count
+            } for level in referrals.get_level_earnings(current_user.id)],
             'recent_earnings': [{
                 'id': earning.id,
                 'amount_usdt': round(earning.amount_usdt, 2),
@@ -61,6 +69,11 @@ def get_referral_info(current_user):
                 'joined_at': TransactionUtil.format_created_at_to_ist(user.created_at),
                 'status': user.status.value
             } for user in direct_referrals],
+            'pagination': {
+                'total_pages': max(1, -(-stats.direct_count // per_page)),
+                'current_page': page,
+                'total_items': stats.direct_count
+            },
             'buy_commission': rate.buy_commission_percent if rate else 0.00,
             'sell_commission': rate.sell_commission_percent if rate else 0.00,
         }), 200
@@ -115,4 +128,44 @@ def get_earnings(current_user):
 
     except Exception as e:
         current_app.logger.error(f"Get earnings error: {str(e)}")
-        return jsonify({'error': 'Failed to fetch earnings'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Failed to fetch earnings'}), 500
+
+def _serialize_tree_nodes(nodes):
+    return [{
+        'mobile': node['mobile'],
+        'name': node['name'],
+        'level': node['level'],
+        'status': node['status'],
+        'joined_at': TransactionUtil.format_created_at_to_ist(node['joined_at']),
+        'children': _serialize_tree_nodes(node['children'])
+    } for node in nodes]
+
+
+@referral_bp.route('/tree', methods=['GET'])
+@token_required
+def get_tree(current_user):
+    """
+    Get the user's downline as a tree
+    Query params:
+    - page: int, page of direct referrals
+    - per_page: int
+    """
+    try:
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+
+        tree = get_referral_tree(current_user.id, page=page, per_page=per_page)
+
+        return jsonify({
+            'tree': _serialize_tree_nodes(tree['children']),
+            'truncated': tree['truncated'],
+            'pagination': {
+                'total_pages': max(1, -(-tree['total_direct'] // per_page)),
+                'current_page': page,
+                'total_items': tree['total_direct']
+            }
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Get referral tree error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch referral tree'}), 500
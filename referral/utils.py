@@ -1,26 +1,91 @@
 from flask import current_app
+from sqlalchemy.orm import aliased
 
-from models.models import User
+from models.models import db, User, ReferralAncestor, ReferralStats
 
+EARNINGS_CHUNK_SIZE = 1000
 
-def get_referral_tree(user_id, level=1, max_levels=None):
-    """Get complete referral tree for visualization"""
-    if max_levels and level > max_levels:
-        return []
 
-    referrals = User.query.filter_by(referred_by=user_id).all()
-    tree = []
+def get_direct_referral_ids(user_id, page=1, per_page=None):
+    """One page of a user's direct referrals, oldest first, and the total count"""
+    query = db.session.query(ReferralAncestor.user_id).filter(
+        ReferralAncestor.ancestor_id == user_id,
+        ReferralAncestor.depth == 1
+    )
+    total = query.count()
 
-    for referral in referrals:
-        sub_tree = get_referral_tree(
-            referral.id,
-            level + 1,
-            max_levels or current_app.config['MAX_REFERRAL_LEVELS']
-        )
-        tree.append({
-            'user': referral,
-            'level': level,
-            'children': sub_tree
-        })
+    query = query.order_by(ReferralAncestor.user_id)
+    if per_page:
+        query = query.offset((page - 1) * per_page).limit(per_page)
 
-    return tree
+    return [referral_id for referral_id, in query.all()], total
+
+
+def _earnings_by_user(user_ids):
+    earnings = {}
+    for start in range(0, len(user_ids), EARNINGS_CHUNK_SIZE):
+        chunk = user_ids[start:start + EARNINGS_CHUNK_SIZE]
+        earnings.update(db.session.query(
+            ReferralStats.user_id, ReferralStats.total_earnings_usdt
+        ).filter(ReferralStats.user_id.in_(chunk)).all())
+    return earnings
+
+
+def get_referral_tree(user_id, max_levels=None, max_nodes=None, page=1, per_page=None):
+    """
+    Get a user's downline for visualization.
+
+    The whole subtree to max_levels is read from the referral ancestry table in
+    one query and assembled in memory. Direct referrals can be paged with
+    page/per_page, in which case only the subtrees under that page are loaded.
+    At most max_nodes nodes are returned, shallowest first.
+    """
+    max_levels = max_levels or current_app.config['MAX_REFERRAL_LEVELS']
+    max_nodes = max_nodes or current_app.config['REFERRAL_TREE_MAX_NODES']
+
+    direct_ids, total_direct = get_direct_referral_ids(user_id, page, per_page)
+
+    query = db.session.query(
+        User.id, User.mobile, User.name, User.status, User.created_at, User.referred_by, ReferralAncestor.depth
+    ).join(
+        ReferralAncestor, ReferralAncestor.user_id == User.id
+    ).filter(
+        ReferralAncestor.ancestor_id == user_id,
+        ReferralAncestor.depth <= max_levels
+    )
+
+    if per_page:
+        page_ancestor = aliased(ReferralAncestor)
+        page_descendants = db.session.query(page_ancestor.user_id).filter(page_ancestor.ancestor_id.in_(direct_ids))
+        query = query.filter(User.id.in_(direct_ids) | User.id.in_(page_descendants))
+
+    # Ordered by depth so every parent precedes its children and truncation drops the deepest nodes
+    rows = query.order_by(ReferralAncestor.depth, User.id).limit(max_nodes + 1).all()
+    truncated = len(rows) > max_nodes
+    rows = rows[:max_nodes]
+
+    earnings = _earnings_by_user([row[0] for row in rows])
+
+    root = {'children': []}
+    nodes = {user_id: root}
+    for node_id, mobile, name, status, created_at, parent_id, depth in rows:
+        node = {
+            'id': node_id,
+            'mobile': mobile,
+            'name': name,
+            'status': status.value if status else None,
+            'joined_at': created_at,
+            'level': depth,
+            'total_earnings': float(earnings.get(node_id) or 0),
+            'children': []
+        }
+        nodes[node_id] = node
+        nodes[parent_id]['children'].append(node)
+
+    return {
+        'children': root['children'],
+        'total_direct': total_direct,
+        'node_count': len(rows),
+        'max_levels': max_levels,
+        'truncated': truncated
+    }
@@ -0,0 +1,68 @@
+"""
+Bulk approval and cancellation of transactions from the admin panel.
+
+The batch is read in one query and moved with one state_machine.transition_many(),
+so its side effects run once for the whole batch: ledger credits and refunds in a
+single ledger batch per entry type, every upline loaded in one query with all the
+ReferralEarning rows in one INSERT, and the linked claims in one UPDATE.
+"""
+from datetime import datetime
+
+from models.models import db, Transaction, TransactionStatus
+from services import state_machine
+
+BULK_STATUSES = (TransactionStatus.COMPLETED, TransactionStatus.CANCELLED)
+
+
+def bulk_update_status(transaction_ids, new_status, admin_notes=None, attempts=3):
+    """
+    Move the given transactions to COMPLETED or CANCELLED in one database transaction
+    and commit. Transactions that are missing or cannot make the move are reported and
+    left alone. If another request changes one of the batch meanwhile, the whole batch
+    is rolled back and re-read, up to `attempts` times, then ConcurrentUpdate is raised.
+    Returns [{'id', 'success', 'status' or 'message'}] in the order of transaction_ids.
+    """
+    new_status = TransactionStatus(new_status)
+    if new_status not in BULK_STATUSES:
+        raise ValueError(f'Transactions can only be bulk moved to {", ".join(s.value for s in BULK_STATUSES)}')
+    transaction_ids = list(dict.fromkeys(transaction_ids))
+
+    for _ in range(attempts):
+        found = {transaction.id: transaction for transaction in
+                 Transaction.query.filter(Transaction.id.in_(transaction_ids)).populate_existing()}
+
+        results = {}
+        batch = []
+        for transaction_id in transaction_ids:
+            transaction = found.get(transaction_id)
+            if transaction is None:
+                results[transaction_id] = {'success': False, 'message': 'Transaction not found'}
+            elif transaction.status == new_status:
+                results[transaction_id] = {'success': False, 'message': f'Already {new_status.value}'}
+            elif not state_machine.can_transition(transaction, new_status):
+                results[transaction_id] = {
+                    'success': False,
+                    'message': f'Cannot move from {transaction.status.value} to {new_status.value}'
+                }
+            else:
+                batch.append(transaction)
+
+        values = {}
+        if admin_notes:
+            values['admin_notes'] = admin_notes
+        if new_status == TransactionStatus.COMPLETED:
+            values['completed_at'] = datetime.utcnow()
+
+        try:
+            state_machine.transition_many(batch, new_status, **values)
+            db.session.commit()
+        except state_machine.ConcurrentUpdate:
+            db.session.rollback()
+            continue
+
+        # By id, not off the batch: touching the committed, expired objects would reload each one
+        for transaction_id in transaction_ids:
+            results.setdefault(transaction_id, {'success': True, 'status': new_status.value})
+        return [{'id': transaction_id, **results[transaction_id]} for transaction_id in transaction_ids]
+
+    raise state_machine.ConcurrentUpdate('Transactions kept changing under the batch, reload and retry')
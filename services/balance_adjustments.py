@@ -0,0 +1,149 @@
+"""
+Bulk admin balance adjustments from a CSV of mobile, amount and reason.
+
+The upload is validated and its users resolved in the request, with one query
+per thousand mobiles, then applied by a background job in batches. Each batch
+locks its users' rows, checks debits against their balances in memory, inserts
+the ADMIN_ADD / ADMIN_SUB audit transactions in one INSERT, moves the balances
+through one ledger batch per type and commits together with the job's progress.
+"""
+import json
+import math
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from models.models import db, User, Transaction, TransactionType, TransactionStatus
+from services import jobs, ledger, state_machine
+from services.bulk_import import read_csv, RowError
+from transaction.utils import TransactionUtil
+
+KIND = 'balance_adjustment'
+COLUMNS = ['mobile', 'amount', 'reason']
+BATCH_SIZE = 500
+
+
+def _amount(value):
+    try:
+        amount = round(float(value), 6)
+    except ValueError:
+        raise RowError('amount is not a number')
+    if not math.isfinite(amount) or not amount:
+        raise RowError('amount must be a non-zero number, negative to subtract')
+    return amount
+
+
+def parse(stream):
+    """
+    Validate an adjustments CSV and resolve its mobiles to users.
+    Returns (rows, errors): rows are [line, user_id, amount, reason] lists in file
+    order, errors [{'row', 'error'}]. Raises InvalidUpload for an unusable file.
+    """
+    parsed, errors = [], []
+    for line, row in read_csv(stream, COLUMNS):
+        try:
+            mobile = row.get('mobile', '')
+            if not mobile:
+                raise RowError('mobile is required')
+            parsed.append((line, mobile, _amount(row.get('amount', '')), row.get('reason', '')[:255]))
+        except RowError as e:
+            errors.append({'row': line, 'error': str(e)})
+
+    mobiles = list({mobile for _, mobile, _, _ in parsed})
+    users = {}
+    for start in range(0, len(mobiles), 1000):
+        users.update(db.session.query(User.mobile, User.id).filter(User.mobile.in_(mobiles[start:start + 1000])))
+
+    rows = []
+    for line, mobile, amount, reason in parsed:
+        if mobile in users:
+            rows.append([line, users[mobile], amount, reason])
+        else:
+            errors.append({'row': line, 'error': f'No user with mobile {mobile}'})
+    errors.sort(key=lambda error: error['row'])
+    return rows, errors
+
+
+def start(rows, errors, created_by):
+    """Queue the job that applies parsed rows and commit; validation errors are carried into its result"""
+    job = jobs.enqueue(KIND, {'rows': rows, 'errors': errors}, total=len(rows), created_by=created_by)
+    db.session.commit()
+    return job
+
+
+def _references(count):
+    references = set()
+    while len(references) < count:
+        references.add(TransactionUtil.generate_transaction_ref())
+    return list(references)
+
+
+def _apply_batch(rows):
+    """Apply one batch in the current database transaction. Returns errors for rows skipped"""
+    user_ids = sorted({user_id for _, user_id, _, _ in rows})
+    # Locked until commit, so the debit checks below hold
+    balances = dict(db.session.query(User.id, User.wallet_balance)
+                    .filter(User.id.in_(user_ids))
+                    .order_by(User.id)
+                    .with_for_update())
+
+    applied, errors = [], []
+    for line, user_id, amount, reason in rows:
+        if round(balances[user_id] + amount, 6) < 0:
+            errors.append({'row': line, 'error': 'Insufficient balance'})
+            continue
+        balances[user_id] += amount
+        applied.append((line, user_id, amount, reason))
+    if not applied:
+        return errors
+
+    # Whole seconds, so the rows can be read back by it on MySQL DATETIME columns
+    now = datetime.utcnow().replace(microsecond=0)
+    references = _references(len(applied))
+    db.session.execute(insert(Transaction), [{
+        'user_id': user_id,
+        'rupal_id': reference,
+        'transaction_type': TransactionType.ADMIN_ADD if amount > 0 else TransactionType.ADMIN_SUB,
+        'amount_usdt': abs(amount),
+        'status': TransactionStatus.COMPLETED,
+        'admin_notes': f"Balance {'added to' if amount > 0 else 'subtracted from'} by admin. Reason: {reason}"[:500],
+        'created_at': now,
+        'updated_at': now,
+        'completed_at': now
+    } for (_, user_id, amount, reason), reference in zip(applied, references)])
+
+    transactions = Transaction.query.filter(
+        Transaction.rupal_id.in_(references),
+        Transaction.created_at == now
+    ).all()
+    transaction_ids = {transaction.rupal_id: transaction.id for transaction in transactions}
+
+    entries = [(user_id, amount, transaction_ids[reference], reason)
+               for (_, user_id, amount, reason), reference in zip(applied, references)]
+    ledger.credit_many([entry for entry in entries if entry[1] > 0], TransactionType.ADMIN_ADD.value)
+    ledger.credit_many([entry for entry in entries if entry[1] < 0], TransactionType.ADMIN_SUB.value)
+
+    state_machine.publish_completed(transactions)
+    return errors
+
+
+@jobs.handler(KIND)
+def _run(job, payload):
+    """
+    Apply the rows from job.processed on. The running totals are committed in
+    job.result with each batch, so a job run again resumes where it stopped.
+    """
+    rows = payload['rows']
+    result = json.loads(job.result) if job.result else {'applied': 0, 'errors': payload['errors']}
+
+    for start in range(job.processed, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        skipped = _apply_batch(batch)
+        result['applied'] += len(batch) - len(skipped)
+        result['errors'].extend(skipped)
+        job.result = json.dumps(result)
+        jobs.progress(job, start + len(batch))
+        db.session.commit()
+
+    result['errors'].sort(key=lambda error: error['row'])
+    return result
@@ -0,0 +1,287 @@
+"""
+Bulk CSV imports for claims, pool wallets and rate slabs.
+
+The upload is read a line at a time and every row is validated in memory:
+duplicate wallet addresses are found with one IN query per batch instead of one
+query per row, and rate slab overlaps with a sort over each transaction type and
+payment mode instead of one range query per row. Valid rows are inserted in
+batched INSERTs, claims indexed for search batch by batch as the INSERTs skip the
+ORM hooks, and committed together; invalid rows are reported by line number and
+skipped.
+"""
+import codecs
+import csv
+import hashlib
+import math
+import os
+import re
+from bisect import bisect_right
+from collections import defaultdict
+
+from flask import current_app
+from sqlalchemy import func, insert
+
+from models.models import db, Claim, ExchangeRate, PaymentMode, PooledWallet, WalletStatus
+from services import claims_book, jobs, search
+from transaction.utils import TransactionUtil
+
+BATCH_SIZE = 1000
+QR_CODES_JOB = 'render_qr_codes'
+QR_CODES_BATCH_SIZE = 200
+
+CLAIM_COLUMNS = ['bank_name', 'account_number', 'ifsc_code', 'account_holder', 'amount_inr']
+WALLET_COLUMNS = ['address']
+RATE_COLUMNS = ['transaction_type', 'payment_mode', 'min_amount_inr', 'max_amount_inr', 'rate']
+
+IFSC_PATTERN = re.compile(r'^[A-Z]{4}0[A-Z0-9]{6}$')
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+_PAYMENT_MODES = {**{mode.value: mode for mode in PaymentMode}, **{mode.name: mode for mode in PaymentMode}}
+
+
+class InvalidUpload(Exception):
+    """The upload as a whole cannot be imported: not a CSV, missing columns, too many rows"""
+    pass
+
+
+class RowError(Exception):
+    pass
+
+
+def read_csv(stream, columns):
+    """(line number, row dict) for each data row of a CSV upload, read a line at a time"""
+    reader = csv.reader(codecs.iterdecode(stream, 'utf-8-sig'))
+    try:
+        header = [name.strip().lower() for name in next(reader)]
+    except StopIteration:
+        raise InvalidUpload('The file is empty')
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise InvalidUpload(f'Not a UTF-8 CSV file: {str(e)}')
+
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise InvalidUpload(f'Missing columns: {", ".join(missing)}')
+
+    max_rows = current_app.config['CSV_IMPORT_MAX_ROWS']
+    try:
+        for count, values in enumerate(reader, start=1):
+            if count > max_rows:
+                raise InvalidUpload(f'At most {max_rows} rows can be imported at once')
+            if not any(value.strip() for value in values):
+                continue
+            yield reader.line_num, {name: value.strip() for name, value in zip(header, values)}
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise InvalidUpload(f'Line {reader.line_num}: {str(e)}')
+
+
+def _required(row, column, max_length=None):
+    value = row.get(column, '')
+    if not value:
+        raise RowError(f'{column} is required')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{column} is longer than {max_length} characters')
+    return value
+
+
+def _amount(row, column, minimum=0):
+    try:
+        value = float(_required(row, column))
+    except ValueError:
+        raise RowError(f'{column} is not a number')
+    if not math.isfinite(value) or value < minimum:
+        raise RowError(f'{column} must be at least {minimum}')
+    return value
+
+
+def is_tron_address(address):
+    """TRON address format: base58check, 25 bytes starting 0x41, 'T...' in text"""
+    if not TransactionUtil.validate_tron_address(address):
+        return False
+    number = 0
+    for char in address:
+        digit = BASE58_ALPHABET.find(char)
+        if digit < 0:
+            return False
+        number = number * 58 + digit
+    raw = number.to_bytes(25, 'big')
+    checksum = hashlib.sha256(hashlib.sha256(raw[:21]).digest()).digest()[:4]
+    return raw[0] == 0x41 and raw[21:] == checksum
+
+
+def _insert(model, rows):
+    # Core INSERTs skip the mapper hooks building the search index, so the rows of indexed models are indexed here
+    indexed = next((entity_type for entity_type, (indexed_model, _) in search.INDEXED_FIELDS.items()
+                    if indexed_model is model), None)
+    for start in range(0, len(rows), BATCH_SIZE):
+        if indexed:
+            last_id = db.session.query(func.max(model.id)).scalar() or 0
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+        if indexed:
+            ids = [entity_id for entity_id, in db.session.query(model.id).filter(model.id > last_id)]
+            search.index_ids(indexed, ids)
+
+
+def _finish(model, rows, errors, total, dry_run):
+    if not dry_run and rows:
+        _insert(model, rows)
+        db.session.commit()
+    return {'total': total, 'imported': 0 if dry_run else len(rows), 'valid': len(rows), 'errors': errors}
+
+
+def import_claims(stream, dry_run=False):
+    """
+    Add AVAILABLE claims from a CSV with the CLAIM_COLUMNS header.
+    Returns {'total', 'valid', 'imported', 'errors': [{'row', 'error'}]}
+    """
+    rows, errors, total = [], [], 0
+    for line, row in read_csv(stream, CLAIM_COLUMNS):
+        total += 1
+        try:
+            ifsc_code = _required(row, 'ifsc_code', 20).upper()
+            if not IFSC_PATTERN.match(ifsc_code):
+                raise RowError(f'Invalid IFSC code {ifsc_code}')
+            amount_inr = _amount(row, 'amount_inr')
+            if not amount_inr:
+                raise RowError('amount_inr must be more than 0')
+            rows.append({
+                'bank_name': _required(row, 'bank_name', 100),
+                'account_number': _required(row, 'account_number', 50),
+                'ifsc_code': ifsc_code,
+                'account_holder': _required(row, 'account_holder', 100),
+                'amount_inr': amount_inr,
+                'is_active': True,
+                'status': 'AVAILABLE'
+            })
+        except RowError as e:
+            errors.append({'row': line, 'error': str(e)})
+
+    result = _finish(Claim, rows, errors, total, dry_run)
+    if result['imported']:
+        claims_book.invalidate()
+    return result
+
+
+def import_wallets(stream, created_by, dry_run=False):
+    """
+    Add AVAILABLE pool wallets from a CSV with an address column, skipping
+    addresses already in the pool or earlier in the file, and queue a job
+    rendering their QR codes with them. Returns as import_claims.
+    """
+    rows, errors, total = [], [], 0
+    lines = {}
+    for line, row in read_csv(stream, WALLET_COLUMNS):
+        total += 1
+        address = row.get('address', '')
+        if not is_tron_address(address):
+            errors.append({'row': line, 'error': f'Invalid TRON address {address}'})
+        elif address in lines:
+            errors.append({'row': line, 'error': f'Duplicate of row {lines[address]}'})
+        else:
+            lines[address] = line
+            rows.append({'address': address, 'status': WalletStatus.AVAILABLE, 'created_by': created_by})
+
+    addresses = list(lines)
+    existing = set()
+    for start in range(0, len(addresses), BATCH_SIZE):
+        existing.update(address for address, in db.session.query(PooledWallet.address).filter(
+            PooledWallet.address.in_(addresses[start:start + BATCH_SIZE])))
+    if existing:
+        errors.extend({'row': lines[address], 'error': 'Wallet address already exists'} for address in existing)
+        errors.sort(key=lambda error: error['row'])
+        rows = [row for row in rows if row['address'] not in existing]
+
+    if rows and not dry_run:
+        jobs.enqueue(QR_CODES_JOB, [row['address'] for row in rows], total=len(rows), priority=jobs.PRIORITY_LOW)
+    return _finish(PooledWallet, rows, errors, total, dry_run)
+
+
+def import_rates(stream, dry_run=False):
+    """
+    Add active rate slabs from a CSV with the RATE_COLUMNS header. A slab may not
+    overlap an active slab or another row of the same transaction type and payment
+    mode, min and max inclusive as in the add form; of two overlapping rows the one
+    with the lower min is kept. Returns as import_claims.
+    """
+    slabs, errors, total = defaultdict(list), [], 0
+    for line, row in read_csv(stream, RATE_COLUMNS):
+        total += 1
+        try:
+            transaction_type = _required(row, 'transaction_type').upper()
+            if transaction_type not in ('BUY', 'SELL'):
+                raise RowError('transaction_type must be BUY or SELL')
+            payment_mode = _PAYMENT_MODES.get(_required(row, 'payment_mode'))
+            if payment_mode is None:
+                raise RowError(f'Invalid payment mode {row["payment_mode"]}')
+            min_amount_inr = _amount(row, 'min_amount_inr')
+            max_amount_inr = _amount(row, 'max_amount_inr', min_amount_inr)
+            rate = _amount(row, 'rate')
+            if not rate:
+                raise RowError('rate must be more than 0')
+            slabs[(transaction_type, payment_mode)].append((min_amount_inr, max_amount_inr, line, rate))
+        except RowError as e:
+            errors.append({'row': line, 'error': str(e)})
+
+    active = defaultdict(list)
+    ranges = set()  # (type, mode, min, max) of every slab, active or not, which must stay unique
+    for rate in ExchangeRate.query:
+        ranges.add((rate.transaction_type, rate.payment_mode, rate.min_amount_inr, rate.max_amount_inr))
+        if rate.is_active:
+            active[(rate.transaction_type, rate.payment_mode)].append((rate.min_amount_inr, rate.max_amount_inr))
+
+    rows = []
+    for (transaction_type, payment_mode), group in slabs.items():
+        # Active slabs sorted by min, with the running highest max, answer "does [lo, hi] overlap any" by bisect
+        existing = sorted(active[(transaction_type, payment_mode)])
+        mins = [low for low, _ in existing]
+        reach = []
+        for _, high in existing:
+            reach.append(max(high, reach[-1]) if reach else high)
+
+        accepted_high, accepted_line = None, None
+        for low, high, line, rate in sorted(group):
+            index = bisect_right(mins, high) - 1
+            if index >= 0 and reach[index] >= low:
+                errors.append({'row': line, 'error': 'Overlaps an active rate slab'})
+            elif (transaction_type, payment_mode, low, high) in ranges:
+                errors.append({'row': line, 'error': 'Same range as an inactive rate slab'})
+            elif accepted_high is not None and low <= accepted_high:
+                errors.append({'row': line, 'error': f'Overlaps row {accepted_line}'})
+            else:
+                accepted_high, accepted_line = high, line
+                rows.append({
+                    'transaction_type': transaction_type,
+                    'payment_mode': payment_mode,
+                    'min_amount_inr': low,
+                    'max_amount_inr': high,
+                    'rate': rate,
+                    'is_active': True
+                })
+    errors.sort(key=lambda error: error['row'])
+
+    return _finish(ExchangeRate, rows, errors, total, dry_run)
+
+
+@jobs.handler(QR_CODES_JOB)
+def _render_qr_codes(job, addresses):
+    """
+    Render the QR codes still missing, so no deposit request waits on one.
+    Progress is committed every QR_CODES_BATCH_SIZE addresses, which renews the
+    job's lease so a long run is not queued again while it is still going.
+    """
+    rendered = failed = 0
+    for start in range(0, len(addresses), QR_CODES_BATCH_SIZE):
+        for address in addresses[start:start + QR_CODES_BATCH_SIZE]:
+            file_path = TransactionUtil.qr_file_path(address)
+            if os.path.exists(file_path):
+                continue
+            try:
+                TransactionUtil.render_address_qr(address, file_path)
+                rendered += 1
+            except Exception as e:
+                current_app.logger.error(f"QR generation error: {str(e)}")
+                failed += 1
+        jobs.progress(job, min(start + QR_CODES_BATCH_SIZE, len(addresses)))
+        db.session.commit()
+    if failed:
+        raise RuntimeError(f'{failed} of {len(addresses)} QR codes failed to render')
+    return {'rendered': rendered}
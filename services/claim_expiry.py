@@ -0,0 +1,174 @@
+"""
+Claim expiry driven by an in-memory timer heap.
+
+Claims are pushed onto a heap keyed on expires_at when they are claimed and
+dropped when they are released or completed, through the state machine hooks.
+Each tick pops only the claims that are due and releases them in bulk, so an
+idle tick costs no queries. The heap is rebuilt from the database at startup
+and every CLAIM_EXPIRY_RESEED_SECONDS, which picks up claims made by other
+processes and any entry lost to a rolled back request.
+
+Only the process holding the claim_expiry lease keeps the heap; the hooks do
+nothing elsewhere, web processes included, so nothing grows where nothing
+pops. Claims made in other processes, which is most of them as the API runs
+in the web processes, are therefore only picked up at the next reseed and may
+be released up to CLAIM_EXPIRY_RESEED_SECONDS after they are due.
+"""
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+
+from models.models import db, Claim, Setting, Transaction, TransactionStatus
+from services import claims_book, leases, platform_metrics, scheduler_stats, state_machine
+
+RELEASE_BATCH_SIZE = 500
+JOB = 'claim_expiry'  # the scheduled job, and its lease, in setup_schedulers
+
+_lock = threading.Lock()
+_heap = []  # (expires_at, claim_id)
+_deadlines = {}  # claim_id -> expires_at of its live heap entry; other entries are stale
+_state = {'seeded_at': None, 'grace': timedelta(minutes=2)}
+
+
+def _active():
+    """
+    True if this process holds the job's lease. A process that lost it drops
+    its heap, which would go stale, and seeds a new one if it takes it back.
+    """
+    if JOB in leases.held:
+        return True
+    if _state['seeded_at'] is not None:
+        with _lock:
+            _heap.clear()
+            _deadlines.clear()
+            _state['seeded_at'] = None
+    return False
+
+
+def schedule(claim_id, expires_at):
+    if not _active():
+        return
+    with _lock:
+        _deadlines[claim_id] = expires_at
+        heapq.heappush(_heap, (expires_at, claim_id))
+
+
+def unschedule(claim_id):
+    if not _active():
+        return
+    with _lock:
+        _deadlines.pop(claim_id, None)
+
+
+def seed():
+    """Rebuild the heap from the claims currently CLAIMED"""
+    rows = db.session.query(Claim.id, Claim.expires_at).filter(
+        Claim.status == 'CLAIMED',
+        Claim.expires_at.isnot(None)
+    ).all()
+    grace = timedelta(minutes=int(Setting.get_value("claim.expiry_time_delta", 2)))
+
+    with _lock:
+        _deadlines.clear()
+        _deadlines.update({claim_id: expires_at for claim_id, expires_at in rows})
+        _heap[:] = [(expires_at, claim_id) for claim_id, expires_at in rows]
+        heapq.heapify(_heap)
+        _state['grace'] = grace
+        _state['seeded_at'] = time.monotonic()
+    return len(rows)
+
+
+def _pop_due(cutoff):
+    """Pop the claims due by cutoff. Returns (claim ids, earliest expires_at among them or None)"""
+    due, earliest = [], None
+    with _lock:
+        while _heap and _heap[0][0] <= cutoff:
+            expires_at, claim_id = heapq.heappop(_heap)
+            if _deadlines.get(claim_id) == expires_at:
+                del _deadlines[claim_id]
+                due.append(claim_id)
+                earliest = earliest or expires_at
+    return due, earliest
+
+
+def pending_count():
+    return len(_deadlines)
+
+
+def release_expired_claims():
+    """
+    Release claims past expiry plus the claim.expiry_time_delta grace, cancelling
+    their PENDING transactions in the same database transaction. Both UPDATEs
+    re-check status and expires_at, so a claim completed or released since it was
+    scheduled is left alone. Returns the number of claims released.
+    """
+    reseed_seconds = current_app.config['CLAIM_EXPIRY_RESEED_SECONDS']
+    if _state['seeded_at'] is None or time.monotonic() - _state['seeded_at'] > reseed_seconds:
+        seed()
+
+    cutoff = datetime.utcnow() - _state['grace']
+    due, earliest = _pop_due(cutoff)
+    released = 0
+    scheduler_stats.count('items', len(due))
+    if earliest is not None:
+        scheduler_stats.oldest((cutoff - earliest).total_seconds())
+
+    for start in range(0, len(due), RELEASE_BATCH_SIZE):
+        claim_ids = due[start:start + RELEASE_BATCH_SIZE]
+        try:
+            released += _release(claim_ids, cutoff)
+        except Exception as e:
+            db.session.rollback()
+            # Put the batch back for the next tick
+            for claim_id in claim_ids:
+                schedule(claim_id, cutoff)
+            scheduler_stats.count('failures')
+            current_app.logger.error(f"Claim expiry error: {str(e)}")
+
+    if released:
+        claims_book.invalidate()
+        current_app.logger.info(f"Released {released} expired claims")
+    return released
+
+
+def _release(claim_ids, cutoff):
+    now = datetime.utcnow()
+    expired = select(Claim.id).where(
+        Claim.id.in_(claim_ids),
+        Claim.status == 'CLAIMED',
+        Claim.expires_at <= cutoff
+    )
+
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.claim_id.in_(expired), Transaction.status == TransactionStatus.PENDING)
+        .values(status=TransactionStatus.CANCELLED, error_message='Claim expired',
+                version=Transaction.version + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        update(Claim)
+        .where(Claim.id.in_(claim_ids), Claim.status == 'CLAIMED', Claim.expires_at <= cutoff)
+        .values(status='AVAILABLE', claimed_by=None, claimed_at=None, expires_at=None,
+                version=Claim.version + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        platform_metrics.increment_metric(platform_metrics.CLAIMS_EXPIRED, result.rowcount)
+    db.session.commit()
+    return result.rowcount
+
+
+@state_machine.on_enter(Claim, 'CLAIMED')
+def _claim_claimed(claim, old_status, context):
+    schedule(claim.id, claim.expires_at)
+
+
+@state_machine.on_enter(Claim, 'AVAILABLE')
+@state_machine.on_enter(Claim, 'COMPLETED')
+def _claim_settled(claim, old_status, context):
+    unschedule(claim.id)
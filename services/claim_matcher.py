@@ -0,0 +1,161 @@
+"""
+Match a buy order to the available claim closest to the requested amount.
+
+Candidates come from the in-memory claims book, nearest amount first, with
+equally near claims shuffled so concurrent buyers of the same amount spread
+over them. Each candidate is claimed by compare-and-swap; a buyer who loses a
+race moves straight on to the next candidate instead of going back to the
+list and failing with "Invalid claim status".
+
+Amounts no single claim covers are filled from several claims at once, and an
+admin can split a large claim into buyer-sized pieces.
+"""
+import random
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models.models import db, Claim
+from models.types import to_units, from_units
+from services import claims_book, state_machine
+
+# Equally near claims are shuffled over a pool this many times CLAIM_MATCH_CANDIDATES,
+# so buyers of the same amount do not all start on the same few claims
+POOL_FACTOR = 4
+
+
+class NoMatch(Exception):
+    pass
+
+
+def match_claim(user_id, amount_inr, bank_name=None, expiry_minutes=30):
+    """
+    Claim the available claim nearest to amount_inr, within CLAIM_MATCH_TOLERANCE_PERCENT
+    and the MIN_BUY_INR to MAX_BUY_INR limits of a buy order, for user_id, trying up to
+    CLAIM_MATCH_CANDIDATES candidates. Call inside the caller's database transaction; the
+    caller commits. Raises NoMatch when none could be claimed.
+    """
+    config = current_app.config
+    tolerance = amount_inr * config['CLAIM_MATCH_TOLERANCE_PERCENT'] / 100
+    low = max(amount_inr - tolerance, config['MIN_BUY_INR'])
+    high = min(amount_inr + tolerance, config['MAX_BUY_INR'])
+    attempts = config['CLAIM_MATCH_CANDIDATES']
+    candidates, _ = claims_book.get_book().query(bank_name, near=amount_inr, limit=attempts * POOL_FACTOR)
+    candidates = sorted(
+        (candidate for candidate in candidates if low <= candidate['amount_inr'] <= high),
+        key=lambda candidate: (abs(candidate['amount_inr'] - amount_inr), random.random())
+    )
+
+    for candidate in candidates[:attempts]:
+        # The book may lag changes made by other processes; the CAS below is what decides
+        claim = db.session.get(Claim, candidate['id'], populate_existing=True)
+        if claim is None or claim.status != 'AVAILABLE' or not claim.is_active:
+            continue
+        try:
+            state_machine.transition(
+                claim, 'CLAIMED',
+                claimed_by=user_id,
+                claimed_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(minutes=expiry_minutes)
+            )
+            return claim
+        except state_machine.ConcurrentUpdate:
+            # A lost compare-and-swap wrote nothing and ran no hooks, so there is nothing to undo
+            continue
+
+    raise NoMatch(f'No available claim near {amount_inr} INR')
+
+
+def fill_claims(user_id, amount_inr, bank_name=None, expiry_minutes=30):
+    """
+    Claim up to CLAIM_FILL_MAX_PIECES available claims, each within the MIN_BUY_INR
+    to MAX_BUY_INR limits of a buy order, adding up to within
+    CLAIM_MATCH_TOLERANCE_PERCENT of amount_inr for user_id, all of them or none.
+    A plan losing any piece is rolled back and planned again without that claim,
+    up to CLAIM_MATCH_CANDIDATES times. Call inside the caller's database
+    transaction; the caller commits. Returns the claims; raises NoMatch.
+    """
+    config = current_app.config
+    tolerance = amount_inr * config['CLAIM_MATCH_TOLERANCE_PERCENT'] / 100
+    max_pieces = config['CLAIM_FILL_MAX_PIECES']
+    lost = set()
+
+    for _ in range(config['CLAIM_MATCH_CANDIDATES']):
+        plan = claims_book.get_book().fill(amount_inr, bank_name, max_pieces, tolerance, exclude=lost,
+                                           low=config['MIN_BUY_INR'], high=config['MAX_BUY_INR'])
+        if not plan:
+            break
+
+        # The book may lag changes made by other processes; read the pieces once, before the savepoint
+        ids = [entry['id'] for entry in plan]
+        found = {claim.id: claim for claim in Claim.query.filter(Claim.id.in_(ids)).populate_existing()}
+        stale = [claim_id for claim_id in ids if claim_id not in found
+                 or found[claim_id].status != 'AVAILABLE' or not found[claim_id].is_active]
+        if stale:
+            lost.update(stale)
+            continue
+
+        claims = []
+        try:
+            with db.session.begin_nested():
+                for claim_id in ids:
+                    state_machine.transition(
+                        found[claim_id], 'CLAIMED',
+                        claimed_by=user_id,
+                        claimed_at=datetime.utcnow(),
+                        expires_at=datetime.utcnow() + timedelta(minutes=expiry_minutes)
+                    )
+                    claims.append(found[claim_id])
+            return claims
+        except state_machine.ConcurrentUpdate:
+            # The savepoint undid the pieces already claimed
+            lost.add(ids[len(claims)])
+
+    raise NoMatch(f'No available claims adding up to {amount_inr} INR')
+
+
+def split_amounts(amount_inr, piece_amount, min_piece, max_piece):
+    """
+    amount_inr cut into pieces of piece_amount, plus the remainder as a last piece
+    when it is at least min_piece, otherwise added to the last full piece. Every
+    piece must be of min_piece to max_piece, or ValueError is raised.
+    """
+    if not min_piece <= piece_amount <= max_piece:
+        raise ValueError(f'Piece amount must be between {min_piece} and {max_piece}')
+    count, remainder = divmod(to_units(amount_inr), to_units(piece_amount))
+    pieces = [to_units(piece_amount)] * count
+    if remainder and pieces and from_units(remainder) < min_piece:
+        pieces[-1] += remainder
+        if from_units(pieces[-1]) > max_piece:
+            raise ValueError(f'The remainder of {from_units(remainder)} is below {min_piece} '
+                             f'and would take the last piece above {max_piece}')
+    elif remainder:
+        pieces.append(remainder)
+    return [from_units(piece) for piece in pieces]
+
+
+def split_claim(claim, piece_amount, min_piece, max_piece):
+    """
+    Replace an AVAILABLE or DISABLED claim with claims on the same bank account of
+    piece_amount each (see split_amounts), leaving it SPLIT. The pieces start in the
+    claim's state. Call inside the caller's database transaction; the caller commits
+    and invalidates the claims book. Returns the pieces.
+    """
+    amounts = split_amounts(claim.amount_inr, piece_amount, min_piece, max_piece)
+    if len(amounts) < 2:
+        raise ValueError('Piece amount must be less than the claim amount')
+
+    available = claim.status == 'AVAILABLE' and claim.is_active
+    state_machine.transition(claim, 'SPLIT', is_active=False)
+    pieces = [Claim(
+        bank_name=claim.bank_name,
+        account_number=claim.account_number,
+        ifsc_code=claim.ifsc_code,
+        account_holder=claim.account_holder,
+        amount_inr=amount,
+        is_active=available,
+        status='AVAILABLE' if available else 'DISABLED',
+        parent_id=claim.id
+    ) for amount in amounts]
+    db.session.add_all(pieces)
+    return pieces
@@ -0,0 +1,263 @@
+"""
+In-memory book of the claims buyers can pick from.
+
+Available claims are kept sorted by amount, overall and per bank, so the
+"recommended" nearest-amount ordering is a bisect plus a walk outwards instead
+of ORDER BY ABS(amount - x) over the table, and the bank list is cached. The
+same sorted lists let fill() pick several claims adding up to a large amount.
+
+Claim state changes made in this process update the book after they commit,
+through the state machine hooks. Changes made elsewhere (other processes, bulk
+expiry, admin edits) are picked up by comparing a cheap change marker,
+MAX(updated_at) and COUNT(*) over claims, at most every
+CLAIMS_BOOK_CHECK_SECONDS, and reloading when it moved.
+"""
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, func
+
+from models.models import db, Claim
+from services import state_machine
+
+# Timestamps are stored to the second on MySQL, so a marker this recent may not yet show every change
+MARKER_SETTLE = timedelta(seconds=2)
+
+_PENDING_KEY = 'claims_book_changes'
+
+
+def _digest(claim_id, version):
+    return zlib.crc32(f'{claim_id}:{version}'.encode())
+
+
+class ClaimsBook:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claims = {}
+        self._sorted = {None: []}  # bank name -> [(amount, id)], None -> every bank
+        self._banks = []
+        self._fingerprint = 0
+        self._marker = None
+        self._checked_at = None
+
+    def load(self, claims):
+        with self._lock:
+            self._claims = {}
+            self._sorted = {None: []}
+            self._fingerprint = 0
+            for claim in claims:
+                self._add(claim)
+            self._refresh_banks()
+
+    def apply(self, claims, removed_ids):
+        with self._lock:
+            if self._marker is None:
+                # Not loaded yet, or invalidated: the next read reloads it anyway
+                return
+            for claim_id in removed_ids:
+                self._remove(claim_id)
+            for claim in claims:
+                self._remove(claim['id'])
+                self._add(claim)
+            self._refresh_banks()
+
+    def _add(self, claim):
+        self._claims[claim['id']] = claim
+        key = (claim['amount_inr'], claim['id'])
+        insort(self._sorted[None], key)
+        insort(self._sorted.setdefault(claim['bank_name'], []), key)
+        self._fingerprint ^= _digest(claim['id'], claim['version'])
+
+    def _remove(self, claim_id):
+        claim = self._claims.pop(claim_id, None)
+        if claim is None:
+            return
+        key = (claim['amount_inr'], claim['id'])
+        for entries in (self._sorted[None], self._sorted[claim['bank_name']]):
+            del entries[bisect_left(entries, key)]
+        if not self._sorted[claim['bank_name']]:
+            del self._sorted[claim['bank_name']]
+        self._fingerprint ^= _digest(claim['id'], claim['version'])
+
+    def _refresh_banks(self):
+        self._banks = sorted(bank for bank in self._sorted if bank is not None)
+
+    @property
+    def banks(self):
+        return list(self._banks)
+
+    @property
+    def etag(self):
+        """Identifies the book's content, the same in every process holding the same claims"""
+        return f'{self._fingerprint:08x}-{len(self._claims)}'
+
+    def query(self, bank_name=None, order='asc', near=None, offset=0, limit=None):
+        """Claims of a bank (or all banks) in amount order, or nearest to `near` first. Returns (claims, total)"""
+        with self._lock:
+            entries = self._sorted.get(bank_name, [])
+            total = len(entries)
+            end = total if limit is None else min(total, offset + limit)
+
+            if near is not None:
+                ids = _nearest(entries, near, end)[offset:end]
+            elif order == 'desc':
+                ids = [claim_id for _, claim_id in reversed(entries[total - end:total - offset])]
+            else:
+                ids = [claim_id for _, claim_id in entries[offset:end]]
+
+            return [self._claims[claim_id] for claim_id in ids], total
+
+    def fill(self, amount, bank_name=None, max_pieces=1, tolerance=0, exclude=(), low=None, high=None):
+        """
+        At most max_pieces claims of a bank (or all banks), each of low to high
+        if given, adding up to within tolerance of amount, or []
+        """
+        with self._lock:
+            ids = _fill(self._sorted.get(bank_name, []), amount, max_pieces, tolerance, set(exclude), low, high)
+            return [self._claims[claim_id] for claim_id in ids]
+
+
+def _nearest(entries, amount, count):
+    """The first `count` ids of entries ordered by distance from amount, walking out from its bisect position"""
+    right = bisect_left(entries, (amount,))
+    left = right - 1
+    ids = []
+    while len(ids) < count and (left >= 0 or right < len(entries)):
+        if right >= len(entries) or (left >= 0 and amount - entries[left][0] <= entries[right][0] - amount):
+            ids.append(entries[left][1])
+            left -= 1
+        else:
+            ids.append(entries[right][1])
+            right += 1
+    return ids
+
+
+def _nearest_unused(entries, amount, used, start=0, end=None):
+    end = len(entries) if end is None else end
+    right = min(max(bisect_left(entries, (amount,)), start), end)
+    left = right - 1
+    while left >= start and entries[left][1] in used:
+        left -= 1
+    while right < end and entries[right][1] in used:
+        right += 1
+    if right >= end or (left >= start and amount - entries[left][0] <= entries[right][0] - amount):
+        return entries[left] if left >= start else None
+    return entries[right]
+
+
+def _largest_unused(entries, limit, used, start=0, end=None):
+    end = len(entries) if end is None else end
+    index = min(bisect_right(entries, (limit, float('inf'))), end) - 1
+    while index >= start and entries[index][1] in used:
+        index -= 1
+    return entries[index] if index >= start else None
+
+
+def _fill(entries, amount, max_pieces, tolerance, used, low=None, high=None):
+    """
+    Ids of at most max_pieces entries, each of low to high if given, summing to
+    within tolerance of amount, or [].
+
+    Best fit decreasing: when some entry is within tolerance of what is left it
+    closes the fill; otherwise take the largest entry that still leaves at least
+    the smallest amount in the book for a later piece, and repeat. Every step is
+    a bisect, so a fill costs O(max_pieces * log n) whatever the size of the book.
+    """
+    # The entries of low to high are entries[start:end], searched in place rather than copied
+    start = 0 if low is None else bisect_left(entries, (low,))
+    end = len(entries) if high is None else bisect_right(entries, (high, float('inf')))
+    used = set(used)
+    picked = []
+    remaining = amount
+    while start < end and len(picked) < max_pieces:
+        closing = _nearest_unused(entries, remaining, used, start, end)
+        if closing is None:
+            break
+        if abs(closing[0] - remaining) <= tolerance:
+            return picked + [closing[1]]
+        if len(picked) == max_pieces - 1:
+            break
+        piece = _largest_unused(entries, remaining - entries[start][0] + tolerance, used, start, end)
+        if piece is None:
+            break
+        picked.append(piece[1])
+        used.add(piece[1])
+        remaining -= piece[0]
+    return []
+
+
+_book = ClaimsBook()
+
+
+def _serialize(claim):
+    return {
+        'id': claim.id,
+        'bank_name': claim.bank_name,
+        'account_number': claim.account_number,
+        'ifsc_code': claim.ifsc_code,
+        'account_holder': claim.account_holder,
+        'amount_inr': claim.amount_inr,
+        'status': claim.status,
+        'version': claim.version,
+        'created_at': claim.created_at.isoformat()
+    }
+
+
+def _available():
+    return Claim.query.filter(Claim.is_active == True, Claim.status == 'AVAILABLE')
+
+
+def _change_marker():
+    return db.session.query(func.max(Claim.updated_at), func.count(Claim.id)).one()
+
+
+def get_book():
+    """The book, reloaded first if claims changed elsewhere since the last check"""
+    now = time.monotonic()
+    if _book._checked_at is None or now - _book._checked_at >= current_app.config['CLAIMS_BOOK_CHECK_SECONDS']:
+        marker = tuple(_change_marker())
+        settling = marker[0] is not None and marker[0] >= datetime.utcnow() - MARKER_SETTLE
+        if marker != _book._marker or settling:
+            _book.load(_serialize(claim) for claim in _available().order_by(Claim.id))
+            _book._marker = marker
+        _book._checked_at = now
+    return _book
+
+
+def invalidate():
+    """Reload on the next read, for bulk changes that bypass the state machine"""
+    _book._checked_at = None
+    _book._marker = None
+
+
+@state_machine.on_enter(Claim, 'AVAILABLE')
+@state_machine.on_enter(Claim, 'CLAIMED')
+@state_machine.on_enter(Claim, 'COMPLETED')
+@state_machine.on_enter(Claim, 'DISABLED')
+@state_machine.on_enter(Claim, 'SPLIT')
+def _claim_changed(claim, old_status, context):
+    # Applied once the change commits, when the claim can no longer be read; a rolled back request leaves the book alone
+    available = claim.status == 'AVAILABLE' and claim.is_active
+    db.session.info.setdefault(_PENDING_KEY, {})[claim.id] = _serialize(claim) if available else None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_pending(session):
+    changed = session.info.pop(_PENDING_KEY, None)
+    if not changed:
+        return
+    # The data is already committed; never fail the request over the book
+    try:
+        _book.apply([claim for claim in changed.values() if claim], list(changed))
+    except Exception as e:
+        invalidate()
+        current_app.logger.error(f"Claims book update error: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
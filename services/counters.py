@@ -0,0 +1,26 @@
+from sqlalchemy import update, insert
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+
+
+def increment(model, keys, deltas):
+    """
+    Add deltas to the counter row identified by keys, creating it if missing.
+
+    The increment is a single UPDATE ... SET col = col + :delta so concurrent
+    writers never lose updates. The row is inserted on first use; if another
+    writer inserts it first the unique constraint fails and the UPDATE is retried.
+    """
+    filters = [getattr(model, key) == value for key, value in keys.items()]
+    values = {getattr(model, column): getattr(model, column) + delta for column, delta in deltas.items()}
+
+    statement = update(model).where(*filters).values(values).execution_options(synchronize_session=False)
+    if db.session.execute(statement).rowcount:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model).values(**keys, **deltas))
+    except IntegrityError:
+        db.session.execute(statement)
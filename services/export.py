@@ -0,0 +1,141 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import Response, stream_with_context, current_app
+
+from models.models import db, Transaction, User, Claim, BankAccount
+
+EXPORT_CHUNK_SIZE = 1000
+
+EXPORT_COLUMNS = [
+    ('id', Transaction.id),
+    ('rupal_id', Transaction.rupal_id),
+    ('user_mobile', User.mobile),
+    ('type', Transaction.transaction_type),
+    ('status', Transaction.status),
+    ('amount_usdt', Transaction.amount_usdt),
+    ('amount_inr', Transaction.amount_inr),
+    ('exchange_rate', Transaction.exchange_rate),
+    ('fee_usdt', Transaction.fee_usdt),
+    ('payment_mode', Transaction.payment_mode),
+    ('payment_reference', Transaction.payment_reference),
+    ('blockchain_txn_id', Transaction.blockchain_txn_id),
+    ('to_address', Transaction.to_address),
+    ('claim_bank_name', Claim.bank_name),
+    ('claim_account_holder', Claim.account_holder),
+    ('claim_account_number', Claim.account_number),
+    ('claim_ifsc_code', Claim.ifsc_code),
+    ('bank_name', BankAccount.bank_name),
+    ('account_holder', BankAccount.account_holder),
+    ('account_number', BankAccount.account_number),
+    ('ifsc_code', BankAccount.ifsc_code),
+    ('created_at', Transaction.created_at),
+    ('completed_at', Transaction.completed_at),
+]
+
+EXPORT_FIELDS = ['id', 'rupal_id', 'user_mobile', 'type', 'status', 'amount_usdt', 'amount_inr',
+                 'exchange_rate', 'fee_usdt', 'payment_mode', 'payment_reference', 'blockchain_txn_id',
+                 'to_address', 'bank_name', 'account_holder', 'account_number', 'ifsc_code',
+                 'created_at', 'completed_at']
+
+
+def build_export_query():
+    """Column-only transaction query with the joins needed for an export row"""
+    return (db.session.query(*[column for _, column in EXPORT_COLUMNS])
+            .select_from(Transaction)
+            .join(User, Transaction.user_id == User.id)
+            .outerjoin(Claim, Transaction.claim_id == Claim.id)
+            .outerjoin(BankAccount, Transaction.bank_account_id == BankAccount.id))
+
+
+def iter_transaction_rows(query, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield export rows as dicts, newest first.
+
+    Rows are fetched with keyset pagination on the primary key so every chunk is
+    an index range read and only one chunk is held in memory at a time.
+    """
+    names = [name for name, _ in EXPORT_COLUMNS]
+    last_id = None
+
+    while True:
+        chunk_query = query
+        if last_id is not None:
+            chunk_query = chunk_query.filter(Transaction.id < last_id)
+
+        chunk = chunk_query.order_by(Transaction.id.desc()).limit(chunk_size).all()
+        if not chunk:
+            return
+
+        for values in chunk:
+            yield _format_row(dict(zip(names, values)))
+
+        last_id = chunk[-1][0]
+        if len(chunk) < chunk_size:
+            return
+
+
+def _format_row(row):
+    # Bank details shown to users come from the claim for buys and the user's account for sells
+    claim_details = {key: row.pop(f'claim_{key}')
+                     for key in ('bank_name', 'account_holder', 'account_number', 'ifsc_code')}
+    if claim_details['bank_name'] is not None:
+        row.update(claim_details)
+
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            row[key] = value.isoformat()
+        elif hasattr(value, 'value'):
+            row[key] = value.value
+    return row
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps({field: row.get(field) for field in EXPORT_FIELDS}) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', _csv_lines),
+    'ndjson': ('application/x-ndjson', _ndjson_lines),
+}
+
+
+def export_response(query, export_format, filename):
+    """Stream an export query as a CSV or NDJSON download"""
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unsupported export format: {export_format}')
+
+    mimetype, serializer = EXPORT_FORMATS[export_format]
+
+    def generate():
+        try:
+            yield from serializer(iter_transaction_rows(query))
+        except Exception as e:
+            current_app.logger.error(f"Transaction export error: {str(e)}")
+            raise
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}.{export_format}',
+            'X-Accel-Buffering': 'no'
+        }
+    )
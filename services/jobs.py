@@ -0,0 +1,254 @@
+"""
+Durable background job queue on the application database.
+
+A job is a Job row holding its kind, JSON payload, priority and run_at.
+enqueue() adds it to the caller's session, so it is committed, or rolled back,
+together with the work that asked for it, and the request returns at once.
+
+Workers take jobs with dequeue(). The next due job is selected FOR UPDATE SKIP
+LOCKED, so concurrent workers pass over a row another worker is claiming
+instead of queueing behind its lock, and is then claimed with an UPDATE
+conditional on its status, which keeps two workers from taking the same job on
+databases without SKIP LOCKED. A failed job is queued again after a delay that
+doubles with each attempt until it has used max_attempts. A job whose worker
+died is queued again by requeue_stale() once its lease runs out.
+
+Handlers working in batches commit each batch together with progress(), so the
+progress shown is exactly the work committed, the lease stays fresh, and a
+retried job can resume from job.processed.
+
+Other queues ride on the same workers: a poller() is called on every pass
+before the worker looks for a job, and housekeeping() functions once a minute.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models.models import db, Job, JobStatus
+from services import log_pipeline
+
+PRIORITY_HIGH = 10
+PRIORITY_NORMAL = 0
+PRIORITY_LOW = -10
+
+HOUSEKEEPING_SECONDS = 60
+
+_handlers = {}
+_pollers = []
+_housekeeping = []
+
+
+def handler(kind, max_attempts=None):
+    """Register handler(job, payload) -> result for jobs of a kind, with its default attempts"""
+    def register(fn):
+        _handlers[kind] = (fn, max_attempts)
+        return fn
+    return register
+
+
+def poller(fn):
+    """Register fn() -> how much work it did, for every worker to call before it looks for a job"""
+    _pollers.append(fn)
+    return fn
+
+
+def housekeeping(fn):
+    """Register fn() for every worker to call once every HOUSEKEEPING_SECONDS"""
+    _housekeeping.append(fn)
+    return fn
+
+
+def enqueue(kind, payload, total=0, created_by=None, priority=PRIORITY_NORMAL, run_at=None, max_attempts=None):
+    """
+    Add a job to the current session and flush it, so it is queued when the
+    caller commits. run_at delays it; max_attempts overrides the kind's default,
+    itself defaulting to JOB_MAX_ATTEMPTS. Returns the Job.
+    """
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind {kind}')
+
+    job = Job(kind=kind,
+              payload=json.dumps(payload),
+              total=total,
+              created_by=created_by,
+              priority=priority,
+              run_at=run_at or datetime.utcnow(),
+              max_attempts=max_attempts or _handlers[kind][1] or current_app.config['JOB_MAX_ATTEMPTS'],
+              status=JobStatus.QUEUED)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def dequeue(worker_id):
+    """Claim the next due job for worker_id and commit. Returns the Job, or None if no job is due"""
+    while True:
+        now = datetime.utcnow()
+        job_id = (db.session.query(Job.id)
+                  .filter(Job.status == JobStatus.QUEUED, Job.run_at <= now)
+                  .order_by(Job.priority.desc(), Job.run_at, Job.id)
+                  .limit(1)
+                  .with_for_update(skip_locked=True)
+                  .scalar())
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = Job.query.filter(Job.id == job_id, Job.status == JobStatus.QUEUED).update({
+            'status': JobStatus.RUNNING,
+            'locked_by': worker_id,
+            'locked_at': now,
+            'started_at': db.func.coalesce(Job.started_at, now),
+            'attempts': Job.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+
+
+def run(job):
+    """
+    Run a claimed job and commit its outcome: COMPLETED with the handler's result,
+    QUEUED again with backoff if it failed with attempts left, otherwise FAILED.
+    Returns True if the job completed.
+    """
+    job_id, kind = job.id, job.kind
+    try:
+        fn, _ = _handlers[kind]
+        with log_pipeline.context(job_id=job_id, job_kind=kind):
+            result = fn(job, json.loads(job.payload or 'null'))
+        job.status = JobStatus.COMPLETED
+        job.result = json.dumps(result)
+        job.error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Job {job_id} ({kind}) error: {str(e)}", extra={'job_id': job_id, 'job_kind': kind})
+
+        job = db.session.get(Job, job_id)
+        job.error = str(e)[:500]
+        if job.attempts < job.max_attempts:
+            delay = current_app.config['JOB_RETRY_SECONDS'] * 2 ** (job.attempts - 1)
+            job.status = JobStatus.QUEUED
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+        else:
+            job.status = JobStatus.FAILED
+            job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+
+def progress(job, processed):
+    """Record a job's progress and renew its lease; commit it with the work it counts"""
+    job.processed = processed
+    job.locked_at = datetime.utcnow()
+
+
+@housekeeping
+def requeue_stale():
+    """
+    Queue again the RUNNING jobs whose worker has not renewed the lease for
+    JOB_LEASE_SECONDS, or fail them if out of attempts. Commits; returns how many.
+    """
+    now = datetime.utcnow()
+    stale = (Job.status == JobStatus.RUNNING,
+             Job.locked_at < now - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS']))
+
+    requeued = Job.query.filter(*stale, Job.attempts < Job.max_attempts).update({
+        'status': JobStatus.QUEUED,
+        'run_at': now,
+        'error': 'Worker stopped renewing its lease'
+    }, synchronize_session=False)
+    failed = Job.query.filter(*stale).update({
+        'status': JobStatus.FAILED,
+        'finished_at': now,
+        'error': 'Worker stopped renewing its lease'
+    }, synchronize_session=False)
+    db.session.commit()
+    return requeued + failed
+
+
+@housekeeping
+def purge():
+    """Delete jobs that finished more than JOB_RETENTION_DAYS ago. Commits; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['JOB_RETENTION_DAYS'])
+    deleted = Job.query.filter(
+        Job.status.in_([JobStatus.COMPLETED, JobStatus.FAILED]),
+        Job.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+class Worker:
+    """Runs the pollers and queued jobs until stopped, with housekeeping as it goes"""
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self):
+        housekeeping_at = 0
+        while not self.stopped.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= housekeeping_at:
+                        for fn in _housekeeping:
+                            fn()
+                        housekeeping_at = time.monotonic() + HOUSEKEEPING_SECONDS
+
+                    busy = sum(fn() for fn in _pollers)
+                    job = dequeue(self.name)
+                    if job is not None:
+                        run(job)
+                    if busy or job is not None:
+                        continue
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Job worker {self.name} error: {str(e)}")
+            self.stopped.wait(self.app.config['JOB_POLL_SECONDS'])
+
+    def start(self, daemon=True):
+        self.thread = threading.Thread(target=self.run, name=f'job-worker-{self.name}', daemon=daemon)
+        self.thread.start()
+
+    def stop(self):
+        """Stop taking jobs; a job already running finishes first"""
+        self.stopped.set()
+
+
+def start_workers(app, count, daemon=True):
+    """Start count worker threads for app. Returns the Workers"""
+    prefix = f'{socket.gethostname()}:{os.getpid()}'
+    workers = [Worker(app, f'{prefix}:{index}') for index in range(count)]
+    for worker in workers:
+        worker.start(daemon=daemon)
+    return workers
+
+
+def to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status.value,
+        'priority': job.priority,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'total': job.total,
+        'processed': job.processed,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'run_at': job.run_at.isoformat() if job.run_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
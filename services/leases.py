@@ -0,0 +1,82 @@
+"""
+Lease-based leader election for singleton scheduled jobs.
+
+Every scheduler process runs every scheduled job, but a job only does its work
+in the process holding that job's lease. A lease is a SchedulerLease row the
+holder renews with an UPDATE conditional on being the holder, and another
+process can only take over with an UPDATE conditional on it having expired, so
+at most one process holds it at a time. The holder renews it on each run; if
+it dies, the lease runs out and the next process to try takes over.
+"""
+import os
+import socket
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models.models import db, SchedulerLease
+
+INSTANCE = f'{socket.gethostname()}:{os.getpid()}'
+
+# Names of the leases this process held when it last tried them
+held = set()
+
+
+def acquire(name, seconds, holder=INSTANCE):
+    """Take or renew the lease on name for seconds. Commits; returns True if holder has it"""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+
+    taken = SchedulerLease.query.filter(
+        SchedulerLease.name == name,
+        SchedulerLease.holder == holder
+    ).update({'expires_at': expires_at}, synchronize_session=False)
+    if not taken:
+        taken = SchedulerLease.query.filter(
+            SchedulerLease.name == name,
+            SchedulerLease.expires_at < now
+        ).update({'holder': holder, 'acquired_at': now, 'expires_at': expires_at}, synchronize_session=False)
+    if not taken and db.session.get(SchedulerLease, name) is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SchedulerLease(name=name, holder=holder, acquired_at=now, expires_at=expires_at))
+            taken = 1
+        except IntegrityError:
+            pass
+    db.session.commit()
+    if holder == INSTANCE:
+        if taken:
+            held.add(name)
+        else:
+            held.discard(name)
+    return bool(taken)
+
+
+def release_all(holder=INSTANCE):
+    """Give up holder's leases, so another process takes over at once. Commits"""
+    SchedulerLease.query.filter(SchedulerLease.holder == holder).update({
+        'expires_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    if holder == INSTANCE:
+        held.clear()
+
+
+def singleton(app, name, fn, lease_seconds):
+    """
+    Wrap fn to run in an app context, and only in the process holding the lease
+    on name. lease_seconds should outlast the gap between two runs, so a live
+    holder renews its lease before another process can take it.
+    """
+    def run():
+        with app.app_context():
+            try:
+                if not acquire(name, lease_seconds):
+                    return
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Lease {name} error: {str(e)}")
+                return
+            fn()
+    return run
@@ -0,0 +1,177 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import update, insert, case, func
+
+from models.models import db, User, LedgerEntry, BalanceSnapshot
+from models.types import money
+
+# Entries younger than this may still belong to uncommitted transactions with lower ids
+SNAPSHOT_LAG = timedelta(minutes=1)
+DRIFT_TOLERANCE = 1e-6
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+def _expire_balances(user_ids):
+    """Users already loaded in this session must re-read their balance after a SQL-side change"""
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, User) and obj.id in user_ids:
+            db.session.expire(obj, ['wallet_balance'])
+
+
+def _apply(user_id, amount, entry_type, transaction=None, note=None, guard=False):
+    statement = update(User).where(User.id == user_id)
+    if guard:
+        statement = statement.where(User.wallet_balance >= -amount)
+    statement = statement.values(wallet_balance=User.wallet_balance + amount) \
+        .execution_options(synchronize_session=False)
+
+    if not db.session.execute(statement).rowcount:
+        if guard:
+            raise InsufficientBalance(f'Insufficient balance for user {user_id}')
+        raise ValueError(f'User {user_id} not found')
+
+    # The row is locked by the UPDATE until commit, so this reads our own result
+    balance_after = db.session.query(User.wallet_balance).filter(User.id == user_id).scalar()
+    db.session.execute(insert(LedgerEntry).values(
+        user_id=user_id,
+        amount=amount,
+        balance_after=balance_after,
+        entry_type=entry_type,
+        transaction_id=transaction.id if transaction is not None else None,
+        note=note[:255] if note else None,
+        created_at=datetime.utcnow()
+    ))
+    _expire_balances({user_id})
+    return balance_after
+
+
+def credit(user_id, amount, entry_type, transaction=None, note=None):
+    """
+    Add to a balance with an atomic UPDATE ... SET wallet_balance = wallet_balance + :amount
+    and record the ledger entry. Call inside the caller's database transaction.
+    """
+    return _apply(user_id, amount, entry_type, transaction, note)
+
+
+def debit(user_id, amount, entry_type, transaction=None, note=None):
+    """Subtract from a balance; raises InsufficientBalance instead of going negative"""
+    return _apply(user_id, -amount, entry_type, transaction, note, guard=True)
+
+
+def credit_many(entries, entry_type):
+    """
+    Apply many credits at once: entries are (user_id, amount, transaction_id) tuples,
+    optionally with a note as a fourth element; a negative amount is a debit that is
+    not checked against the balance. Balances move in one UPDATE and the ledger rows
+    are written in one INSERT.
+    """
+    totals = defaultdict(float)
+    for user_id, amount, *_ in entries:
+        totals[user_id] += amount
+    if not totals:
+        return
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(totals))
+        .values(wallet_balance=User.wallet_balance + case(
+            {user_id: money(total) for user_id, total in totals.items()}, value=User.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    balances = dict(db.session.query(User.id, User.wallet_balance).filter(User.id.in_(totals)))
+
+    # Walk each user's entries backwards from the final balance to get every balance_after
+    running = dict(balances)
+    rows = []
+    now = datetime.utcnow()
+    for user_id, amount, transaction_id, *note in reversed(entries):
+        rows.append({
+            'user_id': user_id,
+            'amount': amount,
+            'balance_after': running[user_id],
+            'entry_type': entry_type,
+            'transaction_id': transaction_id,
+            'note': note[0][:255] if note and note[0] else None,
+            'created_at': now
+        })
+        running[user_id] -= amount
+
+    db.session.execute(insert(LedgerEntry), rows[::-1])
+    _expire_balances(set(totals))
+
+
+def take_snapshots(batch_size=1000):
+    """
+    Snapshot the balance of every user with ledger activity since the last run, as of
+    the newest entry old enough to be committed, and record any drift between the balance
+    and the previous snapshot plus the entries in between.
+    Returns (snapshots written, snapshots with drift).
+    """
+    cutoff = db.session.query(func.max(LedgerEntry.id)).filter(
+        LedgerEntry.created_at < datetime.utcnow() - SNAPSHOT_LAG).scalar()
+    if not cutoff:
+        return 0, 0
+
+    high_water = db.session.query(func.max(BalanceSnapshot.ledger_entry_id)).scalar() or 0
+    written = drifted = 0
+    last_user_id = 0
+
+    while True:
+        user_ids = [user_id for user_id, in db.session.query(LedgerEntry.user_id).filter(
+            LedgerEntry.id > high_water,
+            LedgerEntry.id <= cutoff,
+            LedgerEntry.user_id > last_user_id
+        ).group_by(LedgerEntry.user_id).order_by(LedgerEntry.user_id).limit(batch_size)]
+        if not user_ids:
+            break
+
+        balances = dict(db.session.query(User.id, User.wallet_balance).filter(User.id.in_(user_ids)))
+
+        # Entries after the cutoff are already in the balance; take them out to get the balance at the cutoff
+        newer = dict(db.session.query(LedgerEntry.user_id, func.sum(LedgerEntry.amount)).filter(
+            LedgerEntry.user_id.in_(user_ids), LedgerEntry.id > cutoff).group_by(LedgerEntry.user_id))
+
+        latest_ids = db.session.query(func.max(BalanceSnapshot.id)).filter(
+            BalanceSnapshot.user_id.in_(user_ids)).group_by(BalanceSnapshot.user_id)
+        previous = {snapshot.user_id: snapshot for snapshot in
+                    BalanceSnapshot.query.filter(BalanceSnapshot.id.in_(latest_ids))}
+
+        since_previous = defaultdict(float)
+        if previous:
+            lowest = min(snapshot.ledger_entry_id for snapshot in previous.values())
+            for user_id, entry_id, amount in db.session.query(
+                    LedgerEntry.user_id, LedgerEntry.id, LedgerEntry.amount).filter(
+                    LedgerEntry.user_id.in_(list(previous)),
+                    LedgerEntry.id > lowest,
+                    LedgerEntry.id <= cutoff):
+                if entry_id > previous[user_id].ledger_entry_id:
+                    since_previous[user_id] += amount
+
+        rows = []
+        for user_id in user_ids:
+            balance = (balances.get(user_id) or 0) - (newer.get(user_id) or 0)
+            drift = None
+            if user_id in previous:
+                drift = balance - (previous[user_id].balance + since_previous[user_id])
+                if abs(drift) > DRIFT_TOLERANCE:
+                    drifted += 1
+                    current_app.logger.warning(f"Balance drift for user {user_id}: {drift:.6f}")
+            rows.append({
+                'user_id': user_id,
+                'ledger_entry_id': cutoff,
+                'balance': balance,
+                'drift': drift,
+                'created_at': datetime.utcnow()
+            })
+
+        db.session.execute(insert(BalanceSnapshot), rows)
+        db.session.commit()
+        written += len(rows)
+        last_user_id = user_ids[-1]
+
+    return written, drifted
@@ -0,0 +1,212 @@
+"""
+Non-blocking structured logging.
+
+Every record goes to a QueueHandler on the root logger, which only tags it
+with the current request, job or scheduled job ids, samples it, and puts it
+on a bounded queue; a QueueListener thread formats it as one JSON line and
+writes it to the rotating log file. Request, job worker and scheduler threads
+never wait on the disk, and if the queue is ever full a record is dropped and
+counted rather than blocking its thread.
+
+    LOG_LEVEL                 level of the app and root loggers
+    LOG_LEVELS                {logger name: level}, e.g. to quieten werkzeug or apscheduler
+    LOG_SAMPLING              {logger or module name: fraction of its records below WARNING kept}
+    LOG_MAX_BYTES, LOG_BACKUP_COUNT   rotation
+    LOG_CAPTURE_STDOUT        log what is printed as DEBUG records of the stdout logger
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+CONTEXT_FIELDS = ('request_id', 'job_id', 'job_kind', 'scheduled_job')
+
+_context = threading.local()
+_state = {'listener': None, 'handler': None, 'stdout': None}
+
+
+@contextmanager
+def context(**fields):
+    """Tag the records logged by this thread within the block with fields, e.g. job_id"""
+    previous = getattr(_context, 'fields', {})
+    _context.fields = {**previous, **fields}
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+class ContextFilter(logging.Filter):
+    """Adds the request id and the context() fields; runs in the thread that logged the record"""
+
+    def filter(self, record):
+        for key, value in getattr(_context, 'fields', {}).items():
+            setattr(record, key, value)
+        if has_request_context() and 'request_id' in g:
+            record.request_id = g.request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps the given fraction of the records below WARNING of each logger or module named"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name, self.rates.get(record.module))
+        return rate is None or random.random() < rate
+
+
+class _QueueHandler(QueueHandler):
+    dropped = 0
+
+    def prepare(self, record):
+        # The message is rendered here, as its arguments may change once we return; formatting is the listener's
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, where, context ids and any traceback"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class _StreamToLogger:
+    """A file object that logs each line written to it"""
+
+    def __init__(self, logger, level):
+        self.logger = logger
+        self.level = level
+        self.buffers = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.buffers, 'text', '') + text
+        *lines, self.buffers.text = buffer.split('\n')
+        for line in lines:
+            if line.strip():
+                self.logger.log(self.level, line.rstrip())
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def init_app(app):
+    """Give every request an id, from X-Request-ID if the client sent one, and echo it back"""
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID', '')[:64] or uuid.uuid4().hex[:16]
+
+    @app.after_request
+    def return_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+
+def setup(app):
+    """Route app, library and, if LOG_CAPTURE_STDOUT, printed output through the queue to the log file"""
+    config = app.config
+    stop()
+
+    os.makedirs(config['LOG_DIR'], exist_ok=True)
+    file_handler = RotatingFileHandler(os.path.join(config['LOG_DIR'], config['LOG_FILE']),
+                                       maxBytes=config['LOG_MAX_BYTES'],
+                                       backupCount=config['LOG_BACKUP_COUNT'])
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(maxsize=config['LOG_QUEUE_SIZE'])
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(config['LOG_SAMPLING']))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'])
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(config['LOG_LEVEL'])
+    for name, level in config['LOG_LEVELS'].items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    _state.update(listener=listener, handler=handler)
+
+    if config['LOG_CAPTURE_STDOUT'] and _state['stdout'] is None:
+        _state['stdout'] = sys.stdout
+        # Its own level unless LOG_LEVELS sets one, as LOG_LEVEL would drop these DEBUG records before the queue
+        stdout_logger = logging.getLogger('stdout')
+        if 'stdout' not in config['LOG_LEVELS']:
+            stdout_logger.setLevel(logging.DEBUG)
+        sys.stdout = _StreamToLogger(stdout_logger, logging.DEBUG)
+
+
+def stop():
+    """Write out the records still queued and detach the pipeline"""
+    if _state['stdout'] is not None:
+        sys.stdout, _state['stdout'] = _state['stdout'], None
+    if _state['listener'] is not None:
+        logging.getLogger().removeHandler(_state['handler'])
+        _state['listener'].stop()
+        if _state['handler'].dropped:
+            _state['listener'].handlers[0].handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"{_state['handler'].dropped} log records dropped, the queue was full"
+            }))
+        for handler in _state['listener'].handlers:
+            handler.close()
+        _state.update(listener=None, handler=None)
+
+
+atexit.register(stop)
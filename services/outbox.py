@@ -0,0 +1,163 @@
+"""
+Transactional outbox for side effects that need not hold up the change causing them.
+
+publish() writes OutboxEvent rows in the caller's database transaction, so an
+event exists if and only if the change it describes was committed. The job
+workers then call dispatch(), which takes a batch of pending events FOR UPDATE
+SKIP LOCKED, hands each event type's payloads to its subscribers in one call,
+and marks the batch DELIVERED in the same database transaction as the
+subscribers' writes: an event's effects are applied exactly once, whichever
+worker delivers it.
+
+If a batch fails, its events are delivered one at a time so a single bad
+event cannot hold up the rest; an event that keeps failing is retried with
+backoff and set aside as FAILED after OUTBOX_MAX_ATTEMPTS.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+
+from models.models import db, OutboxEvent, OutboxStatus
+from services import jobs
+
+_subscribers = defaultdict(list)
+
+
+class _Taken(Exception):
+    """Another dispatcher delivered some of the batch first"""
+    pass
+
+
+def subscriber(event_type):
+    """Register fn(payloads) to receive every batch of events of a type, in the delivering transaction"""
+    def register(fn):
+        _subscribers[event_type].append(fn)
+        return fn
+    return register
+
+
+def publish(event_type, payloads):
+    """Write one event per payload in the current database transaction; the caller commits"""
+    if not payloads:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(OutboxEvent), [{
+        'event_type': event_type,
+        'payload': json.dumps(payload),
+        'status': OutboxStatus.PENDING,
+        'attempts': 0,
+        'available_at': now,
+        'created_at': now
+    } for payload in payloads])
+
+
+def _deliver(events):
+    now = datetime.utcnow()
+    # Marked first, so a dispatcher racing us on a database without SKIP LOCKED waits here, then finds them gone
+    taken = OutboxEvent.query.filter(
+        OutboxEvent.id.in_([event.id for event in events]),
+        OutboxEvent.status == OutboxStatus.PENDING
+    ).update({
+        'status': OutboxStatus.DELIVERED,
+        'attempts': OutboxEvent.attempts + 1,
+        'delivered_at': now
+    }, synchronize_session=False)
+    if taken != len(events):
+        raise _Taken()
+
+    payloads = defaultdict(list)
+    for event in events:
+        payloads[event.event_type].append(json.loads(event.payload or 'null'))
+    for event_type, batch in payloads.items():
+        for fn in _subscribers[event_type]:
+            fn(batch)
+
+
+def _pending(limit, event_id=None):
+    query = OutboxEvent.query.filter(
+        OutboxEvent.status == OutboxStatus.PENDING,
+        OutboxEvent.available_at <= datetime.utcnow()
+    )
+    if event_id is not None:
+        query = query.filter(OutboxEvent.id == event_id)
+    return query.order_by(OutboxEvent.id).limit(limit).with_for_update(skip_locked=True).all()
+
+
+@jobs.poller
+def dispatch(batch_size=None):
+    """Deliver one batch of due events to their subscribers. Commits; returns how many were delivered"""
+    events = _pending(batch_size or current_app.config['OUTBOX_BATCH_SIZE'])
+    if not events:
+        db.session.commit()
+        return 0
+
+    event_ids = [event.id for event in events]
+    try:
+        _deliver(events)
+        db.session.commit()
+        return len(events)
+    except _Taken:
+        db.session.rollback()
+        return 0
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Outbox batch of {len(event_ids)} events failed, delivering one at a time: {str(e)}")
+
+    delivered = 0
+    for event_id in event_ids:
+        events = _pending(1, event_id)
+        if not events:
+            db.session.commit()
+            continue
+        try:
+            _deliver(events)
+            db.session.commit()
+            delivered += 1
+        except _Taken:
+            db.session.rollback()
+        except Exception as e:
+            db.session.rollback()
+            _failed(event_id, e)
+    return delivered
+
+
+def _failed(event_id, error):
+    current_app.logger.error(f"Outbox event {event_id} error: {str(error)}")
+    event = db.session.get(OutboxEvent, event_id, populate_existing=True)
+    event.attempts += 1
+    event.error = str(error)[:500]
+    if event.attempts >= current_app.config['OUTBOX_MAX_ATTEMPTS']:
+        event.status = OutboxStatus.FAILED
+    else:
+        delay = current_app.config['OUTBOX_RETRY_SECONDS'] * 2 ** (event.attempts - 1)
+        event.available_at = datetime.utcnow() + timedelta(seconds=delay)
+    db.session.commit()
+
+
+def retry_failed(event_ids=None):
+    """Queue FAILED events, or just the given ones, for delivery again. Commits; returns how many"""
+    query = OutboxEvent.query.filter(OutboxEvent.status == OutboxStatus.FAILED)
+    if event_ids is not None:
+        query = query.filter(OutboxEvent.id.in_(event_ids))
+    count = query.update({
+        'status': OutboxStatus.PENDING,
+        'attempts': 0,
+        'available_at': datetime.utcnow()
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+@jobs.housekeeping
+def purge():
+    """Delete events delivered more than OUTBOX_RETENTION_DAYS ago. Commits; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['OUTBOX_RETENTION_DAYS'])
+    deleted = OutboxEvent.query.filter(
+        OutboxEvent.status == OutboxStatus.DELIVERED,
+        OutboxEvent.delivered_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -0,0 +1,224 @@
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, update, insert, delete, case
+from sqlalchemy.exc import IntegrityError
+
+from models.models import db, PlatformMetric, Transaction, TransactionStatus, TransactionType, PooledWallet, \
+    WalletStatus, Claim, ReferralEarning, ReferralStats, User
+from services.counters import increment
+
+TOP_REFERRERS_LIMIT = 5
+
+# Cumulative counters for claim throughput
+CLAIMS_CLAIMED = 'claims.claimed'
+CLAIMS_COMPLETED = 'claims.completed'
+CLAIMS_RELEASED = 'claims.released'
+CLAIMS_EXPIRED = 'claims.expired'
+
+REFERRAL_PAYOUT_USDT = 'referral.payout_usdt'
+REFERRAL_PAYOUT_COUNT = 'referral.payout_count'
+REFERRAL_TOP_REFERRERS = 'referral.top_referrers'
+
+
+def volume_key(transaction_type, payment_mode, measure):
+    return f"volume.{measure}.{transaction_type}.{payment_mode or 'NONE'}"
+
+
+def _type_name(tx_type):
+    return tx_type.name if isinstance(tx_type, TransactionType) else tx_type
+
+
+def record_completed(transactions):
+    """Add completed transactions to the platform volume counters, in the completing DB transaction"""
+    if isinstance(transactions, Transaction):
+        transactions = [transactions]
+
+    deltas = defaultdict(float)
+    for transaction in transactions:
+        tx_type = _type_name(transaction.transaction_type)
+        deltas[volume_key(tx_type, transaction.payment_mode, 'usdt')] += transaction.amount_usdt or 0
+        deltas[volume_key(tx_type, transaction.payment_mode, 'inr')] += transaction.amount_inr or 0
+        deltas[volume_key(tx_type, transaction.payment_mode, 'count')] += 1
+
+    for key in sorted(deltas):
+        increment_metric(key, deltas[key])
+
+
+def record_referral_payout(amount_usdt, count=1):
+    increment_metric(REFERRAL_PAYOUT_USDT, amount_usdt)
+    increment_metric(REFERRAL_PAYOUT_COUNT, count)
+
+
+def increment_metric(key, delta=1):
+    increment(PlatformMetric, {'key': key}, {'value': delta})
+
+
+def _update_many(values, value_of):
+    """One UPDATE setting value to value_of(CASE key ...) for the given keys; returns the keys without a row"""
+    keys = sorted(values)
+    result = db.session.execute(
+        update(PlatformMetric)
+        .where(PlatformMetric.key.in_(keys))
+        .values(value=value_of(case(values, value=PlatformMetric.key)), updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == len(keys):
+        return []
+    existing = {key for key, in db.session.query(PlatformMetric.key).filter(PlatformMetric.key.in_(keys))}
+    return [key for key in keys if key not in existing]
+
+
+def increment_metrics(deltas):
+    """increment_metric() for many keys in one UPDATE; only keys seen for the first time cost more"""
+    if deltas:
+        for key in _update_many(deltas, lambda delta: PlatformMetric.value + delta):
+            increment_metric(key, deltas[key])
+
+
+def set_metrics(values):
+    """set_metric() for many gauges in one UPDATE"""
+    if values:
+        for key in _update_many(values, lambda value: value):
+            set_metric(key, values[key])
+
+
+def set_metric(key, value, payload=None):
+    """Overwrite a gauge metric"""
+    values = {
+        'value': value,
+        'payload': json.dumps(payload) if payload is not None else None,
+        'updated_at': datetime.utcnow()
+    }
+
+    statement = update(PlatformMetric).where(PlatformMetric.key == key).values(**values)
+    if db.session.execute(statement).rowcount:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(PlatformMetric).values(key=key, **values))
+    except IntegrityError:
+        db.session.execute(statement)
+
+
+def get_metrics():
+    """All platform metrics as {key: value}; the table holds a few dozen rows"""
+    return {metric.key: metric.value for metric in PlatformMetric.query.all()}
+
+
+def get_metric(key, default=0):
+    metric = PlatformMetric.query.filter_by(key=key).first()
+    return metric.value if metric else default
+
+
+def get_payload(key, default=None):
+    metric = PlatformMetric.query.filter_by(key=key).first()
+    if not metric or not metric.payload:
+        return default
+    return json.loads(metric.payload)
+
+
+def refresh_gauges():
+    """
+    Recompute point-in-time metrics: queue sizes, wallet pool and claim book state
+    and the top referrers. Each is an indexed count or a small grouped read.
+    """
+    try:
+        queue_sizes = db.session.query(
+            Transaction.transaction_type,
+            Transaction.status,
+            func.count(Transaction.id)
+        ).filter(
+            Transaction.status.in_([TransactionStatus.PENDING, TransactionStatus.PROCESSING])
+        ).group_by(Transaction.transaction_type, Transaction.status).all()
+
+        queue_counts = {f'queue.{tx_type.name}.{status.name}': count for tx_type, status, count in queue_sizes}
+        for tx_type in TransactionType:
+            for status in (TransactionStatus.PENDING, TransactionStatus.PROCESSING):
+                key = f'queue.{tx_type.name}.{status.name}'
+                set_metric(key, queue_counts.get(key, 0))
+
+        wallet_counts = dict(db.session.query(
+            PooledWallet.status, func.count(PooledWallet.id)
+        ).group_by(PooledWallet.status).all())
+        for status in WalletStatus:
+            set_metric(f'wallets.{status.name}', wallet_counts.get(status, 0))
+
+        in_use = wallet_counts.get(WalletStatus.IN_USE, 0)
+        usable = in_use + wallet_counts.get(WalletStatus.AVAILABLE, 0)
+        set_metric('wallets.utilization', round(in_use / usable, 4) if usable else 0)
+
+        claim_counts = db.session.query(Claim.status, func.count(Claim.id)).group_by(Claim.status).all()
+        for status, count in claim_counts:
+            set_metric(f'claims.status.{status}', count)
+
+        top_referrers = db.session.query(
+            User.id,
+            User.mobile,
+            ReferralStats.earning_count,
+            ReferralStats.total_earnings_usdt
+        ).join(
+            ReferralStats,
+            User.id == ReferralStats.user_id
+        ).filter(
+            ReferralStats.earning_count > 0
+        ).order_by(
+            ReferralStats.total_earnings_usdt.desc()
+        ).limit(TOP_REFERRERS_LIMIT).all()
+
+        set_metric(REFERRAL_TOP_REFERRERS, len(top_referrers), [{
+            'user_id': user_id,
+            'mobile': mobile,
+            'earning_count': count,
+            'total_earnings': float(total or 0)
+        } for user_id, mobile, count, total in top_referrers])
+
+        set_metric('metrics.refreshed_at', datetime.utcnow().timestamp())
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Metrics refresh error: {str(e)}")
+
+
+def rebuild():
+    """Recompute the incrementally maintained counters from the source tables"""
+    db.session.execute(delete(PlatformMetric).where(PlatformMetric.key.like('volume.%')))
+
+    volumes = db.session.query(
+        Transaction.transaction_type,
+        Transaction.payment_mode,
+        func.sum(Transaction.amount_usdt),
+        func.sum(Transaction.amount_inr),
+        func.count(Transaction.id)
+    ).filter(
+        Transaction.status == TransactionStatus.COMPLETED
+    ).group_by(Transaction.transaction_type, Transaction.payment_mode).all()
+
+    for tx_type, payment_mode, volume_usdt, volume_inr, count in volumes:
+        set_metric(volume_key(tx_type.name, payment_mode, 'usdt'), volume_usdt or 0)
+        set_metric(volume_key(tx_type.name, payment_mode, 'inr'), volume_inr or 0)
+        set_metric(volume_key(tx_type.name, payment_mode, 'count'), count)
+
+    payout_total, payout_count = db.session.query(
+        func.sum(ReferralEarning.amount_usdt), func.count(ReferralEarning.id)
+    ).one()
+    set_metric(REFERRAL_PAYOUT_USDT, payout_total or 0)
+    set_metric(REFERRAL_PAYOUT_COUNT, payout_count)
+
+    db.session.commit()
+    refresh_gauges()
+
+
+def volume_breakdown(metrics):
+    """Group volume.* metrics into {type: {mode: {'usdt', 'inr', 'count'}}} for display"""
+    breakdown = defaultdict(lambda: defaultdict(dict))
+    for key, value in metrics.items():
+        if not key.startswith('volume.'):
+            continue
+        _, measure, tx_type, payment_mode = key.split('.', 3)
+        breakdown[tx_type][payment_mode][measure] = value
+    return {tx_type: dict(modes) for tx_type, modes in breakdown.items()}
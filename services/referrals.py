@@ -0,0 +1,290 @@
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, insert, select, update, case, literal, func
+
+from models.models import db, User, ReferralAncestor, ReferralCommission, ReferralEarning, Transaction, \
+    TransactionType, ReferralStats, ReferralLevelStats
+from services import platform_metrics, ledger
+from services.counters import increment
+
+# Commission levels change rarely; each process re-reads them at most this often
+LEVELS_CACHE_SECONDS = 60
+
+_levels_cache = {'levels': None, 'loaded_at': 0}
+
+
+def get_commission_levels():
+    """Active commission rates keyed by level, cached in-process"""
+    now = time.monotonic()
+    if _levels_cache['levels'] is None or now - _levels_cache['loaded_at'] > LEVELS_CACHE_SECONDS:
+        levels = ReferralCommission.query.filter_by(is_active=True).all()
+        _levels_cache['levels'] = {level.level: {
+            'buy_commission_percent': level.buy_commission_percent,
+            'sell_commission_percent': level.sell_commission_percent,
+            'min_amount_usdt': level.min_amount_usdt or 0
+        } for level in levels}
+        _levels_cache['loaded_at'] = now
+    return _levels_cache['levels']
+
+
+def invalidate_commission_levels():
+    _levels_cache['levels'] = None
+
+
+def get_uplines(user_ids, max_depth):
+    """{user_id: [(ancestor_id, depth), ...]} nearest first, for many users in one query"""
+    rows = db.session.query(
+        ReferralAncestor.user_id, ReferralAncestor.ancestor_id, ReferralAncestor.depth
+    ).filter(
+        ReferralAncestor.user_id.in_(set(user_ids)),
+        ReferralAncestor.depth <= max_depth
+    ).order_by(ReferralAncestor.user_id, ReferralAncestor.depth).all()
+
+    uplines = defaultdict(list)
+    for user_id, ancestor_id, depth in rows:
+        uplines[user_id].append((ancestor_id, depth))
+    return uplines
+
+
+def _commission_percent(level, transaction):
+    tx_type = transaction.transaction_type
+    if tx_type in (TransactionType.BUY, 'BUY'):
+        return level['buy_commission_percent']
+    return level['sell_commission_percent']
+
+
+def credit_upline(transactions):
+    """
+    Pay referral commissions on completed transactions to every upline level.
+
+    The uplines of all transactions load in one query, earnings are written in
+    one multi-row INSERT and balances move through one ledger batch. Call inside the
+    database transaction that completes them; the caller commits.
+    """
+    if isinstance(transactions, Transaction):
+        transactions = [transactions]
+
+    levels = get_commission_levels()
+    if not transactions or not levels:
+        return []
+
+    uplines = get_uplines([transaction.user_id for transaction in transactions], max(levels))
+
+    earnings = []
+    credits = defaultdict(float)
+    counts = defaultdict(int)
+    level_deltas = defaultdict(lambda: {'earnings_usdt': 0.0, 'earning_count': 0})
+    for transaction in transactions:
+        for ancestor_id, depth in uplines.get(transaction.user_id, []):
+            level = levels.get(depth)
+            if not level or transaction.amount_usdt < level['min_amount_usdt']:
+                continue
+
+            commission_percent = _commission_percent(level, transaction)
+            commission_amount = (transaction.amount_usdt * commission_percent) / 100
+            if commission_amount <= 0:
+                continue
+
+            earnings.append({
+                'user_id': ancestor_id,
+                'transaction_id': transaction.id,
+                'referral_level': depth,
+                'amount_usdt': commission_amount,
+                'commission_percent': commission_percent
+            })
+            credits[ancestor_id] += commission_amount
+            counts[ancestor_id] += 1
+            level_deltas[(ancestor_id, depth)]['earnings_usdt'] += commission_amount
+            level_deltas[(ancestor_id, depth)]['earning_count'] += 1
+
+    if not earnings:
+        return []
+
+    db.session.execute(insert(ReferralEarning), earnings)
+    ledger.credit_many([
+        (earning['user_id'], earning['amount_usdt'], earning['transaction_id']) for earning in earnings
+    ], 'REFERRAL')
+
+    _increment_stats({user_id: {
+        'total_earnings_usdt': credits[user_id],
+        'earning_count': counts[user_id]
+    } for user_id in credits})
+    for user_id, level in sorted(level_deltas):
+        increment(ReferralLevelStats, {'user_id': user_id, 'level': level}, level_deltas[(user_id, level)])
+
+    platform_metrics.record_referral_payout(sum(credits.values()), len(earnings))
+    return earnings
+
+
+def _increment_stats(deltas_by_user):
+    """
+    Add per-user deltas to ReferralStats in one UPDATE. Users without a stats row yet
+    (created before the counters existed) fall back to a row-creating increment.
+    """
+    if not deltas_by_user:
+        return
+
+    columns = {column for deltas in deltas_by_user.values() for column in deltas}
+    values = {
+        column: getattr(ReferralStats, column) + case(
+            {user_id: literal(deltas.get(column, 0), getattr(ReferralStats, column).type)
+             for user_id, deltas in deltas_by_user.items()},
+            value=ReferralStats.user_id, else_=0
+        ) for column in columns
+    }
+    result = db.session.execute(
+        update(ReferralStats)
+        .where(ReferralStats.user_id.in_(deltas_by_user))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == len(deltas_by_user):
+        return
+
+    existing = {user_id for user_id, in db.session.query(ReferralStats.user_id).filter(
+        ReferralStats.user_id.in_(deltas_by_user))}
+    for user_id in sorted(set(deltas_by_user) - existing):
+        increment(ReferralStats, {'user_id': user_id}, deltas_by_user[user_id])
+
+
+def record_signup(user):
+    """
+    Count a new user in their upline's referral stats. Call after the user is flushed,
+    in the same database transaction.
+    """
+    db.session.add(ReferralStats(user_id=user.id))
+    if not user.referred_by:
+        return
+
+    ancestor_ids = [ancestor_id for ancestor_id, in db.session.query(ReferralAncestor.ancestor_id).filter(
+        ReferralAncestor.user_id == user.id)]
+
+    _increment_stats({ancestor_id: {
+        'direct_count': 1 if ancestor_id == user.referred_by else 0,
+        'downline_count': 1
+    } for ancestor_id in ancestor_ids})
+
+
+def get_stats(user_id):
+    """A user's referral counters, zeros if they have none yet"""
+    stats = ReferralStats.query.filter_by(user_id=user_id).first()
+    return stats or ReferralStats(user_id=user_id, direct_count=0, downline_count=0,
+                                  total_earnings_usdt=0.0, earning_count=0)
+
+
+def get_level_earnings(user_id):
+    return ReferralLevelStats.query.filter_by(user_id=user_id).order_by(ReferralLevelStats.level).all()
+
+
+@event.listens_for(User, 'after_insert')
+def _record_ancestry(mapper, connection, target):
+    """A new user's upline is their referrer plus the referrer's upline"""
+    if not target.referred_by:
+        return
+
+    inherited = select(
+        literal(target.id), ReferralAncestor.ancestor_id, ReferralAncestor.depth + 1
+    ).where(ReferralAncestor.user_id == target.referred_by)
+
+    connection.execute(insert(ReferralAncestor).values(
+        user_id=target.id, ancestor_id=target.referred_by, depth=1
+    ))
+    connection.execute(insert(ReferralAncestor).from_select(['user_id', 'ancestor_id', 'depth'], inherited))
+
+
+def rebuild_ancestry():
+    """
+    Rebuild the closure table from User.referred_by one depth at a time:
+    depth 1 is every referral link, depth n + 1 extends depth n by one more referrer.
+    """
+    db.session.query(ReferralAncestor).delete()
+
+    db.session.execute(insert(ReferralAncestor).from_select(
+        ['user_id', 'ancestor_id', 'depth'],
+        select(User.id, User.referred_by, literal(1)).where(User.referred_by.isnot(None))
+    ))
+
+    depth = 1
+    while True:
+        result = db.session.execute(insert(ReferralAncestor).from_select(
+            ['user_id', 'ancestor_id', 'depth'],
+            select(ReferralAncestor.user_id, User.referred_by, literal(depth + 1))
+            .join(User, User.id == ReferralAncestor.ancestor_id)
+            .where(ReferralAncestor.depth == depth, User.referred_by.isnot(None))
+        ))
+        if not result.rowcount:
+            break
+        depth += 1
+
+    db.session.commit()
+    return db.session.query(func.count(ReferralAncestor.id)).scalar()
+
+
+def reconcile_stats(batch_size=1000):
+    """
+    Recompute referral counters from users, the ancestry table and earnings, in
+    user id batches, and correct any that drifted. Stats rows of a batch are locked
+    while it is checked so concurrent increments wait rather than get overwritten.
+    Returns the number of rows corrected.
+    """
+    corrected = 0
+    last_id = 0
+
+    while True:
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(
+            User.id > last_id).order_by(User.id).limit(batch_size)]
+        if not user_ids:
+            break
+        low, high = user_ids[0], user_ids[-1]
+
+        stats = {row.user_id: row for row in ReferralStats.query.filter(
+            ReferralStats.user_id.between(low, high)).with_for_update()}
+        level_stats = {(row.user_id, row.level): row for row in ReferralLevelStats.query.filter(
+            ReferralLevelStats.user_id.between(low, high)).with_for_update()}
+
+        direct = dict(db.session.query(User.referred_by, func.count(User.id)).filter(
+            User.referred_by.between(low, high)).group_by(User.referred_by))
+        downline = dict(db.session.query(ReferralAncestor.ancestor_id, func.count(ReferralAncestor.id)).filter(
+            ReferralAncestor.ancestor_id.between(low, high)).group_by(ReferralAncestor.ancestor_id))
+        earned = {user_id: (total, count) for user_id, total, count in db.session.query(
+            ReferralEarning.user_id, func.sum(ReferralEarning.amount_usdt), func.count(ReferralEarning.id)
+        ).filter(ReferralEarning.user_id.between(low, high)).group_by(ReferralEarning.user_id)}
+        earned_by_level = {(user_id, level): (total, count) for user_id, level, total, count in db.session.query(
+            ReferralEarning.user_id, ReferralEarning.referral_level,
+            func.sum(ReferralEarning.amount_usdt), func.count(ReferralEarning.id)
+        ).filter(ReferralEarning.user_id.between(low, high)).group_by(
+            ReferralEarning.user_id, ReferralEarning.referral_level)}
+
+        for user_id in user_ids:
+            total, count = earned.get(user_id, (0, 0))
+            expected = {
+                'direct_count': direct.get(user_id, 0),
+                'downline_count': downline.get(user_id, 0),
+                'total_earnings_usdt': float(total or 0),
+                'earning_count': count
+            }
+            corrected += _correct(stats.get(user_id), ReferralStats, {'user_id': user_id}, expected)
+
+        for key in set(level_stats) | set(earned_by_level):
+            total, count = earned_by_level.get(key, (0, 0))
+            expected = {'earnings_usdt': float(total or 0), 'earning_count': count}
+            corrected += _correct(level_stats.get(key), ReferralLevelStats,
+                                  {'user_id': key[0], 'level': key[1]}, expected)
+
+        db.session.commit()
+        last_id = high
+
+    return corrected
+
+
+def _correct(row, model, keys, expected):
+    if row is None:
+        db.session.add(model(**keys, **expected))
+        return 1
+
+    drifted = {column: value for column, value in expected.items()
+               if abs((getattr(row, column) or 0) - value) > 1e-6}
+    for column, value in drifted.items():
+        setattr(row, column, value)
+    return 1 if drifted else 0
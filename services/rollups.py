@@ -0,0 +1,124 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, delete
+
+from models.models import db, Transaction, TransactionStatus, TransactionType, UserVolumeRollup, User
+from services.counters import increment
+
+
+def _transaction_type(transaction):
+    tx_type = transaction.transaction_type
+    return tx_type if isinstance(tx_type, TransactionType) else TransactionType[tx_type]
+
+
+def record_completed(transactions):
+    """
+    Add transactions that just reached COMPLETED to the per-user daily rollups.
+    Call inside the same database transaction that completes them.
+    """
+    if isinstance(transactions, Transaction):
+        transactions = [transactions]
+
+    deltas = defaultdict(lambda: {'volume_usdt': 0.0, 'volume_inr': 0.0, 'txn_count': 0})
+    for transaction in transactions:
+        day = (transaction.created_at or datetime.utcnow()).date()
+        delta = deltas[(transaction.user_id, day, _transaction_type(transaction))]
+        delta['volume_usdt'] += transaction.amount_usdt or 0
+        delta['volume_inr'] += transaction.amount_inr or 0
+        delta['txn_count'] += 1
+
+    # Sorted so concurrent writers touch rollup rows in the same order
+    for user_id, day, tx_type in sorted(deltas, key=lambda key: (key[0], key[1], key[2].name)):
+        increment(UserVolumeRollup, {
+            'user_id': user_id,
+            'day': day,
+            'transaction_type': tx_type
+        }, deltas[(user_id, day, tx_type)])
+
+
+def get_user_rollups(user_id, start_day, end_day=None):
+    """Rollup rows for a user between two days inclusive, oldest first"""
+    query = UserVolumeRollup.query.filter(
+        UserVolumeRollup.user_id == user_id,
+        UserVolumeRollup.day >= start_day
+    )
+    if end_day:
+        query = query.filter(UserVolumeRollup.day <= end_day)
+    return query.order_by(UserVolumeRollup.day).all()
+
+
+def backfill(user_id=None, batch_size=1000):
+    """Rebuild rollups from completed transactions, for every user or a single one"""
+    if user_id:
+        total = _backfill_users([user_id])
+        db.session.commit()
+        return total
+
+    db.session.execute(delete(UserVolumeRollup))
+
+    total = 0
+    last_id = 0
+    while True:
+        user_ids = [row[0] for row in (db.session.query(User.id)
+                                       .filter(User.id > last_id)
+                                       .order_by(User.id)
+                                       .limit(batch_size)
+                                       .all())]
+        if not user_ids:
+            break
+
+        total += _backfill_users(user_ids, clear=False)
+        db.session.commit()
+        last_id = user_ids[-1]
+
+    return total
+
+
+def _backfill_users(user_ids, clear=True):
+    if clear:
+        db.session.execute(delete(UserVolumeRollup).where(UserVolumeRollup.user_id.in_(user_ids)))
+
+    day = func.date(Transaction.created_at)
+    grouped = db.session.query(
+        Transaction.user_id,
+        day,
+        Transaction.transaction_type,
+        func.sum(Transaction.amount_usdt),
+        func.sum(Transaction.amount_inr),
+        func.count(Transaction.id)
+    ).filter(
+        Transaction.user_id.in_(user_ids),
+        Transaction.status == TransactionStatus.COMPLETED
+    ).group_by(
+        Transaction.user_id, day, Transaction.transaction_type
+    ).all()
+
+    rows = []
+    for row_user_id, row_day, tx_type, volume_usdt, volume_inr, count in grouped:
+        if isinstance(row_day, str):
+            row_day = datetime.strptime(row_day, '%Y-%m-%d').date()
+        rows.append({
+            'user_id': row_user_id,
+            'day': row_day,
+            'transaction_type': tx_type,
+            'volume_usdt': volume_usdt or 0,
+            'volume_inr': volume_inr or 0,
+            'txn_count': count
+        })
+
+    if rows:
+        db.session.execute(insert(UserVolumeRollup), rows)
+    return len(rows)
+
+
+def analytics_window(period, now=None):
+    """Start day and bucket size for a dashboard analytics period"""
+    today = (now or datetime.utcnow()).date()
+    if period == 'day':
+        return today - timedelta(days=1), 'day'
+    if period == 'week':
+        return today - timedelta(days=7), 'day'
+    if period == 'year':
+        return today - timedelta(days=365), 'month'
+    return today - timedelta(days=30), 'day'
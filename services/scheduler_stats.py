@@ -0,0 +1,157 @@
+"""
+Instrumentation for scheduled jobs.
+
+instrument() wraps a job so that each run records its duration in a histogram,
+its failures, and whatever the job reports about its own work through count()
+and oldest(): items processed, external calls made, and the age of the oldest
+item still waiting when the run started, which is how far behind the job is.
+A listener on the scheduler adds the runs APScheduler did not make: skipped
+because the previous run was still going (max_instances), missed past the
+misfire grace time, and coalesced into one, plus how late each run started.
+
+A run's figures are written as platform metrics under scheduler.<job>.*, in
+one UPDATE for the counters and one for the gauges, so the admin overview and
+the metrics endpoint show them wherever the job ran. Only the process holding
+the job's lease records it.
+"""
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from flask import current_app
+
+from models.models import db, SchedulerLease
+from services import leases, log_pipeline, platform_metrics
+
+# Upper bounds in seconds of the run duration histogram buckets; the last bucket is unbounded
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+COUNTERS = ('runs', 'failures', 'skipped', 'missed', 'coalesced', 'items', 'external_calls', 'duration_sum')
+GAUGES = ('last_run_at', 'last_duration', 'oldest_item_age', 'start_lag')
+
+_local = threading.local()
+_lock = threading.Lock()
+_pending = defaultdict(lambda: defaultdict(float))  # job -> counter deltas from scheduler events
+_lag = {}  # job -> start lag of its latest run, seconds
+
+
+def bucket_label(bound):
+    return '+Inf' if bound is None else f'{bound:g}'
+
+
+def _key(job, name):
+    return f'scheduler.{job}.{name}'
+
+
+def count(name, n=1):
+    """Add n to a counter (items, external_calls) of the scheduled run in progress on this thread, if any"""
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run['counters'][name] += n
+
+
+def oldest(age_seconds):
+    """Report the age of the oldest item the run in progress found waiting"""
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run['oldest_item_age'] = max(run['oldest_item_age'], age_seconds)
+
+
+def instrument(job, fn):
+    """Wrap fn, run inside an app context, to record each run of the job"""
+    def run():
+        _local.run = {'counters': defaultdict(float), 'oldest_item_age': 0.0}
+        started = time.perf_counter()
+        failed = False
+        try:
+            with log_pipeline.context(scheduled_job=job):
+                return fn()
+        except Exception:
+            failed = True
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            stats, _local.run = _local.run, None
+            try:
+                _record(job, duration, failed, stats)
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error(f"Scheduler stats error for {job}: {str(e)}")
+    return run
+
+
+def _record(job, duration, failed, stats):
+    bound = next((bound for bound in DURATION_BUCKETS if duration <= bound), None)
+    deltas = {_key(job, 'runs'): 1,
+              _key(job, 'duration_sum'): duration,
+              _key(job, f'duration_bucket.{bucket_label(bound)}'): 1}
+    if failed:
+        deltas[_key(job, 'failures')] = 1
+    for name, n in stats['counters'].items():
+        deltas[_key(job, name)] = deltas.get(_key(job, name), 0) + n
+
+    with _lock:
+        for name, n in _pending.pop(job, {}).items():
+            deltas[_key(job, name)] = deltas.get(_key(job, name), 0) + n
+        start_lag = _lag.pop(job, 0.0)
+
+    platform_metrics.increment_metrics(deltas)
+    platform_metrics.set_metrics({
+        # Epoch seconds, exact to the microsecond in the double precision metric value
+        _key(job, 'last_run_at'): time.time(),
+        _key(job, 'last_duration'): duration,
+        _key(job, 'oldest_item_age'): stats['oldest_item_age'],
+        _key(job, 'start_lag'): start_lag
+    })
+    db.session.commit()
+
+
+def listen(scheduler):
+    """Count the runs the scheduler skipped, missed or coalesced, and how late runs start"""
+    def on_event(event):
+        # Only the lease holder's runs are the job's runs
+        if event.job_id not in leases.held:
+            return
+        with _lock:
+            if event.code == EVENT_JOB_MAX_INSTANCES:
+                _pending[event.job_id]['skipped'] += 1
+            elif event.code == EVENT_JOB_MISSED:
+                _pending[event.job_id]['missed'] += 1
+            elif event.code == EVENT_JOB_SUBMITTED:
+                run_times = event.scheduled_run_times
+                if len(run_times) > 1:
+                    _pending[event.job_id]['coalesced'] += len(run_times) - 1
+                _lag[event.job_id] = max(0.0, (datetime.now(run_times[-1].tzinfo) - run_times[-1]).total_seconds())
+
+    scheduler.add_listener(on_event, EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED | EVENT_JOB_SUBMITTED)
+
+
+def summary(metrics=None):
+    """Per job figures for the admin overview, with the current lease holder, sorted by job"""
+    metrics = metrics if metrics is not None else platform_metrics.get_metrics()
+    holders = {lease.name: lease for lease in SchedulerLease.query}
+
+    jobs = {}
+    for key, value in metrics.items():
+        if key.startswith('scheduler.'):
+            job, name = key[len('scheduler.'):].split('.', 1)
+            jobs.setdefault(job, {})[name] = value
+
+    rows = []
+    for job in sorted(set(jobs) | set(holders)):
+        values = jobs.get(job, {})
+        runs = values.get('runs', 0)
+        lease = holders.get(job)
+        last_run_at = values.get('last_run_at')
+        rows.append({
+            'job': job,
+            **{name: values.get(name, 0) for name in COUNTERS + GAUGES},
+            'mean_duration': values.get('duration_sum', 0) / runs if runs else 0,
+            'buckets': [(bucket_label(bound), values.get(f'duration_bucket.{bucket_label(bound)}', 0))
+                        for bound in DURATION_BUCKETS + (None,)],
+            'last_run_at': datetime.utcfromtimestamp(last_run_at) if last_run_at else None,
+            'holder': lease.holder if lease and lease.expires_at > datetime.utcnow() else None
+        })
+    return rows
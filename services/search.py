@@ -0,0 +1,232 @@
+import re
+
+from sqlalchemy import event, func, insert, delete, inspect, case
+
+from models.models import db, SearchToken, User, Claim, Transaction
+
+MAX_RANKED_RESULTS = 500
+MIN_TOKEN_MATCH_RATIO = 0.6
+
+REFERENCE_PATTERN = re.compile(r'^PO\d{1,8}$', re.IGNORECASE)
+DIGITS_PATTERN = re.compile(r'^\d+$')
+MOBILE_LENGTH = 10
+REFERENCE_LENGTH = 10
+
+# Text fields indexed as trigrams, per entity type
+INDEXED_FIELDS = {
+    'USER': (User, ('name',)),
+    'CLAIM': (Claim, ('account_holder', 'bank_name')),
+}
+
+
+class QueryType:
+    REFERENCE = 'REFERENCE'
+    DIGITS = 'DIGITS'
+    TEXT = 'TEXT'
+
+
+def detect_query_type(search):
+    """Classify a search string as a transaction reference, a number or free text"""
+    if REFERENCE_PATTERN.match(search):
+        return QueryType.REFERENCE
+    if DIGITS_PATTERN.match(search):
+        return QueryType.DIGITS
+    return QueryType.TEXT
+
+
+def _normalize(text):
+    return re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).split()
+
+
+def index_tokens(text):
+    """Trigrams stored for a field value; words are padded so prefixes get their own grams"""
+    tokens = set()
+    for word in _normalize(text):
+        padded = f' {word} '
+        tokens.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return tokens
+
+
+def query_tokens(text):
+    """Trigrams looked up for a search string; only the start of each word is padded"""
+    tokens = set()
+    for word in _normalize(text):
+        padded = f' {word}'
+        tokens.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return tokens
+
+
+def ranked_ids(entity_type, search, limit=MAX_RANKED_RESULTS):
+    """
+    Rank entity ids by the number of search trigrams they contain.
+    Returns ids ordered best match first.
+    """
+    tokens = query_tokens(search)
+    if not tokens:
+        return []
+
+    min_matches = max(1, int(len(tokens) * MIN_TOKEN_MATCH_RATIO))
+    score = func.count(func.distinct(SearchToken.token))
+
+    rows = (db.session.query(SearchToken.entity_id, score.label('score'))
+            .filter(SearchToken.entity_type == entity_type,
+                    SearchToken.token.in_(tokens))
+            .group_by(SearchToken.entity_id)
+            .having(score >= min_matches)
+            .order_by(score.desc(), SearchToken.entity_id.desc())
+            .limit(limit)
+            .all())
+
+    return [entity_id for entity_id, _ in rows]
+
+
+def _prefix(column, prefix):
+    """Prefix match as an index range, which unlike LIKE is usable by every backend's b-tree"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (column >= prefix) & (column < upper)
+
+
+def _order_by_rank(column, ids):
+    return case({entity_id: rank for rank, entity_id in enumerate(ids)}, value=column)
+
+
+def search_transactions(query, search):
+    """Filter a transaction query by rupal_id, user mobile or user name"""
+    search = search.strip()
+    query_type = detect_query_type(search)
+
+    if query_type == QueryType.REFERENCE:
+        reference = search.upper()
+        if len(reference) == REFERENCE_LENGTH:
+            return query.filter(Transaction.rupal_id == reference)
+        return query.filter(_prefix(Transaction.rupal_id, reference))
+
+    if query_type == QueryType.DIGITS:
+        user_ids = db.session.query(User.id).filter(_prefix(User.mobile, search))
+        return query.filter(
+            _prefix(Transaction.rupal_id, f'PO{search}') |
+            Transaction.user_id.in_(user_ids)
+        )
+
+    return query.filter(Transaction.user_id.in_(ranked_ids('USER', search)))
+
+
+def search_users(query, search):
+    """Filter a user query by mobile prefix, or rank by name similarity"""
+    search = search.strip()
+
+    if detect_query_type(search) == QueryType.DIGITS:
+        if len(search) == MOBILE_LENGTH:
+            return query.filter(User.mobile == search)
+        return query.filter(_prefix(User.mobile, search))
+
+    ids = ranked_ids('USER', search)
+    if not ids:
+        return query.filter(db.false())
+    return query.filter(User.id.in_(ids)).order_by(_order_by_rank(User.id, ids))
+
+
+def search_claims(query, search):
+    """Filter a claim query by account number prefix, or rank by holder/bank similarity"""
+    search = search.strip()
+
+    if detect_query_type(search) == QueryType.DIGITS:
+        return query.filter(_prefix(Claim.account_number, search))
+
+    ids = ranked_ids('CLAIM', search)
+    if not ids:
+        return query.filter(db.false())
+    return query.filter(Claim.id.in_(ids)).order_by(_order_by_rank(Claim.id, ids))
+
+
+def _token_rows(entity_type, entity_id, field, value):
+    return [{
+        'entity_type': entity_type,
+        'entity_id': entity_id,
+        'field': field,
+        'token': token
+    } for token in index_tokens(value)]
+
+
+def _reindex(connection, entity_type, target, fields):
+    connection.execute(
+        delete(SearchToken).where(
+            SearchToken.entity_type == entity_type,
+            SearchToken.entity_id == target.id,
+            SearchToken.field.in_(fields)
+        )
+    )
+
+    rows = []
+    for field in fields:
+        rows.extend(_token_rows(entity_type, target.id, field, getattr(target, field)))
+    if rows:
+        connection.execute(insert(SearchToken), rows)
+
+
+def _register(entity_type, model, fields):
+    @event.listens_for(model, 'after_insert')
+    def after_insert(mapper, connection, target):
+        _reindex(connection, entity_type, target, fields)
+
+    @event.listens_for(model, 'after_update')
+    def after_update(mapper, connection, target):
+        state = inspect(target)
+        changed = [field for field in fields if state.attrs[field].history.has_changes()]
+        if changed:
+            _reindex(connection, entity_type, target, changed)
+
+
+for _entity_type, (_model, _fields) in INDEXED_FIELDS.items():
+    _register(_entity_type, _model, _fields)
+
+
+def _batch_token_rows(entity_type, fields, rows):
+    token_rows = []
+    for entity_id, *values in rows:
+        for field, value in zip(fields, values):
+            token_rows.extend(_token_rows(entity_type, entity_id, field, value))
+    return token_rows
+
+
+def index_ids(entity_type, ids):
+    """Index the rows with these ids in the current session, for inserts that bypass the ORM hooks"""
+    model, fields = INDEXED_FIELDS[entity_type]
+    if not ids:
+        return
+    db.session.execute(
+        delete(SearchToken).where(
+            SearchToken.entity_type == entity_type,
+            SearchToken.entity_id.in_(ids)
+        )
+    )
+    rows = db.session.query(model.id, *[getattr(model, field) for field in fields]).filter(model.id.in_(ids)).all()
+    token_rows = _batch_token_rows(entity_type, fields, rows)
+    if token_rows:
+        db.session.execute(insert(SearchToken), token_rows)
+
+
+def rebuild_index(batch_size=5000):
+    """Rebuild the trigram index from scratch, e.g. after bulk loads that bypass the ORM"""
+    db.session.execute(delete(SearchToken))
+
+    for entity_type, (model, fields) in INDEXED_FIELDS.items():
+        columns = [getattr(model, field) for field in fields]
+        last_id = 0
+
+        while True:
+            batch = (db.session.query(model.id, *columns)
+                     .filter(model.id > last_id)
+                     .order_by(model.id)
+                     .limit(batch_size)
+                     .all())
+            if not batch:
+                break
+
+            rows = _batch_token_rows(entity_type, fields, batch)
+            if rows:
+                db.session.execute(insert(SearchToken), rows)
+
+            last_id = batch[-1][0]
+
+    db.session.commit()
@@ -0,0 +1,219 @@
+"""
+SQL profiling: the statements a request or a block of code issues, their
+count and database time, and the statements repeated with the same shape.
+
+A statement's shape is its SQL with literals, bound parameters and IN lists
+reduced to placeholders, so the lazy load of one row per loop iteration shows
+up as one shape run N times: an N+1.
+
+With SQL_PROFILER on, every request is recorded. A request that repeats a
+shape SQL_PROFILER_REPEAT_THRESHOLD times or more, or runs a statement slower
+than SQL_PROFILER_SLOW_MS, is logged as one JSON line, and the last
+SQL_PROFILER_KEEP requests of the process are kept for the admin view.
+Responses carry X-Query-Count and X-Query-Time-Ms.
+
+query_budget() records a block regardless of SQL_PROFILER and fails when it
+issues more queries than allowed, for tests and benchmark scripts:
+
+    with sql_profiler.query_budget(5, max_repeats=2):
+        client.get('/api/v1/transaction/transactions?page=0', headers=headers)
+"""
+import json
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app, g, request
+from sqlalchemy import event
+
+from models.models import db
+
+_local = threading.local()
+_recent_lock = threading.Lock()
+_recent = deque(maxlen=200)
+_installed = set()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETER = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+_LIST = re.compile(r'\(\?(?:, \?)+\)')
+_ROWS = re.compile(r'(\(\?(?:, \?)*\))(?:, \1)+')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A block issued more queries, or repeated a statement more often, than its budget"""
+    pass
+
+
+def shape(statement):
+    """The statement with literals, parameters and IN lists or VALUES rows reduced to placeholders"""
+    statement = _SPACE.sub(' ', statement).strip()
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _PARAMETER.sub('?', statement)
+    statement = _ROWS.sub(r'\1, ...', statement)
+    return _LIST.sub('(?, ...)', statement)
+
+
+class Recording:
+    """The statements run on this thread while the recording is active"""
+
+    def __init__(self):
+        self.statements = []  # (statement, seconds)
+        self.started = time.perf_counter()
+
+    def add(self, statement, seconds):
+        self.statements.append((statement, seconds))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def db_time(self):
+        return sum(seconds for _, seconds in self.statements)
+
+    def shapes(self):
+        """{shape: [count, seconds]}, most repeated first"""
+        shapes = {}
+        for statement, seconds in self.statements:
+            totals = shapes.setdefault(shape(statement), [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        return dict(sorted(shapes.items(), key=lambda item: -item[1][0]))
+
+    def repeated(self, threshold):
+        return [{'shape': statement, 'count': count, 'ms': round(seconds * 1000, 2)}
+                for statement, (count, seconds) in self.shapes().items() if count >= threshold]
+
+    def slow(self, threshold_ms):
+        return [{'statement': statement[:1000], 'ms': round(seconds * 1000, 2)}
+                for statement, seconds in self.statements if seconds * 1000 >= threshold_ms]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'recordings', None):
+        conn.info.setdefault('sql_profiler_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recordings = getattr(_local, 'recordings', None)
+    started = conn.info.get('sql_profiler_started')
+    if recordings and started:
+        seconds = time.perf_counter() - started.pop()
+        for recording in recordings:
+            recording.add(statement, seconds)
+
+
+def _install(engine):
+    if id(engine) not in _installed:
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        _installed.add(id(engine))
+
+
+def start_recording():
+    """Start recording this thread's statements; needs an app context. Returns the Recording"""
+    _install(db.engine)
+    recording = Recording()
+    if not hasattr(_local, 'recordings'):
+        _local.recordings = []
+    _local.recordings.append(recording)
+    return recording
+
+
+def stop_recording(recording):
+    if recording in getattr(_local, 'recordings', []):
+        _local.recordings.remove(recording)
+
+
+@contextmanager
+def recording():
+    """Record the statements of the block. Yields the Recording"""
+    active = start_recording()
+    try:
+        yield active
+    finally:
+        stop_recording(active)
+
+
+@contextmanager
+def query_budget(max_queries, max_repeats=None):
+    """
+    Record the block and raise QueryBudgetExceeded if it ran more than
+    max_queries statements, or one shape more than max_repeats times
+    """
+    with recording() as active:
+        yield active
+
+    problems = []
+    if active.count > max_queries:
+        problems.append(f'{active.count} queries, budget {max_queries}')
+    if max_repeats is not None:
+        problems.extend(f"{repeat['count']}x {repeat['shape']}" for repeat in active.repeated(max_repeats + 1))
+    if problems:
+        shapes = '\n'.join(f'  {count}x {statement}' for statement, (count, _) in active.shapes().items())
+        raise QueryBudgetExceeded('; '.join(problems) + f'\nStatements run:\n{shapes}')
+
+
+def profile(active, status, duration):
+    """The summary of a request's recording kept for the admin view and logged when flagged"""
+    config = current_app.config
+    return {
+        'at': datetime.utcnow().isoformat(),
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': status,
+        'ms': round(duration * 1000, 2),
+        'queries': active.count,
+        'db_ms': round(active.db_time * 1000, 2),
+        'repeated': active.repeated(config['SQL_PROFILER_REPEAT_THRESHOLD']),
+        'slow': active.slow(config['SQL_PROFILER_SLOW_MS'])
+    }
+
+
+def recent():
+    """The profiles kept by this process, newest first"""
+    with _recent_lock:
+        return list(reversed(_recent))
+
+
+def init_app(app):
+    """Record every request of app if SQL_PROFILER is on"""
+    global _recent
+    if not app.config['SQL_PROFILER']:
+        return
+    _recent = deque(maxlen=app.config['SQL_PROFILER_KEEP'])
+
+    @app.before_request
+    def start_profile():
+        g.sql_recording = start_recording()
+
+    def finish(status, response=None):
+        active = g.pop('sql_recording', None)
+        if active is None:
+            return
+        stop_recording(active)
+        result = profile(active, status, time.perf_counter() - active.started)
+        with _recent_lock:
+            _recent.append(result)
+        if result['repeated'] or result['slow']:
+            app.logger.warning(json.dumps({'event': 'sql_profile', **result}))
+        if response is not None:
+            response.headers['X-Query-Count'] = str(result['queries'])
+            response.headers['X-Query-Time-Ms'] = str(result['db_ms'])
+
+    @app.after_request
+    def finish_profile(response):
+        finish(response.status_code, response)
+        return response
+
+    @app.teardown_request
+    def finish_failed_profile(error):
+        # after_request is skipped when a request fails with an unhandled exception
+        finish(500)
@@ -0,0 +1,236 @@
+"""
+Status transitions for transactions and claims.
+
+Every status change goes through transition(): it checks the move is legal and
+applies it with a compare-and-swap UPDATE ... WHERE id = :id AND version = :version,
+so callers read rows without locking them and a concurrent change makes the
+loser fail with ConcurrentUpdate instead of waiting on a row lock. Side effects
+of entering a status are hooks registered below and run in the caller's database
+transaction. transition_many() moves a batch of rows in one UPDATE, and hooks
+registered with batch=True handle the whole batch at once.
+
+The hooks only do what must be true the moment the status commits: the user's
+own ledger credit or refund and the linked claim. Everything downstream of a
+completion (rollups, platform metrics, referral commissions) and the claim
+counters are published to the outbox in the same commit and applied by the job
+workers in batches, off the request's database transaction.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import update, tuple_
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models.models import db, Transaction, TransactionStatus, TransactionType, Claim
+from services import rollups, platform_metrics, ledger, referrals, outbox
+
+TRANSITIONS = {
+    Transaction: {
+        TransactionStatus.PENDING: {TransactionStatus.PROCESSING, TransactionStatus.COMPLETED,
+                                    TransactionStatus.CANCELLED, TransactionStatus.FAILED},
+        TransactionStatus.PROCESSING: {TransactionStatus.COMPLETED, TransactionStatus.CANCELLED,
+                                       TransactionStatus.FAILED},
+    },
+    Claim: {
+        'AVAILABLE': {'CLAIMED', 'COMPLETED', 'DISABLED', 'SPLIT'},
+        'CLAIMED': {'AVAILABLE', 'COMPLETED'},
+        'DISABLED': {'AVAILABLE', 'SPLIT'},
+    },
+}
+
+_hooks = defaultdict(list)  # (model, status) -> [(hook, batch)]
+
+TRANSACTION_COMPLETED = 'transaction.completed'
+CLAIM_STATUS_CHANGED = 'claim.status_changed'
+
+
+class IllegalTransition(Exception):
+    pass
+
+
+class ConcurrentUpdate(Exception):
+    pass
+
+
+def _status(model, status):
+    if model is Transaction and not isinstance(status, TransactionStatus):
+        return TransactionStatus(status)
+    return status
+
+
+def _name(status):
+    return getattr(status, 'value', status)
+
+
+def can_transition(obj, new_status):
+    model = type(obj)
+    return _status(model, new_status) in TRANSITIONS[model].get(_status(model, obj.status), ())
+
+
+def on_enter(model, status, batch=False):
+    """
+    Register hook(obj, old_status, context) to run whenever a model enters status.
+    With batch=True the hook is hook(objs, old_statuses, context), called once for
+    all the rows a transition_many() moved.
+    """
+    def register(hook):
+        _hooks[(model, status)].append((hook, batch))
+        return hook
+    return register
+
+
+def transition(obj, new_status, context=None, **values):
+    """
+    Move a Transaction or Claim to new_status, setting any other column values in
+    the same UPDATE, then run the hooks for the new status. Raises IllegalTransition
+    for a move the table above does not allow and ConcurrentUpdate if the row changed
+    since it was read. Call inside the caller's database transaction; the caller commits.
+    """
+    transition_many([obj], new_status, context, **values)
+    return obj
+
+
+def transition_many(objs, new_status, context=None, **values):
+    """
+    transition() for many rows of one model in a single compare-and-swap UPDATE on
+    (id, version). All of them move or none: IllegalTransition if any cannot, and
+    ConcurrentUpdate if any changed since it was read, after which the caller must
+    roll back. Hooks then run once per batch, or once per row if not batch hooks.
+    """
+    if not objs:
+        return objs
+    model = type(objs[0])
+    # Pending ORM changes would bump the version under us on autoflush
+    db.session.flush()
+
+    new_status = _status(model, new_status)
+    old_statuses = [_status(model, obj.status) for obj in objs]
+    for obj, old_status in zip(objs, old_statuses):
+        if new_status not in TRANSITIONS[model].get(old_status, ()):
+            raise IllegalTransition(f'{model.__name__} {obj.id} cannot move from '
+                                    f'{_name(old_status)} to {_name(new_status)}')
+
+    if len(objs) == 1:
+        current = (model.id == objs[0].id, model.version == objs[0].version)
+    else:
+        current = (tuple_(model.id, model.version).in_([(obj.id, obj.version) for obj in objs]),)
+
+    values.update(status=new_status, updated_at=datetime.utcnow())
+    result = db.session.execute(
+        update(model)
+        .where(*current)
+        .values(version=model.version + 1, **values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(objs):
+        for obj in objs:
+            db.session.expire(obj)
+        if len(objs) == 1:
+            raise ConcurrentUpdate(f'{model.__name__} {objs[0].id} was changed by another request')
+        raise ConcurrentUpdate(f'{len(objs) - result.rowcount} of {len(objs)} {model.__name__} rows '
+                               f'were changed by another request')
+
+    for obj in objs:
+        for key, value in values.items():
+            set_committed_value(obj, key, value)
+        set_committed_value(obj, 'version', obj.version + 1)
+
+    context = context or {}
+    for hook, batch in _hooks[(model, new_status)]:
+        if batch:
+            hook(objs, old_statuses, context)
+        else:
+            for obj, old_status in zip(objs, old_statuses):
+                hook(obj, old_status, context)
+    return objs
+
+
+def _claims_of(transactions):
+    claim_ids = {transaction.claim_id for transaction in transactions if transaction.claim_id}
+    if not claim_ids:
+        return []
+    return Claim.query.filter(Claim.id.in_(claim_ids)).order_by(Claim.id).all()
+
+
+def publish_completed(transactions):
+    """
+    Publish the completion of transactions, for those created already COMPLETED
+    that never pass through transition(). Call in the creating database transaction.
+    """
+    db.session.flush()
+    outbox.publish(TRANSACTION_COMPLETED, [{'transaction_id': transaction.id} for transaction in transactions])
+
+
+@on_enter(Transaction, TransactionStatus.COMPLETED, batch=True)
+def _transactions_completed(transactions, old_statuses, context):
+    credits = defaultdict(list)
+    for transaction in transactions:
+        # Transactions built in this request may still hold the type as a plain string
+        tx_type = TransactionType(transaction.transaction_type)
+        if tx_type in (TransactionType.BUY, TransactionType.DEPOSIT):
+            credits[tx_type.value].append((transaction.user_id, transaction.amount_usdt, transaction.id))
+    for entry_type, entries in credits.items():
+        ledger.credit_many(entries, entry_type)
+    publish_completed(transactions)
+
+    claims = [claim for claim in _claims_of(transactions) if can_transition(claim, 'COMPLETED')]
+    transition_many(claims, 'COMPLETED', context)
+
+
+@on_enter(Transaction, TransactionStatus.CANCELLED, batch=True)
+def _transactions_cancelled(transactions, old_statuses, context):
+    refunds = [(transaction.user_id, transaction.amount_usdt, transaction.id) for transaction in transactions
+               if TransactionType(transaction.transaction_type) == TransactionType.SELL]
+    if refunds:
+        ledger.credit_many(refunds, 'REFUND')
+
+    release_claims([claim for claim in _claims_of(transactions) if claim.status == 'CLAIMED'], context)
+
+
+@on_enter(Claim, 'CLAIMED', batch=True)
+@on_enter(Claim, 'COMPLETED', batch=True)
+@on_enter(Claim, 'AVAILABLE', batch=True)
+def _claims_changed(claims, old_statuses, context):
+    # Claim counters only count a return to AVAILABLE when it releases a claimed account
+    outbox.publish(CLAIM_STATUS_CHANGED, [
+        {'claim_id': claim.id, 'status': claim.status, 'old_status': old_status}
+        for claim, old_status in zip(claims, old_statuses)
+        if claim.status != 'AVAILABLE' or old_status == 'CLAIMED'
+    ])
+
+
+@outbox.subscriber(TRANSACTION_COMPLETED)
+def _deliver_transactions_completed(payloads):
+    transactions = Transaction.query.filter(
+        Transaction.id.in_({payload['transaction_id'] for payload in payloads})
+    ).order_by(Transaction.id).all()
+
+    rollups.record_completed(transactions)
+    platform_metrics.record_completed(transactions)
+    referrals.credit_upline([transaction for transaction in transactions
+                             if TransactionType(transaction.transaction_type) in (TransactionType.BUY,
+                                                                                  TransactionType.SELL)])
+
+
+@outbox.subscriber(CLAIM_STATUS_CHANGED)
+def _deliver_claims_changed(payloads):
+    counts = defaultdict(int)
+    for payload in payloads:
+        if payload['status'] == 'CLAIMED':
+            counts[platform_metrics.CLAIMS_CLAIMED] += 1
+        elif payload['status'] == 'COMPLETED':
+            counts[platform_metrics.CLAIMS_COMPLETED] += 1
+        elif payload['status'] == 'AVAILABLE':
+            counts[platform_metrics.CLAIMS_RELEASED] += 1
+    for key in sorted(counts):
+        platform_metrics.increment_metric(key, counts[key])
+
+
+def release_claim(claim, context=None):
+    """Return a claimed bank account to the pool"""
+    return transition(claim, 'AVAILABLE', context, claimed_by=None, claimed_at=None, expires_at=None)
+
+
+def release_claims(claims, context=None):
+    """release_claim() for many claims in one UPDATE"""
+    return transition_many(claims, 'AVAILABLE', context, claimed_by=None, claimed_at=None, expires_at=None)
@@ -0,0 +1,306 @@
+"""
+Request, external call and connection pool telemetry, served in the Prometheus
+text format at /metrics.
+
+Observations are added to in-memory counters under a lock, a few dict updates
+per request. A background thread in every process, web or worker, flushes the
+counters every TELEMETRY_FLUSH_SECONDS as platform metrics, in one batched
+UPDATE, together with its connection pool gauges. /metrics reads the table, so
+whichever process is scraped reports the totals of all of them. Histograms are
+stored one row per bucket and made cumulative when rendered.
+
+    http.requests.<method>.<status>.<endpoint>      requests served
+    http.latency.<le|sum>.<endpoint>                request duration
+    external.requests.<status>.<service>            calls to TronGrid and the SMS gateway
+    external.latency.<le|sum>.<service>             their duration
+    pool.<gauge>.<instance>                         SQLAlchemy pool, per process
+    otp.sms.<sent|failed>                           OTP messages
+
+Counters not yet flushed when a process dies are lost.
+"""
+import atexit
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import current_app, g, request
+
+from models.models import db, PlatformMetric
+from services import jobs, platform_metrics, scheduler_stats
+from services.leases import INSTANCE
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+POOL_GAUGES = ('size', 'checked_in', 'checked_out', 'overflow')
+# Anything else a client sends is counted as OTHER, so it cannot add series without bound
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Per process gauges not refreshed for this long belong to a stopped process
+STALE_GAUGE_FLUSHES = 3
+STALE_GAUGE_RETENTION = timedelta(days=1)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+
+
+def _bucket(seconds, buckets=LATENCY_BUCKETS):
+    return scheduler_stats.bucket_label(next((bound for bound in buckets if seconds <= bound), None))
+
+
+def count(key, n=1):
+    """Add n to a counter, flushed to the platform metric key"""
+    with _lock:
+        _counters[key] += n
+
+
+def _observe(prefix, name, seconds, counter):
+    with _lock:
+        _counters[counter] += 1
+        _counters[f'{prefix}.latency.{_bucket(seconds)}.{name}'] += 1
+        _counters[f'{prefix}.latency.sum.{name}'] += seconds
+
+
+def observe_request(endpoint, method, status, seconds):
+    endpoint = endpoint or 'unmatched'
+    method = method if method in HTTP_METHODS else 'OTHER'
+    _observe('http', endpoint, seconds, f'http.requests.{method}.{status}.{endpoint}')
+
+
+class _Call:
+    status = 'error'
+
+
+@contextmanager
+def external_call(service):
+    """
+    Time a call to an external service. Set .status on the yielded object to the
+    HTTP status; a call that raises or leaves it unset is counted as an error.
+    """
+    call = _Call()
+    started = time.perf_counter()
+    try:
+        yield call
+    finally:
+        _observe('external', service, time.perf_counter() - started, f'external.requests.{call.status}.{service}')
+
+
+def init_app(app):
+    """Time every request of app"""
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            observe_request(request.endpoint, request.method, response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error):
+        # after_request is skipped when a request fails with an unhandled exception
+        started = g.pop('request_started', None)
+        if started is not None:
+            observe_request(request.endpoint, request.method, 500, time.perf_counter() - started)
+
+
+def _pool_gauges():
+    pool = db.engine.pool
+    values = {}
+    for gauge, method in zip(POOL_GAUGES, ('size', 'checkedin', 'checkedout', 'overflow')):
+        if hasattr(pool, method):
+            values[f'pool.{gauge}.{INSTANCE}'] = getattr(pool, method)()
+    # QueuePool counts overflow from -size while the pool is filling up
+    if values.get(f'pool.overflow.{INSTANCE}', 0) < 0:
+        values[f'pool.overflow.{INSTANCE}'] = 0
+    return values
+
+
+def flush():
+    """Write this process's counters and pool gauges as platform metrics. Commits"""
+    with _lock:
+        deltas = dict(_counters)
+        _counters.clear()
+    try:
+        platform_metrics.increment_metrics(deltas)
+        platform_metrics.set_metrics(_pool_gauges())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Kept for the next flush
+        with _lock:
+            for key, n in deltas.items():
+                _counters[key] += n
+        raise
+
+
+def start(app):
+    """Start the thread flushing this process's telemetry every TELEMETRY_FLUSH_SECONDS, and on exit"""
+    def flush_now():
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                app.logger.error(f"Telemetry flush error: {str(e)}")
+
+    def run():
+        while True:
+            time.sleep(app.config['TELEMETRY_FLUSH_SECONDS'])
+            flush_now()
+
+    thread = threading.Thread(target=run, name='telemetry-flush', daemon=True)
+    thread.start()
+    atexit.register(flush_now)
+    return thread
+
+
+@jobs.housekeeping
+def purge_stale_gauges():
+    """Delete the pool gauges of processes gone for STALE_GAUGE_RETENTION. Commits; returns how many"""
+    deleted = PlatformMetric.query.filter(
+        PlatformMetric.key.like('pool.%'),
+        PlatformMetric.updated_at < datetime.utcnow() - STALE_GAUGE_RETENTION
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# Rendering
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}' if labels else ''
+
+
+def _number(value):
+    return repr(float(value))
+
+
+class _Exposition:
+    """Prometheus text format, one HELP/TYPE header per metric family"""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text, samples):
+        if not samples:
+            return
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+        for suffix, labels, value in samples:
+            self.lines.append(f'{name}{suffix}{_labels(labels)} {_number(value)}')
+
+    def histogram(self, name, help_text, series, buckets):
+        """series: [(labels, {bucket label or 'sum': value})], bucket counts not cumulative"""
+        samples = []
+        for labels, values in series:
+            cumulative = 0
+            for bound in buckets + (None,):
+                le = scheduler_stats.bucket_label(bound)
+                cumulative += values.get(le, 0)
+                samples.append(('_bucket', {**labels, 'le': le}, cumulative))
+            samples.append(('_sum', labels, values.get('sum', 0)))
+            samples.append(('_count', labels, cumulative))
+        self.family(name, 'histogram', help_text, samples)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def _endpoint_labels(endpoint):
+    blueprint = endpoint.split('.', 1)[0] if '.' in endpoint else ''
+    return {'blueprint': blueprint, 'endpoint': endpoint}
+
+
+def render():
+    """All metrics, as of the last flush of every process, in the Prometheus text format"""
+    rows = PlatformMetric.query.with_entities(PlatformMetric.key, PlatformMetric.value, PlatformMetric.updated_at)
+    stale_before = datetime.utcnow() - timedelta(
+        seconds=STALE_GAUGE_FLUSHES * current_app.config['TELEMETRY_FLUSH_SECONDS'])
+
+    requests_total, request_latency = [], defaultdict(dict)
+    external_total, external_latency = [], defaultdict(dict)
+    pool = defaultdict(list)
+    metrics = {}
+    for key, value, updated_at in rows:
+        metrics[key] = value
+        if key.startswith('http.requests.'):
+            method, status, endpoint = key[len('http.requests.'):].split('.', 2)
+            requests_total.append(('', {**_endpoint_labels(endpoint), 'method': method, 'status': status}, value))
+        elif key.startswith('http.latency.'):
+            le, endpoint = _split_bucket(key[len('http.latency.'):])
+            request_latency[endpoint][le] = value
+        elif key.startswith('external.requests.'):
+            status, service = key[len('external.requests.'):].split('.', 1)
+            external_total.append(('', {'service': service, 'status': status}, value))
+        elif key.startswith('external.latency.'):
+            le, service = _split_bucket(key[len('external.latency.'):])
+            external_latency[service][le] = value
+        elif key.startswith('pool.') and updated_at and updated_at >= stale_before:
+            gauge, instance = key[len('pool.'):].split('.', 1)
+            pool[gauge].append(('', {'instance': instance}, value))
+
+    out = _Exposition()
+    out.family('http_requests_total', 'counter', 'HTTP requests served, by endpoint, method and status',
+               requests_total)
+    out.histogram('http_request_duration_seconds', 'HTTP request duration',
+                  [(_endpoint_labels(endpoint), values) for endpoint, values in sorted(request_latency.items())],
+                  LATENCY_BUCKETS)
+    out.family('external_requests_total', 'counter', 'Calls to external services, by HTTP status or error',
+               external_total)
+    out.histogram('external_request_duration_seconds', 'Duration of calls to external services',
+                  [({'service': service}, values) for service, values in sorted(external_latency.items())],
+                  LATENCY_BUCKETS)
+    for gauge in POOL_GAUGES:
+        out.family(f'db_pool_{gauge}', 'gauge', f'SQLAlchemy connection pool {gauge.replace("_", " ")}, per process',
+                   pool[gauge])
+
+    _business(out, metrics)
+    _scheduler(out)
+    return out.text()
+
+
+def _split_bucket(rest):
+    # Bucket labels such as 0.005 contain dots themselves
+    for le in [scheduler_stats.bucket_label(bound) for bound in LATENCY_BUCKETS + (None,)] + ['sum']:
+        if rest.startswith(le + '.'):
+            return le, rest[len(le) + 1:]
+    return rest.split('.', 1)
+
+
+def _business(out, metrics):
+    deposits = [(key, value) for key, value in metrics.items() if key.startswith('volume.') and '.DEPOSIT.' in key]
+    out.family('deposits_credited_total', 'counter', 'Deposits credited to users',
+               [('', {}, sum(value for key, value in deposits if key.startswith('volume.count.')))])
+    out.family('deposits_credited_usdt_total', 'counter', 'USDT credited to users by deposits',
+               [('', {}, sum(value for key, value in deposits if key.startswith('volume.usdt.')))])
+    out.family('claims_expired_total', 'counter', 'Claims released because they expired',
+               [('', {}, metrics.get(platform_metrics.CLAIMS_EXPIRED, 0))])
+    out.family('otp_sms_total', 'counter', 'OTP messages handed to the SMS gateway, by result',
+               [('', {'result': result}, metrics.get(f'otp.sms.{result}', 0)) for result in ('sent', 'failed')])
+
+
+def _scheduler(out):
+    rows = scheduler_stats.summary()
+    for name, kind, help_text in (('runs', 'counter', 'Runs of the scheduled job'),
+                                  ('failures', 'counter', 'Failed runs of the scheduled job'),
+                                  ('skipped', 'counter', 'Runs skipped because the previous run was still going'),
+                                  ('missed', 'counter', 'Runs missed past the misfire grace time'),
+                                  ('coalesced', 'counter', 'Runs coalesced into one'),
+                                  ('items', 'counter', 'Items processed by the scheduled job'),
+                                  ('external_calls', 'counter', 'External calls made by the scheduled job')):
+        out.family(f'scheduler_job_{name}_total', kind, help_text,
+                   [('', {'job': job['job']}, job[name]) for job in rows])
+    out.histogram('scheduler_job_duration_seconds', 'Duration of the scheduled job runs',
+                  [({'job': job['job']}, {**dict(job['buckets']), 'sum': job['duration_sum']}) for job in rows],
+                  scheduler_stats.DURATION_BUCKETS)
+    for name, help_text in (('oldest_item_age', 'Age of the oldest item waiting when the last run started'),
+                            ('start_lag', 'How late the last run started'),
+                            ('last_duration', 'Duration of the last run')):
+        out.family(f'scheduler_job_{name}_seconds', 'gauge', help_text,
+                   [('', {'job': job['job']}, job[name]) for job in rows])
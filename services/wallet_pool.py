@@ -1,10 +1,12 @@
-import traceback
-
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import current_app
 
-from models.models import db, PooledWallet, WalletAssignment, Transaction, TransactionStatus, User, Claim, Setting
+from sqlalchemy import update, select
+
+from models.models import db, PooledWallet, WalletAssignment, WalletStatus, Transaction, TransactionStatus
 from datetime import datetime, timedelta
+from services import scheduler_stats, state_machine, telemetry
+from services.claim_expiry import release_expired_claims
 from transaction.utils import TransactionUtil
 import requests
 
@@ -16,61 +18,76 @@ class DepositMonitor:
 
     def monitor_active_assignments(self):
         try:
-            current_app.logger.info(f"Checking wallets")
+            current_app.logger.debug("Checking wallets")
+            # Whole seconds, so last_checked_at >= started holds for it on MySQL DATETIME columns
+            started = datetime.utcnow().replace(microsecond=0)
             # Get both active and expired assignments
             assignments = (WalletAssignment.query
                            .filter(WalletAssignment.is_active == True)
                            .with_for_update()
                            .all())
 
-            current_app.logger.info(f"Found assignment to check : {assignments}")
-
-            for assignment in assignments:
-                self._check_assignment(assignment)
+            current_app.logger.debug(f"Found {len(assignments)} assignments to check")
+            scheduler_stats.count('items', len(assignments))
+            if assignments:
+                # How long the wallet waiting longest has gone without a deposit check
+                last_checked = min(assignment.wallet.last_checked_at or assignment.assigned_at
+                                   for assignment in assignments)
+                scheduler_stats.oldest((started - last_checked).total_seconds())
+
+            checked_wallet_ids = [assignment.wallet_id for assignment in assignments
+                                  if self._check_assignment(assignment)]
+            if checked_wallet_ids:
+                db.session.execute(
+                    update(PooledWallet)
+                    .where(PooledWallet.id.in_(checked_wallet_ids))
+                    .values(last_checked_at=started)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
 
-                # If assignment is expired, do one final check with grace period
-                if datetime.utcnow() > assignment.expires_at:
-                    self._handle_expired_assignment(assignment)
+            # Expired assignments just had their final deposit check above
+            release_expired_assignments(started)
 
         except Exception as e:
-            print(e)
-            current_app.logger.error(f"Monitor error: {str(e)}")
+            scheduler_stats.count('failures')
+            current_app.logger.error(f"Monitor error: {str(e)}", exc_info=True)
 
     def _check_assignment(self, assignment):
+        """Look for a deposit to the assignment's wallet; False if the chain could not be read"""
         try:
             # Get blockchain transactions
             blockchain_txns = self._get_blockchain_transactions(
                 assignment.wallet.address,
                 assignment.assigned_at
             )
+            if blockchain_txns is None:
+                return False
 
-            current_app.logger.info(f"Blockchain Transactions Fetched : {blockchain_txns}")
+            current_app.logger.debug(f"Blockchain Transactions Fetched : {len(blockchain_txns)} "
+                                     f"for {assignment.wallet.address}")
 
             for txn in blockchain_txns:
                 # Skip if transaction already processed
                 if Transaction.query.filter_by(blockchain_txn_id=txn['transaction_id']).first():
-                    current_app.logger.info(f"Blockchain Transaction already processed : {txn}")
+                    current_app.logger.debug(f"Blockchain Transaction already processed : {txn['transaction_id']}")
                     continue
 
                 # Verify transaction
                 if not self._verify_transaction(txn, assignment):
-                    current_app.logger.info(f"Blockchain Transaction not verified : {txn}")
+                    current_app.logger.debug(f"Blockchain Transaction not verified : {txn['transaction_id']}")
                     continue
 
                 # Create transaction and credit user
                 self._process_transaction(assignment, txn)
-                return
+                break
 
-            # Check if assignment expired
-            if datetime.utcnow() > assignment.expires_at:
-                assignment.is_active = False
-                assignment.wallet.status = 'AVAILABLE'
-                db.session.commit()
+            return True
 
         except Exception as e:
             db.session.rollback()
-            traceback.print_exc()
-            current_app.logger.error(f"Check assignment error: {str(e)}")
+            current_app.logger.error(f"Check assignment error: {str(e)}", exc_info=True)
+            return False
 
     def _verify_transaction(self, txn, assignment):
         try:
@@ -96,12 +113,12 @@ class DepositMonitor:
             return True
 
         except Exception as e:
-            traceback.print_exc()
-            current_app.logger.error(f"Verify transaction error: {str(e)}")
+            current_app.logger.error(f"Verify transaction error: {str(e)}", exc_info=True)
             return False
 
     def _process_transaction(self, assignment, txn):
-        current_app.logger.info(f"Blockchain Transaction Detected : {txn}")
+        current_app.logger.info(f"Blockchain Transaction Detected : {txn['transaction_id']} "
+                                f"to {txn.get('to')} value {txn.get('value')}")
         try:
             amount_usdt = float(txn['value']) / 1e6
 
@@ -110,7 +127,7 @@ class DepositMonitor:
                 user_id=assignment.user_id,
                 wallet_assignment_id=assignment.id,
                 transaction_type='DEPOSIT',
-                status='COMPLETED',
+                status='PENDING',
                 amount_usdt=round(amount_usdt, 2),
                 blockchain_txn_id=txn['transaction_id'],
                 from_address=txn["from"],
@@ -119,9 +136,8 @@ class DepositMonitor:
             )
             db.session.add(transaction)
 
-            # Credit user
-            user = User.query.get(assignment.user_id)
-            user.wallet_balance += amount_usdt
+            # Credits the user through the completion hook
+            state_machine.transition(transaction, TransactionStatus.COMPLETED, completed_at=datetime.utcnow())
 
             # Mark assignment and wallet as completed
             assignment.is_active = False
@@ -131,98 +147,71 @@ class DepositMonitor:
 
         except Exception as e:
             db.session.rollback()
-            traceback.print_exc()
-            current_app.logger.error(f"Process transaction error: {str(e)}")
+            current_app.logger.error(f"Process transaction error: {str(e)}", exc_info=True)
 
     def _get_blockchain_transactions(self, address, start_time):
+        """TRC20 transfers to the address since start_time, None if the API call failed"""
         try:
-            response = requests.get(
-                f"{self.tron_api_url}/v1/accounts/{address}/transactions/trc20",
-                params={
-                    'only_to': True,
-                    'min_timestamp': int(start_time.timestamp() * 1000),
-                    'contract_address': self.usdt_contract
-                }
-            )
+            scheduler_stats.count('external_calls')
+            with telemetry.external_call('trongrid') as call:
+                response = requests.get(
+                    f"{self.tron_api_url}/v1/accounts/{address}/transactions/trc20",
+                    params={
+                        'only_to': True,
+                        'min_timestamp': int(start_time.timestamp() * 1000),
+                        'contract_address': self.usdt_contract
+                    }
+                )
+                call.status = response.status_code
 
             if response.ok:
                 return response.json().get('data', [])
-            return []
+            current_app.logger.error(f"Get blockchain transactions error: HTTP {response.status_code}")
+            return None
 
         except Exception as e:
             current_app.logger.error(f"Get blockchain transactions error: {str(e)}")
-            return []
-
-    def _handle_expired_assignment(self, assignment):
-        """Handle expired assignment with final check"""
-        current_app.logger.info(f"Assignment Expired, Verifying with Tron : {assignment}")
+            return None
+
+
+def release_expired_assignments(checked_since):
+    """
+    Deactivate every assignment past expiry plus WALLET_ASSIGNMENT_GRACE_MINUTES whose
+    wallet had a successful deposit check since checked_since, and return the wallets
+    to the pool. On MySQL both tables change in one multi-table UPDATE driven by the
+    (is_active, expires_at) index; other databases take one UPDATE per table.
+    """
+    cutoff = checked_since - timedelta(minutes=current_app.config['WALLET_ASSIGNMENT_GRACE_MINUTES'])
+    expired = (
+        WalletAssignment.is_active == True,
+        WalletAssignment.expires_at <= cutoff,
+        WalletAssignment.wallet_id == PooledWallet.id,
+        PooledWallet.last_checked_at >= checked_since
+    )
 
-        try:
-            # One final check with grace period
-            grace_period = datetime.utcnow() + timedelta(minutes=5)
-            blockchain_txns = self._get_blockchain_transactions(
-                assignment.wallet.address,
-                assignment.assigned_at
+    if db.engine.dialect.name == 'mysql':
+        db.session.execute(
+            update(WalletAssignment)
+            .where(*expired)
+            .values({WalletAssignment.is_active: False, PooledWallet.status: WalletStatus.AVAILABLE})
+            .execution_options(synchronize_session=False)
+        )
+    else:
+        rows = db.session.execute(select(WalletAssignment.id, WalletAssignment.wallet_id).where(*expired)).all()
+        if rows:
+            db.session.execute(
+                update(PooledWallet)
+                .where(PooledWallet.id.in_({wallet_id for _, wallet_id in rows}))
+                .values(status=WalletStatus.AVAILABLE)
+                .execution_options(synchronize_session=False)
             )
-
-            # Check transactions one last time
-            for txn in blockchain_txns:
-                txn_timestamp = datetime.fromtimestamp(txn['block_timestamp'] / 1000)
-
-                # Only process if transaction was made during assignment period
-                if assignment.assigned_at <= txn_timestamp <= assignment.expires_at:
-                    if not Transaction.query.filter_by(blockchain_txn_id=txn['transaction_id']).first():
-                        if self._verify_transaction(txn, assignment):
-                            self._process_transaction(assignment, txn)
-                            return
-
-            # No valid transaction found, release the wallet
-            current_app.logger.info(f"No valid transaction found, release the wallet : {assignment}")
-            assignment.is_active = False
-            assignment.wallet.status = 'AVAILABLE'
-            db.session.commit()
-
-        except Exception as e:
-            db.session.rollback()
-            traceback.print_exc()
-            current_app.logger.error(f"Handle expired assignment error: {str(e)}")
-
-
-def cleanup_expired_claims():
-    try:
-        with db.session.begin_nested():
-            # Find and lock expired claims
-            expiry_time_delta = int(Setting.get_value("claim.expiry_time_delta", 2))
-
-            expired_claims = (Claim.query
-                              .filter(Claim.status == 'CLAIMED')
-                              .with_for_update()
-                              .all())
-
-            for claim in expired_claims:
-                if claim.expires_at + timedelta(minutes=expiry_time_delta) <= datetime.utcnow():
-                    print(f"Found expired claim: {claim}")
-                    claim.status = 'AVAILABLE'
-                    claim.claimed_by = None
-                    claim.claimed_at = None
-                    claim.expires_at = None
-
-                    # Update associated transaction if exists
-                    transaction = Transaction.query.filter_by(claim_id=claim.id,
-                                                              status=TransactionStatus.PENDING).first()
-                    print(f"Found associated transaction: {transaction}")
-                    if transaction and transaction.status == TransactionStatus.PENDING:
-                        print("Updating transaction status")
-                        transaction.status = TransactionStatus.CANCELLED
-                        transaction.error_message = 'Claim expired'
-
-
-            db.session.commit()
-
-    except Exception as e:
-        db.session.rollback()
-        print(e)
-        current_app.logger.error(f"Claim cleanup error: {str(e)}")
+            db.session.execute(
+                update(WalletAssignment)
+                .where(WalletAssignment.id.in_([assignment_id for assignment_id, _ in rows]))
+                .values(is_active=False)
+                .execution_options(synchronize_session=False)
+            )
+    db.session.commit()
 
 
 # scheduler/tasks.py
@@ -249,7 +238,7 @@ def setup_claim_monitoring(app):
 
     # Check for deposits every minute
     scheduler.add_job(
-        cleanup_expired_claims,
+        release_expired_claims,
         'interval',
         seconds=30
     )
@@ -1,13 +1,14 @@
-import traceback
+import zlib
 from datetime import datetime, timedelta
 from enum import Enum
 
 from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import func, cast, Float
 
 from auth.utils import token_required
 from models.models import db, Transaction, TransactionStatus, TransactionType, BankAccount, WalletAssignment, \
     PooledWallet, ExchangeRate, PaymentMode, Claim, Setting
+from services import claim_matcher, claims_book, ledger, state_machine
+from services.export import build_export_query, export_response
 from transaction.utils import TransactionUtil
 
 transaction_bp = Blueprint('transaction', __name__)
@@ -22,7 +23,7 @@ def get_dashboard(current_user):
     try:
         # 1. Get Active Buy Transactions
         version = int(request.args.get("version"))
-        print(version)
+        current_app.logger.debug(f"Dashboard app version {version}")
 
         current_version = int(Setting.get_value('apk.version_number', 5))
 
@@ -137,8 +138,7 @@ def get_dashboard(current_user):
         }), 200
 
     except Exception as e:
-        print(traceback.format_exc())
-        current_app.logger.error(f"Dashboard error: {str(e)}")
+        current_app.logger.error(f"Dashboard error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch dashboard data'}), 500
 
 
@@ -309,8 +309,7 @@ def get_rates(current_user):
         return jsonify(data), 200
 
     except Exception as e:
-        traceback.print_exc()
-        current_app.logger.error(f"Get rates error: {str(e)}")
+        current_app.logger.error(f"Get rates error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to get rates'}), 500
 
 
@@ -458,11 +457,7 @@ def initiate_buy2(current_user):
             payment_mode_val = data['payment_mode']
             payment_mode = PaymentMode.from_value(payment_mode_val).name
 
-            # Lock and verify claim
-            claim = (Claim.query
-                     .filter_by(id=data['claim_id'])
-                     .with_for_update()
-                     .first())
+            claim = Claim.query.filter_by(id=data['claim_id']).first()
 
             if not claim:
                 return jsonify({'error': 'Invalid claim'}), 404
@@ -476,69 +471,214 @@ def initiate_buy2(current_user):
             if amount_inr < current_app.config['MIN_BUY_INR']:
                 return jsonify({'error': f'Minimum buy amount is {current_app.config["MIN_BUY_INR"]} INR'}), 400
 
-            # Get current rate and calculate USDT amount
+            # Get current rate
             rate = TransactionUtil.get_current_rate(
                 TransactionType.BUY.value,
                 payment_mode=payment_mode,
                 amount_inr=amount_inr
             )
-            amount_usdt = amount_inr / rate.rate
-
-            claim.status = 'CLAIMED'
-            claim.claimed_by = current_user.id
-            claim.claimed_at = datetime.utcnow()
 
             claim_expiry_time = int(Setting.get_value("claim.expiry_time", 30))
 
-            claim.expires_at = datetime.utcnow() + timedelta(minutes=claim_expiry_time)
-
-            # Create transaction
-            transaction = Transaction(
-                user_id=current_user.id,
-                rupal_id=TransactionUtil.generate_transaction_ref(),
-                transaction_type=TransactionType.BUY,
-                payment_mode=payment_mode,
-                amount_inr=round(amount_inr, 2),
-                amount_usdt=round(amount_usdt, 2),
-                exchange_rate=rate.rate,
-                status=TransactionStatus.PENDING,
-                payment_reference=TransactionUtil.generate_payment_reference(),
-                claim_id=claim.id
+            # Fails with ConcurrentUpdate if another user claimed it since it was read
+            state_machine.transition(
+                claim, 'CLAIMED',
+                claimed_by=current_user.id,
+                claimed_at=datetime.utcnow(),
+                expires_at=datetime.utcnow() + timedelta(minutes=claim_expiry_time)
             )
 
-            db.session.add(transaction)
+            transaction = _create_buy_transaction(current_user, claim, payment_mode, rate)
             db.session.commit()
 
+        return jsonify(_buy_order_response(transaction, claim, rate, payment_mode_val)), 200
+
+    except state_machine.ConcurrentUpdate:
+        db.session.rollback()
+        return jsonify({'error': 'This option was just claimed, kindly choose another'}), 409
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Buy initiate error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to initiate buy'}), 500
+
+
+@transaction_bp.route('/buy/match', methods=['POST'])
+@token_required
+def match_buy(current_user):
+    """
+    Initiate a buy order on the available option closest to the requested amount
+    Request: {
+        "amount_inr": 5000,
+        "payment_mode": "",
+        "bank_name": "HDFC" (optional)
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Payload is required'}), 400
+
+        if 'payment_mode' not in data:
+            return jsonify({'error': 'Payment mode is required'}), 400
+
+        if 'amount_inr' not in data:
+            return jsonify({'error': 'Amount is required'}), 400
+
+        try:
+            amount_inr = float(data['amount_inr'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid amount'}), 400
+        if amount_inr < current_app.config['MIN_BUY_INR']:
+            return jsonify({'error': f'Minimum buy amount is {current_app.config["MIN_BUY_INR"]} INR'}), 400
+
+        payment_mode_val = data['payment_mode']
+        payment_mode = PaymentMode.from_value(payment_mode_val).name
+        bank_name = data.get('bank_name')
+        if bank_name in ('All', 'null', ''):
+            bank_name = None
+
+        claim = claim_matcher.match_claim(
+            current_user.id, amount_inr, bank_name,
+            expiry_minutes=int(Setting.get_value("claim.expiry_time", 30))
+        )
+        rate = TransactionUtil.get_current_rate(
+            TransactionType.BUY.value,
+            payment_mode=payment_mode,
+            amount_inr=claim.amount_inr
+        )
+        transaction = _create_buy_transaction(current_user, claim, payment_mode, rate)
+        db.session.commit()
+
+        return jsonify(_buy_order_response(transaction, claim, rate, payment_mode_val)), 200
+
+    except claim_matcher.NoMatch:
+        db.session.rollback()
+        return jsonify({'error': 'No matching option available right now, kindly try again'}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Buy match error: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to initiate buy'}), 500
+
+
+@transaction_bp.route('/buy/fill', methods=['POST'])
+@token_required
+def fill_buy(current_user):
+    """
+    Initiate a buy order of an amount no single option covers, as one transaction
+    per option on up to CLAIM_FILL_MAX_PIECES options adding up to the amount.
+    Each transaction is paid, confirmed and cancelled on its own.
+    Request: {
+        "amount_inr": 120000,
+        "payment_mode": "",
+        "bank_name": "HDFC" (optional)
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': 'Payload is required'}), 400
+
+        if 'payment_mode' not in data:
+            return jsonify({'error': 'Payment mode is required'}), 400
+
+        if 'amount_inr' not in data:
+            return jsonify({'error': 'Amount is required'}), 400
+
+        try:
+            amount_inr = float(data['amount_inr'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid amount'}), 400
+        if amount_inr < current_app.config['MIN_BUY_INR']:
+            return jsonify({'error': f'Minimum buy amount is {current_app.config["MIN_BUY_INR"]} INR'}), 400
+        max_fill = current_app.config['CLAIM_FILL_MAX_PIECES'] * current_app.config['MAX_BUY_INR']
+        if amount_inr > max_fill:
+            return jsonify({'error': f'Maximum buy amount is {max_fill} INR'}), 400
+
+        payment_mode_val = data['payment_mode']
+        payment_mode = PaymentMode.from_value(payment_mode_val).name
+        bank_name = data.get('bank_name')
+        if bank_name in ('All', 'null', ''):
+            bank_name = None
+
+        claims = claim_matcher.fill_claims(
+            current_user.id, amount_inr, bank_name,
+            expiry_minutes=int(Setting.get_value("claim.expiry_time", 30))
+        )
+        # One order: the rate is for the amount filled, not for each piece
+        rate = TransactionUtil.get_current_rate(
+            TransactionType.BUY.value,
+            payment_mode=payment_mode,
+            amount_inr=sum(claim.amount_inr for claim in claims)
+        )
+        transactions = [_create_buy_transaction(current_user, claim, payment_mode, rate) for claim in claims]
+        db.session.commit()
+
         return jsonify({
-            'transaction': {
-                'id': transaction.id,
-                'rupal_id': transaction.rupal_id,
-                'amount_inr': amount_inr,
-                'amount_usdt': round(amount_usdt, 2),
-                'payment_mode': payment_mode_val,
-                'rate': rate.rate,
-                'payment_reference': transaction.payment_reference,
-                'created_at': TransactionUtil.format_created_at_to_ist(transaction.created_at),
-                'claim': {
-                    'id': claim.id,
-                    'status': claim.status,
-                    'expires_at': claim.expires_at,
-                    'expire_after': int((claim.expires_at - datetime.utcnow()).total_seconds()) * 1000,
-                    'account_name': claim.account_holder,
-                    'account_number': claim.account_number,
-                    'ifsc_code': claim.ifsc_code,
-                    'bank_name': claim.bank_name
-                }
-            }
+            'amount_inr': round(sum(claim.amount_inr for claim in claims), 2),
+            'transactions': [
+                _buy_order_response(transaction, claim, rate, payment_mode_val)['transaction']
+                for transaction, claim in zip(transactions, claims)
+            ]
         }), 200
 
+    except claim_matcher.NoMatch:
+        db.session.rollback()
+        return jsonify({'error': 'No matching options available right now, kindly try again'}), 404
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        traceback.print_exc()
         db.session.rollback()
-        current_app.logger.error(f"Buy initiate error: {str(e)}")
+        current_app.logger.error(f"Buy fill error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to initiate buy'}), 500
 
 
+def _create_buy_transaction(current_user, claim, payment_mode, rate):
+    amount_usdt = claim.amount_inr / rate.rate
+    transaction = Transaction(
+        user_id=current_user.id,
+        rupal_id=TransactionUtil.generate_transaction_ref(),
+        transaction_type=TransactionType.BUY,
+        payment_mode=payment_mode,
+        amount_inr=round(claim.amount_inr, 2),
+        amount_usdt=round(amount_usdt, 2),
+        exchange_rate=rate.rate,
+        status=TransactionStatus.PENDING,
+        payment_reference=TransactionUtil.generate_payment_reference(),
+        claim_id=claim.id
+    )
+    db.session.add(transaction)
+    return transaction
+
+
+def _buy_order_response(transaction, claim, rate, payment_mode_val):
+    return {
+        'transaction': {
+            'id': transaction.id,
+            'rupal_id': transaction.rupal_id,
+            'amount_inr': claim.amount_inr,
+            'amount_usdt': round(claim.amount_inr / rate.rate, 2),
+            'payment_mode': payment_mode_val,
+            'rate': rate.rate,
+            'payment_reference': transaction.payment_reference,
+            'created_at': TransactionUtil.format_created_at_to_ist(transaction.created_at),
+            'claim': {
+                'id': claim.id,
+                'status': claim.status,
+                'expires_at': claim.expires_at,
+                'expire_after': int((claim.expires_at - datetime.utcnow()).total_seconds()) * 1000,
+                'account_name': claim.account_holder,
+                'account_number': claim.account_number,
+                'ifsc_code': claim.ifsc_code,
+                'bank_name': claim.bank_name
+            }
+        }
+    }
+
+
 @transaction_bp.route('/buy/active', methods=['GET'])
 @token_required
 def active_buy_transactions(current_user):
@@ -574,8 +714,7 @@ def active_buy_transactions(current_user):
         return jsonify({"transactions": transactions, "showActive": True if len(transactions) > 0 else None,
                         "wallet_usdt": current_user.wallet_balance}), 200
     except Exception as e:
-        print(traceback.format_exc())
-        current_app.logger.error(f"Get buy active orders error: {str(e)}")
+        current_app.logger.error(f"Get buy active orders error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch active transactions'}), 500
 
 
@@ -597,23 +736,21 @@ def cancel_buy_transaction(current_user):
             if current_user.id != transaction.user_id:
                 return jsonify({'error': 'Unauthorized access'}), 401
 
-            if transaction.status == TransactionStatus.CANCELLED.name:
+            if transaction.status == TransactionStatus.CANCELLED:
                 return jsonify({'error': 'Transaction is already cancelled'}), 400
 
-            claim = Claim.query.get(transaction.claim_id)
-
-            claim.claimed_by = None
-            claim.claimed_at = None
-            claim.expires_at = None
-            claim.status = 'AVAILABLE'
-
-            transaction.status = TransactionStatus.CANCELLED.name
-            transaction.error_message = 'Claim Expired'
+            # Releases the claim through the cancel hook
+            state_machine.transition(transaction, TransactionStatus.CANCELLED, error_message='Claim Expired')
             db.session.commit()
             return jsonify({"message": "Your order is cancelled successfully."})
+    except state_machine.IllegalTransition:
+        db.session.rollback()
+        return jsonify({'error': 'Transaction can no longer be cancelled'}), 400
+    except state_machine.ConcurrentUpdate:
+        db.session.rollback()
+        return jsonify({'error': 'Transaction was updated, kindly refresh'}), 409
     except Exception as e:
-        print(traceback.format_exc())
-        current_app.logger.error(f"Error while cancelling buy transaction: {str(e)}")
+        current_app.logger.error(f"Error while cancelling buy transaction: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch active transactions'}), 500
 
 
@@ -651,11 +788,11 @@ def confirm_buy(current_user):
         claim = Claim.query.get(transaction.claim_id)
         claim.is_active = False
 
-        # Update transaction
-        transaction.payment_proof = proof_path
-        transaction.payment_reference = ref_number
-        transaction.status = TransactionStatus.PROCESSING
-
+        state_machine.transition(
+            transaction, TransactionStatus.PROCESSING,
+            payment_proof=proof_path,
+            payment_reference=ref_number
+        )
         db.session.commit()
 
         return jsonify({
@@ -666,6 +803,9 @@ def confirm_buy(current_user):
             }
         }), 200
 
+    except state_machine.ConcurrentUpdate:
+        db.session.rollback()
+        return jsonify({'error': 'Transaction was updated, kindly refresh'}), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Buy confirm error: {str(e)}")
@@ -710,8 +850,7 @@ def sell_calculate_rate(current_user):
     except ValueError:
         return jsonify({'error': 'Invalid amount format'}), 400
     except Exception as e:
-        print(traceback.print_exc())
-        current_app.logger.error(f"Rate calculation error: {str(e)}")
+        current_app.logger.error(f"Rate calculation error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to calculate rate'}), 500
 
 
@@ -728,7 +867,7 @@ def initiate_sell(current_user):
     """
     try:
         data = request.get_json()
-        print(data)
+        current_app.logger.debug(f"Sell request {data}")
         if not data or not all(k in data for k in ['amount_inr', 'bank_account_id', 'payment_mode']):
             return jsonify({'error': 'All fields are required'}), 400
 
@@ -737,7 +876,7 @@ def initiate_sell(current_user):
 
         payment_mode = PaymentMode.from_value(payment_mode_val).name
 
-        print(payment_mode)
+        current_app.logger.debug(f"Sell payment mode {payment_mode}")
 
         # Validate amount and balance
         if amount_inr < current_app.config['MIN_SELL_INR']:
@@ -774,9 +913,8 @@ def initiate_sell(current_user):
             bank_account_id=bank_account.id
         )
 
-        current_user.wallet_balance -= amount_usdt
-
         db.session.add(transaction)
+        ledger.debit(current_user.id, amount_usdt, 'SELL', transaction=transaction)
         db.session.commit()
 
         return jsonify({
@@ -799,6 +937,9 @@ def initiate_sell(current_user):
             }
         }), 200
 
+    except ledger.InsufficientBalance:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient balance'}), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Sell initiate error: {str(e)}")
@@ -980,9 +1121,8 @@ def initiate_withdraw(current_user):
             status=TransactionStatus.PENDING
         )
 
-        current_user.wallet_balance -= total_amount
-
         db.session.add(transaction)
+        ledger.debit(current_user.id, total_amount, 'WITHDRAW', transaction=transaction)
         db.session.commit()
 
         return jsonify({
@@ -997,6 +1137,9 @@ def initiate_withdraw(current_user):
             }
         }), 200
 
+    except ledger.InsufficientBalance:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient balance'}), 400
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Withdraw initiate error: {str(e)}")
@@ -1018,8 +1161,7 @@ def get_transactions(current_user):
     - per_page: int
     """
     try:
-        print("Inside Transactions")
-        print(request.args.get('page'))
+        current_app.logger.debug(f"Transactions page {request.args.get('page')}")
         page = int(request.args.get('page'))
         if page:
             page += 1
@@ -1104,11 +1246,39 @@ def get_transactions(current_user):
         }), 200
 
     except Exception as e:
-        print(traceback.format_exc())
-        current_app.logger.error(f"Get transactions error: {str(e)}")
+        current_app.logger.error(f"Get transactions error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch transactions'}), 500
 
 
+@transaction_bp.route('/transactions/export', methods=['GET'])
+@token_required
+def export_transactions(current_user):
+    """
+    Stream the user's transaction history as a statement download
+    Query params:
+    - format: csv/ndjson (default: csv)
+    - type: DEPOSIT/WITHDRAW/BUY/SELL/ADMIN_ADD/ADMIN_SUB
+    - status: PENDING/PROCESSING/COMPLETED/FAILED/CANCELLED
+    - search: rupal_id
+    - date_from: YYYY-MM-DD
+    - date_to: YYYY-MM-DD
+    """
+    try:
+        export_format = request.args.get('format', 'csv')
+
+        query = build_export_query().filter(Transaction.user_id == current_user.id)
+        query = TransactionUtil.apply_filters(query, request.args)
+
+        filename = f"statement_{current_user.id}_{datetime.utcnow().strftime('%Y%m%d')}"
+        return export_response(query, export_format, filename)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Export transactions error: {str(e)}")
+        return jsonify({'error': 'Failed to export transactions'}), 500
+
+
 @transaction_bp.route('/transaction/<int:transaction_id>', methods=['GET'])
 @token_required
 def get_transaction_details(current_user, transaction_id):
@@ -1168,6 +1338,35 @@ class SortPattern(Enum):
     RECOMMENDED = "Recommended"
 
 
+def _available_claims_page(args):
+    """
+    Available claims for the claims screens from the in-memory claims book.
+    Returns (claims, total, bank names, etag); without per_page every claim is returned.
+    """
+    sort_pattern = args.get('sort')
+    if not sort_pattern or sort_pattern == 'null':
+        sort_pattern = SortPattern.RECOMMENDED.value
+    bank_name = args.get('bank_name')
+    if bank_name in ('All', 'null', ''):
+        bank_name = None
+
+    recommended_amount = float(args.get('amount_inr', 0))
+    page = max(int(args.get('page', 1)), 1)
+    per_page = int(args['per_page']) if args.get('per_page') else None
+
+    book = claims_book.get_book()
+    # Read first: a change landing after it only makes the next poll miss the cache
+    etag = book.etag
+    claims, total = book.query(
+        bank_name,
+        order='desc' if sort_pattern == SortPattern.AMOUNT_DESC.value else 'asc',
+        near=recommended_amount if sort_pattern == SortPattern.RECOMMENDED.value and recommended_amount > 0 else None,
+        offset=(page - 1) * per_page if per_page else 0,
+        limit=per_page
+    )
+    return claims, total, ["All"] + book.banks, etag
+
+
 @transaction_bp.route('/claims', methods=['GET'])
 @token_required
 def get_available_claims(current_user):
@@ -1177,74 +1376,37 @@ def get_available_claims(current_user):
     - sort: 1 (Amount ASC), 2 (Amount DESC), 3 (Recommended)
     - bank_name: string (optional)
     - amount_inr: float (optional, for recommended sorting)
+    - page, per_page: int (optional, all claims when per_page is absent)
+    Responds 304 when If-None-Match carries the current ETag.
     """
     try:
-        if request.args.get('sort') == 'null':
-            sort_pattern = SortPattern.RECOMMENDED.value
-        else:
-            sort_pattern = request.args.get('sort', SortPattern.RECOMMENDED.value)
-        bank_name = request.args.get('bank_name')
-        if "All" == bank_name or "null" == bank_name:
-            bank_name = None
-
-        recommended_amount = float(request.args.get('amount_inr', 0))
-
-        # Base query for available claims
-        query = Claim.query.filter(
-            Claim.is_active == True,
-            Claim.status == 'AVAILABLE'
-        )
-
-        # Apply bank name filter if provided
-        if bank_name:
-            query = query.filter(Claim.bank_name == bank_name)
-
-        # Apply sorting
-        if sort_pattern == SortPattern.AMOUNT_ASC.value:
-            query = query.order_by(Claim.amount_inr.asc())
-        elif sort_pattern == SortPattern.AMOUNT_DESC.value:
-            query = query.order_by(Claim.amount_inr.desc())
-        elif sort_pattern == SortPattern.RECOMMENDED.value and recommended_amount > 0:
-            # Calculate absolute difference from recommended amount
-            # Use case to handle recommended amount being closer to claim amount
-            difference = func.abs(cast(Claim.amount_inr, Float) - recommended_amount)
-            query = query.order_by(difference.asc())
-
-        # Execute query
-        claims = query.all()
-
-        # Get unique bank names from active claims
-        bank_names = db.session.query(
-            Claim.bank_name
-        ).filter(
-            Claim.is_active == True,
-            Claim.status == 'AVAILABLE'
-        ).distinct().all()
-
-        banks = ["All"]
-        banks.extend([name[0] for name in bank_names])
+        claims, total, banks, etag = _available_claims_page(request.args)
+        if request.if_none_match.contains(etag):
+            return '', 304
 
-        return jsonify({
+        response = jsonify({
             'claims': [{
-                'id': claim.id,
-                'bank_name': claim.bank_name,
-                'account_number': claim.account_number,  # Mask account number
-                'ifsc_code': claim.ifsc_code,
-                'account_holder': claim.account_holder,
-                'amount_inr': claim.amount_inr,
-                'status': claim.status,
-                'created_at': claim.created_at.isoformat()
+                'id': claim['id'],
+                'bank_name': claim['bank_name'],
+                'account_number': claim['account_number'],  # Mask account number
+                'ifsc_code': claim['ifsc_code'],
+                'account_holder': claim['account_holder'],
+                'amount_inr': claim['amount_inr'],
+                'status': claim['status'],
+                'created_at': claim['created_at']
             } for claim in claims],
+            'total': total,
             'bank_names': banks,
             'sort_options': ["3", "2", "1"],  # 1 (Amount Asc), 2 (Amount Desc), 3 (Recommended)
             'sort_names': ["Recommended", "Amount Desc", "Amount Asc"]
-        }), 200
+        })
+        response.set_etag(etag)
+        return response, 200
 
     except ValueError:
-        traceback.print_exc()
         return jsonify({'error': 'Invalid sort pattern or amount'}), 400
     except Exception as e:
-        current_app.logger.error(f"Get claims error: {str(e)}")
+        current_app.logger.error(f"Get claims error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch claims'}), 500
 
 
@@ -1257,6 +1419,9 @@ def get_claims(current_user):
     - sort: 1 (Amount ASC), 2 (Amount DESC), 3 (Recommended)
     - bank_name: string (optional)
     - amount_inr: float (optional, for recommended sorting)
+    - page, per_page: int (optional, all claims when per_page is absent)
+    Responds 304 when If-None-Match carries the current ETag; not while the user
+    has an active claim, as its expire_after counts down.
     """
     try:
         # First get active transactions (claims)
@@ -1266,9 +1431,19 @@ def get_claims(current_user):
             Transaction.status == TransactionStatus.PENDING
         ).all()
 
+        available_claims, total, banks, book_etag = _available_claims_page(request.args)
+        etag = None
+        if not active_transactions:
+            etag = f'{book_etag}-{zlib.crc32(repr(current_user.wallet_balance).encode()):08x}'
+            if request.if_none_match.contains(etag):
+                return '', 304
+
+        claim_ids = {transaction.claim_id for transaction in active_transactions if transaction.claim_id}
+        claims = {claim.id: claim for claim in Claim.query.filter(Claim.id.in_(claim_ids))} if claim_ids else {}
+
         active_claims = []
         for transaction in active_transactions:
-            claim = Claim.query.get(transaction.claim_id)
+            claim = claims.get(transaction.claim_id)
             if claim:
                 active_claims.append({
                     'id': transaction.id,
@@ -1292,65 +1467,31 @@ def get_claims(current_user):
                     }
                 })
 
-        # Then get available claims
-        sort_pattern = request.args.get('sort', SortPattern.RECOMMENDED.value)
-        bank_name = request.args.get('bank_name')
-        recommended_amount = float(request.args.get('amount_inr', 0))
-
-        # Base query for available claims
-        query = Claim.query.filter(
-            Claim.is_active == True,
-            Claim.status == 'AVAILABLE'
-        )
-
-        # Apply bank name filter if provided
-        if bank_name:
-            query = query.filter(Claim.bank_name == bank_name)
-
-        # Apply sorting
-        if sort_pattern == SortPattern.AMOUNT_ASC.value:
-            query = query.order_by(Claim.amount_inr.asc())
-        elif sort_pattern == SortPattern.AMOUNT_DESC.value:
-            query = query.order_by(Claim.amount_inr.desc())
-        elif sort_pattern == SortPattern.RECOMMENDED.value and recommended_amount > 0:
-            difference = func.abs(cast(Claim.amount_inr, Float) - recommended_amount)
-            query = query.order_by(difference.asc())
-
-        available_claims = query.all()
-
-        # Get unique bank names
-        bank_names = db.session.query(
-            Claim.bank_name
-        ).filter(
-            Claim.is_active == True,
-            Claim.status == 'AVAILABLE'
-        ).distinct().all()
-
-        banks = ["All"]
-        banks.extend([name[0] for name in bank_names])
-
-        return jsonify({
+        response = jsonify({
             'transactions': active_claims,
             'showActive': len(active_claims) > 0,
             'wallet_usdt': current_user.wallet_balance,
             'claims': [{
-                'id': claim.id,
-                'bank_name': claim.bank_name,
-                'account_number': claim.account_number,
-                'ifsc_code': claim.ifsc_code,
-                'account_name': claim.account_holder,
-                'amount_inr': claim.amount_inr,
-                'status': claim.status,
-                'created_at': claim.created_at.isoformat()
+                'id': claim['id'],
+                'bank_name': claim['bank_name'],
+                'account_number': claim['account_number'],
+                'ifsc_code': claim['ifsc_code'],
+                'account_name': claim['account_holder'],
+                'amount_inr': claim['amount_inr'],
+                'status': claim['status'],
+                'created_at': claim['created_at']
             } for claim in available_claims],
+            'total': total,
             'bank_names': banks,
             'sort_options': ["3", "2", "1"],
             'sort_names': ["Recommended", "Amount Desc", "Amount Asc"]
-        }), 200
+        })
+        if etag:
+            response.set_etag(etag)
+        return response, 200
 
     except ValueError as e:
         return jsonify({'error': 'Invalid parameters provided'}), 400
     except Exception as e:
-        current_app.logger.error(f"Get claims error: {str(e)}")
-        print(traceback.format_exc())
+        current_app.logger.error(f"Get claims error: {str(e)}", exc_info=True)
         return jsonify({'error': 'Failed to fetch claims'}), 500
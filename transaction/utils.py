@@ -13,8 +13,9 @@ from sqlalchemy import and_
 
 from werkzeug.utils import secure_filename
 
-from models import db
-from models.models import User, ReferralCommission, TransactionType, ReferralEarning, PaymentMode, ExchangeRate, Setting
+from services.search import search_transactions
+from services import telemetry
+from models.models import TransactionType, PaymentMode, ExchangeRate, Setting, Transaction, TransactionStatus
 
 
 class TransactionUtil:
@@ -97,6 +98,36 @@ class TransactionUtil:
                 raise
             raise ValueError(f'Error finding rate: {str(e)}')
 
+    @staticmethod
+    def apply_filters(query, args):
+        """
+        Apply the admin transaction list filters to a transaction query
+        Args:
+            query: query selecting from Transaction
+            args: request args with type, status, search, date_from and date_to
+
+        Raises:
+            ValueError: If a filter value is invalid
+        """
+        tx_type = args.get('type')
+        status = args.get('status')
+        search = args.get('search', '')  # Search by rupal_id or user mobile
+        date_from = args.get('date_from')
+        date_to = args.get('date_to')
+
+        if tx_type:
+            query = query.filter(Transaction.transaction_type == TransactionType(tx_type))
+        if status:
+            query = query.filter(Transaction.status == TransactionStatus(status))
+        if search:
+            query = search_transactions(query, search)
+        if date_from:
+            query = query.filter(Transaction.created_at >= datetime.strptime(date_from, '%Y-%m-%d'))
+        if date_to:
+            query = query.filter(Transaction.created_at < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+
+        return query
+
     @staticmethod
     def validate_tron_address(address):
         """Validate TRON address format"""
@@ -119,7 +150,9 @@ class TransactionUtil:
         """
         try:
             api_url = f"{current_app.config['TRON_API_URL']}/v1/transactions/{txn_hash}"
-            response = requests.get(api_url)
+            with telemetry.external_call('trongrid') as call:
+                response = requests.get(api_url)
+                call.status = response.status_code
 
             if not response.ok:
                 return False, "Unable to verify transaction", None
@@ -272,60 +305,41 @@ class TransactionUtil:
         })
 
     @staticmethod
-    def process_referral_commission(transaction):
-        """Process referral commission for transaction"""
-        try:
-            user = User.query.get(transaction.user_id)
-            if not user.referred_by:
-                return
-
-            current_level = 1
-            current_referrer_id = user.referred_by
+    def qr_file_path(address):
+        """Where the QR code image for an address is kept under the static folder"""
+        return os.path.join(current_app.static_folder, 'qrcodes', f"qr_{address}.png")
 
-            while (current_referrer_id and
-                   current_level <= current_app.config['MAX_REFERRAL_LEVELS']):
-
-                referrer = User.query.get(current_referrer_id)
-                if not referrer:
-                    break
-
-                # Get commission rate for current level
-                commission = ReferralCommission.query.filter_by(
-                    level=current_level,
-                    is_active=True
-                ).first()
-
-                if commission:
-                    if transaction.transaction_type == TransactionType.BUY:
-                        commission_percent = commission.buy_commission_percent
-                    else:  # SELL
-                        commission_percent = commission.sell_commission_percent
-
-                    commission_amount = (transaction.amount_usdt * commission_percent) / 100
-
-                    # Create commission earning record
-                    earning = ReferralEarning(
-                        user_id=referrer.id,
-                        transaction_id=transaction.id,
-                        referral_level=current_level,
-                        amount_usdt=commission_amount,
-                        commission_percent=commission_percent
-                    )
+    @staticmethod
+    def render_address_qr(address, file_path, size=300):
+        """
+        Render the QR code image for a USDT address to file_path.
+        Needs no app context, so it can run off the request thread
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
-                    # Update referrer's wallet balance
-                    referrer.wallet_balance += commission_amount
+        # Create QR code instance
+        qr = qrcode.QRCode(
+            version=1,
+            error_correction=qrcode.constants.ERROR_CORRECT_L,
+            box_size=10,
+            border=4,
+        )
 
-                    db.session.add(earning)
+        # Add USDT address data
+        qr_data = f"tron:{address}"
+        qr.add_data(qr_data)
+        qr.make(fit=True)
 
-                # Move to next level
-                current_level += 1
-                current_referrer_id = referrer.referred_by
+        # Create QR code image with logo
+        qr_image = qr.make_image(fill_color="black", back_color="white")
 
-            db.session.commit()
+        # Resize if needed
+        qr_image = qr_image.resize((size, size))
 
-        except Exception as e:
-            db.session.rollback()
-            current_app.logger.error(f"Commission processing error: {str(e)}")
+        # Save under a temporary name first, so a half-written image is never served
+        temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+        qr_image.save(temp_path, format='PNG')
+        os.replace(temp_path, file_path)
 
     @staticmethod
     def generate_address_qr(address, size=300):
@@ -334,44 +348,14 @@ class TransactionUtil:
         Returns URL path of saved QR image
         """
         try:
-            # Generate unique filename
             filename = f"qr_{address}.png"
+            file_path = TransactionUtil.qr_file_path(address)
 
-            # Create uploads directory if it doesn't exist
-            upload_dir = os.path.join(current_app.static_folder, 'qrcodes')
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)
-
-            domain = Setting.get_value('domain', "https://payon.website")
-            file_path = os.path.join(upload_dir, filename)
-
-            if os.path.exists(file_path):
-                qr_url = domain + url_for('static', filename=f'qrcodes/{filename}')
-                return qr_url
-
-            # Create QR code instance
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-
-            # Add USDT address data
-            qr_data = f"tron:{address}"
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-
-            # Create QR code image with logo
-            qr_image = qr.make_image(fill_color="black", back_color="white")
-
-            # Resize if needed
-            qr_image = qr_image.resize((size, size))
-
-            # Save image
-            qr_image.save(file_path)
+            if not os.path.exists(file_path):
+                TransactionUtil.render_address_qr(address, file_path, size)
 
             # Generate URL
+            domain = Setting.get_value('domain', "https://payon.website")
             qr_url = domain + url_for('static', filename=f'qrcodes/{filename}')
 
             return qr_url
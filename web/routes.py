@@ -1,6 +1,9 @@
-from flask import Blueprint, render_template
+import hmac
+
+from flask import Blueprint, abort, render_template, request, current_app, Response
 
 from models.models import Setting
+from services import telemetry
 
 web_bp = Blueprint('web', __name__)
 
@@ -13,3 +16,19 @@ def index():
                            login_url=Setting.get_value('web.login_url'),
                            signup_url=Setting.get_value('web.signup_url')
                            )
+
+
+@web_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus scrape endpoint; totals across all processes as of their last flush.
+    Scrapes must send METRICS_TOKEN as a bearer token; without one configured it
+    is only served in debug or testing.
+    """
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(404)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(telemetry.render(), mimetype='text/plain; version=0.0.4')
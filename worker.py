@@ -0,0 +1,56 @@
+"""
+Background worker: scheduled jobs and the database job queue.
+
+Runs the schedulers (deposit monitoring, claim expiry, metrics, referral
+reconciliation, balance snapshots) and job worker threads until stopped with
+SIGINT or SIGTERM, finishing the jobs already running first. Run two or more
+for failover: each scheduled job only runs in the process holding its lease,
+and a stopped process gives up its leases on exit. Web processes start neither
+unless RUN_SCHEDULERS / WEB_JOB_WORKERS are set.
+
+    python worker.py --threads 4
+    python worker.py --threads 8 --no-schedulers
+"""
+import argparse
+import signal
+import threading
+import time
+
+from app import create_app
+from config import Config
+from services.jobs import start_workers
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run scheduled jobs and background jobs from the job queue')
+    parser.add_argument('--threads', type=int, default=2, help='Jobs run at once by this process')
+    parser.add_argument('--no-schedulers', action='store_true', help='Only run jobs from the queue')
+    args = parser.parse_args()
+
+    class WorkerConfig(Config):
+        RUN_SCHEDULERS = not args.no_schedulers
+        WEB_JOB_WORKERS = 0
+
+    app = create_app(WorkerConfig)
+    workers = start_workers(app, args.threads, daemon=False)
+    app.logger.info(f"Worker started with {args.threads} job threads, "
+                    f"schedulers {'off' if args.no_schedulers else 'on'}")
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        app.logger.info('Worker stopping')
+        stopping.set()
+        for worker in workers:
+            worker.stop()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Sleeping rather than joining, so the signal handlers get to run
+    while not stopping.is_set() or any(worker.thread.is_alive() for worker in workers):
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    main()